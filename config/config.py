@@ -2,6 +2,9 @@
 GEOSPHERE_INCA_GRID_URL = "https://dataset.api.hub.geosphere.at/v1/grid/historical/inca-v1-1h-1km"
 GEOSPHERE_INCA_TS_URL = 'https://dataset.api.hub.geosphere.at/v1/timeseries/historical/inca-v1-1h-1km'
 
+# Maximum size of the local cache for INCA grid downloads (least recently used files are evicted)
+INCA_CACHE_MAX_SIZE_GB = 20
+
 # Project EPSG - every layer should be in this projection
 PROJECT_EPSG = "EPSG:31287"
 
@@ -0,0 +1,94 @@
+import time
+import argparse
+from functools import partial
+import numpy as np
+import pandas as pd
+from pytensor.graph.basic import io_toposort
+
+from src.modeling import bayesian_models
+from src.modeling.bayesian_models import BLR_CLASS_FEATURES
+from scripts import legacy_blr_builders
+
+COORDS = {
+    "elevation_classes": [0, 1, 2, 3, 4, 5],
+    "slope_classes": [0, 1, 2, 3, 4],
+    "aspect_classes": [0, 1, 2, 3, 4, 5, 6, 7],
+    "forest_type_classes": [0, 1, 2, 3, 4, 5, 6],
+    "population_classes": [0, 1, 2, 3, 4, 5],
+    "farmyard_density_classes": [0, 1],
+    "forestroad_density_classes": [0, 1],
+    "railway_density_classes": [0, 1],
+    "hikingtrail_density_classes": [0, 1],
+}
+
+
+def create_synthetic_data(n_obs: int, n_spatial_groups: int, n_temporal_groups: int, seed: int = 0) -> tuple:
+    """random training data with the columns and classes of the BLR models"""
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({column: rng.integers(0, len(COORDS[f"{name}_classes"]), n_obs)
+                      for column, name in BLR_CLASS_FEATURES})
+    X["ffmc"] = rng.normal(0, 1, n_obs)
+    X["spatial_group"] = rng.integers(0, n_spatial_groups, n_obs)
+    X["temporal_group"] = rng.integers(0, n_temporal_groups, n_obs)
+    y = pd.Series(rng.integers(0, 2, n_obs))
+    coords = {**COORDS, "spatial_groups": np.arange(n_spatial_groups), "temporal_groups": np.arange(n_temporal_groups)}
+    return X, y, coords
+
+
+def benchmark_model(model, n_evals: int) -> dict:
+    """build, compile and gradient evaluation times of a model"""
+
+    start = time.perf_counter()
+    dlogp = model.compile_dlogp()
+    compile_time = time.perf_counter() - start
+
+    point = model.initial_point()
+    dlogp(point)
+    start = time.perf_counter()
+    for _ in range(n_evals):
+        dlogp(point)
+    eval_time = time.perf_counter() - start
+    return {"compile_s": compile_time, "grad_evals_per_s": n_evals / eval_time}
+
+
+def count_graph_nodes(model) -> int:
+    """number of nodes of the (not optimized) gradient graph"""
+
+    return len(io_toposort(model.value_vars, [model.dlogp()]))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare logp gradient speed of the BLR model builders.')
+    parser.add_argument('--n_obs', type=int, default=10000, help='Number of synthetic training samples')
+    parser.add_argument('--n_evals', type=int, default=200, help='Number of gradient evaluations per model')
+    parser.add_argument('--n_spatial_groups', type=int, default=5)
+    parser.add_argument('--n_temporal_groups', type=int, default=4)
+    args = parser.parse_args()
+
+    X, y, coords = create_synthetic_data(args.n_obs, args.n_spatial_groups, args.n_temporal_groups)
+    grouping_variables = ("spatial_group", "temporal_group")
+
+    # the current (stacked) builders and the original builders with one lookup per feature build the same models
+    builders = {}
+    for prefix, module in [("", bayesian_models), ("legacy ", legacy_blr_builders)]:
+        builders.update({
+            f"{prefix}create_blr": partial(module.create_blr, X, y, coords),
+            f"{prefix}create_st_intercept_blr": partial(module.create_st_intercept_blr, X, y, coords,
+                                                        *grouping_variables),
+            f"{prefix}create_st_blr": partial(module.create_st_blr, X, y, coords, *grouping_variables),
+            f"{prefix}create_st_blr(non_centered)": partial(module.create_st_blr, X, y, coords, *grouping_variables,
+                                                            parameterization="non_centered"),
+        })
+
+    results = []
+    for name, build in builders.items():
+        start = time.perf_counter()
+        model = build()
+        build_time = time.perf_counter() - start
+        result = benchmark_model(model, args.n_evals)
+        results.append({"builder": name, "build_s": build_time, "graph_nodes": count_graph_nodes(model),
+                        "compile_s": result["compile_s"], "grad_evals_per_s": result["grad_evals_per_s"]})
+
+    print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
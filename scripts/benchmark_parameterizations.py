@@ -0,0 +1,58 @@
+import time
+import argparse
+import pandas as pd
+import pymc as pm
+import arviz as az
+
+from src.modeling.bayesian_models import create_st_blr, create_st_intercept_blr
+from scripts.benchmark_model_builders import create_synthetic_data
+
+BUILDERS = {"create_st_blr": create_st_blr, "create_st_intercept_blr": create_st_intercept_blr}
+
+
+def benchmark_sampling(model, draws: int, tune: int, chains: int, random_seed: int = 0) -> dict:
+    """wall time, divergences and effective sample size per second of NUTS"""
+
+    start = time.perf_counter()
+    with model:
+        idata = pm.sample(draws=draws, tune=tune, chains=chains, cores=1, random_seed=random_seed,
+                          progressbar=False, compute_convergence_checks=False)
+    sampling_time = time.perf_counter() - start
+
+    # the free variables differ between the parameterizations, the deterministics don't
+    var_names = [rv.name for rv in model.free_RVs if not rv.name.endswith(("_offset", "_precision"))]
+    ess = az.ess(idata, var_names=var_names + [var.name for var in model.deterministics], method="bulk")
+    min_ess = min(float(ess[name].min()) for name in ess.data_vars)
+    return {
+        "sampling_s": sampling_time,
+        "divergences": int(idata.sample_stats["diverging"].sum()),
+        "min_ess_bulk": min_ess,
+        "min_ess_per_s": min_ess / sampling_time,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare NUTS efficiency of centered and non-centered group coefficients.')
+    parser.add_argument('--builder', type=str, default="create_st_blr", choices=list(BUILDERS))
+    parser.add_argument('--n_obs', type=int, default=2000, help='Number of synthetic training samples')
+    parser.add_argument('--n_spatial_groups', type=int, default=5)
+    parser.add_argument('--n_temporal_groups', type=int, default=4)
+    parser.add_argument('--draws', type=int, default=500)
+    parser.add_argument('--tune', type=int, default=500)
+    parser.add_argument('--chains', type=int, default=2)
+    parser.add_argument('--distributions', type=str, nargs="+", default=["cauchy", "student_t", "normal"])
+    args = parser.parse_args()
+
+    X, y, coords = create_synthetic_data(args.n_obs, args.n_spatial_groups, args.n_temporal_groups)
+    build = BUILDERS[args.builder]
+
+    results = []
+    for distribution in args.distributions:
+        for parameterization in ("centered", "non_centered"):
+            model = build(X, y, coords, "spatial_group", "temporal_group",
+                          parameterization=parameterization, distribution=distribution)
+            result = benchmark_sampling(model, args.draws, args.tune, args.chains)
+            results.append({"distribution": distribution, "parameterization": parameterization, **result})
+
+    print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
@@ -0,0 +1,38 @@
+import argparse
+import pandas as pd
+
+from src.modeling.bayesian_models import create_blr, create_st_blr
+from src.modeling.training import SAMPLER_BACKENDS, check_backend, fit
+from scripts.benchmark_model_builders import create_synthetic_data
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compare wall time and ESS/sec of the sampler backends.')
+    parser.add_argument('--builder', type=str, default="create_blr",
+                        choices=["create_blr", "create_st_blr"])
+    parser.add_argument('--backends', type=str, nargs="+", default=list(SAMPLER_BACKENDS))
+    parser.add_argument('--n_obs', type=int, default=5000, help='Number of synthetic training samples')
+    parser.add_argument('--draws', type=int, default=1000)
+    parser.add_argument('--tune', type=int, default=1000)
+    parser.add_argument('--chains', type=int, default=4)
+    args = parser.parse_args()
+
+    X, y, coords = create_synthetic_data(args.n_obs, n_spatial_groups=5, n_temporal_groups=4)
+    builders = {
+        "create_blr": lambda: create_blr(X, y, coords),
+        "create_st_blr": lambda: create_st_blr(X, y, coords, "spatial_group", "temporal_group"),
+    }
+
+    results = []
+    for backend in args.backends:
+        try:
+            check_backend(backend)
+        except ImportError as error:
+            print(f"Skipping {backend}: {error}")
+            continue
+        idata = fit(builders[args.builder](), backend, draws=args.draws, tune=args.tune, chains=args.chains,
+                    random_seed=0)
+        results.append({key: idata.attrs[key] for key in ("backend", "sampling_time", "min_ess_bulk", "ess_per_second")})
+
+    print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
@@ -0,0 +1,56 @@
+"""
+Writes all static feature layers and the daily FFMC layers into one chunked NetCDF datacube
+aligned to the reference grid (see src.data_preprocessing.feature_datacube).
+"""
+
+import os
+import glob
+import argparse
+
+from config.config import BASE_PATH, PATH_TO_PATH_CONFIG_FILE
+from src.data_preprocessing.feature_datacube import write_feature_datacube
+from src.utils import load_paths_from_yaml, replace_base_path
+
+
+def find_ffmc_layers(path_prefix: str) -> dict:
+    """date (YYYY-MM-DD) -> path of the daily ffmc layers <path_prefix>_YYYYMMDD.tif"""
+
+    ffmc_layers = {}
+    for path in sorted(glob.glob(f"{path_prefix}_*.tif")):
+        date_str = os.path.splitext(os.path.basename(path))[0].rsplit("_", 1)[-1]
+        if len(date_str) == 8 and date_str.isdigit():
+            ffmc_layers[f"{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}"] = path
+    return ffmc_layers
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Create the chunked feature datacube of all static and FFMC layers.')
+    parser.add_argument('--chunk_size', type=int, default=256, help='Edge length of the chunks (in cells)')
+    parser.add_argument('--without_ffmc', action='store_true', help='Only write the static layers')
+    args = parser.parse_args()
+
+    paths = load_paths_from_yaml(PATH_TO_PATH_CONFIG_FILE)
+    paths = replace_base_path(paths, BASE_PATH)
+
+    static_layers = [
+        ("ref_grid_id", paths["reference_grid"]["raster"]),
+        ("population_density_2006", paths["population_layers"]["2006"]["final"]),
+        ("population_density_2011", paths["population_layers"]["2011"]["final"]),
+        ("population_density_2018", paths["population_layers"]["2018"]["final"]),
+        ("population_density_2021", paths["population_layers"]["2021"]["final"]),
+        ("farmyard_density", paths["farmyard_density"]["final"]),
+        ("hikingtrail_density", paths["roads"]["hikingtrails"]["final"]),
+        ("forestroad_density", paths["roads"]["forestroads"]["final"]),
+        ("railway_density", paths["railways"]["final"]),
+        ("elevation", paths["topographical_layers"]["elevation"]["final"]),
+        ("slope", paths["topographical_layers"]["slope"]["final"]),
+        ("aspect", paths["topographical_layers"]["aspect"]["final"]),
+        ("forest_type", paths["forest_type"]["final"]),
+        ("canopy_cover", paths["canopy_cover"]["final"]),
+    ]
+    ffmc_layers = None if args.without_ffmc else find_ffmc_layers(paths["ffmc"]["final"])
+
+    os.makedirs(os.path.dirname(paths["feature_datacube"]), exist_ok=True)
+    write_feature_datacube(paths["feature_datacube"], static_layers, paths["reference_grid"]["raster"],
+                           ffmc_layers, chunk_size=args.chunk_size)
@@ -3,13 +3,15 @@ from typing import List
 import argparse
 import netCDF4 as nc
 import numpy as np
+import pandas as pd
 import rasterio
 
-from config.config import BASE_PATH, PATH_TO_PATH_CONFIG_FILE, BBOX_AUSTRIA
+from config.config import BASE_PATH, PATH_TO_PATH_CONFIG_FILE, BBOX_AUSTRIA, INCA_CACHE_MAX_SIZE_GB
 from src.utils import load_paths_from_yaml, replace_base_path
 from src.gdal_wrapper import gdal_align_and_resample, gdal_create_geotiff_from_nc
-from src.data_collection.inca_data_extraction import get_geosphere_data_grid
-from src.data_preprocessing.inca_data_preprocessing import calculate_wind_speed, calculate_ffmc, calculate_date_of_interest_x_hours_before
+from src.data_collection.inca_data_extraction import get_geosphere_data_grid, get_geosphere_data_grid_chunked
+from src.data_collection.inca_cache import IncaGridCache, get_netcdf_times
+from src.data_preprocessing.inca_data_preprocessing import calculate_wind_speed, calculate_ffmc_array, calculate_hourly_ffmc_array, calculate_date_of_interest_x_hours_before
 
 RESAMPLE_ALGORITHM = "Nearest Neighbor"
 FFMC_INITIAL_VALUE = 85
@@ -22,22 +24,38 @@ def bbox_to_str(bbox: List[float]) -> str:
     return ",".join(map(str, bbox))
 
 
+def get_time_window(nc_dataset: nc.Dataset, start_date: str, end_date: str) -> slice:
+    """Returns slice of time indices of an INCA NetCDF file that lie between start_date and end_date (both included)"""
+    times = get_netcdf_times(nc_dataset)
+    indices = np.flatnonzero((times >= pd.to_datetime(start_date)) & (times <= pd.to_datetime(end_date)))
+    if len(indices) == 0:
+        raise ValueError(f"No time steps between {start_date} and {end_date} in {nc_dataset.filepath()}")
+    return slice(indices[0], indices[-1] + 1)
+
+
+def extract_inca_parameters(nc_rainfall: nc.Dataset, nc_inca_param: nc.Dataset,
+                            rainfall_window: slice = slice(None), parameter_index: int = 0) -> tuple:
+    """Extracts rainfall sum over the time window and humidity, temperature and wind speed at parameter_index"""
+    rainfall_data = nc_rainfall.variables["RR"][rainfall_window].sum(axis=0)
+    uu_data = nc_inca_param.variables["UU"][parameter_index]
+    vv_data = nc_inca_param.variables["VV"][parameter_index]
+    t2m_data = nc_inca_param.variables["T2M"][parameter_index]
+    rh2m_data = nc_inca_param.variables["RH2M"][parameter_index]
+    wind_speed_data = calculate_wind_speed(uu_data, vv_data)
+    return rainfall_data, rh2m_data, t2m_data, wind_speed_data
+
+
 def calculate_ffmc_from_inca_parameters(path_to_rainfall_nc: str, path_to_other_parameters_nc: str,
                                         ffmc_0: np.array = None) -> tuple:
     """Extracts arrays from INCA NetCDF files"""
     with nc.Dataset(path_to_rainfall_nc, 'r') as nc_rainfall, nc.Dataset(path_to_other_parameters_nc, 'r') as nc_inca_param:
-        rainfall_data = nc_rainfall.variables["RR"][:].sum(axis=0)
-        uu_data = nc_inca_param.variables["UU"][:][0]
-        vv_data = nc_inca_param.variables["VV"][:][0]
-        t2m_data = nc_inca_param.variables["T2M"][:][0]
-        rh2m_data = nc_inca_param.variables["RH2M"][:][0]
-        wind_speed_data = calculate_wind_speed(uu_data, vv_data)
+        rainfall_data, rh2m_data, t2m_data, wind_speed_data = extract_inca_parameters(
+            nc_rainfall, nc_inca_param)
 
         if ffmc_0 is None:
             ffmc_0 = np.full(wind_speed_data.shape, FFMC_INITIAL_VALUE)
 
-        calculate_ffmc_vectorized = np.vectorize(calculate_ffmc)
-        ffmc_data = calculate_ffmc_vectorized(
+        ffmc_data = calculate_ffmc_array(
             ffmc_0, rh2m_data, t2m_data, rainfall_data, wind_speed_data)
 
         lon = nc_inca_param.variables['lon'][:]
@@ -46,6 +64,80 @@ def calculate_ffmc_from_inca_parameters(path_to_rainfall_nc: str, path_to_other_
         return ffmc_data, lon, lat
 
 
+def iterate_hourly_ffmc(nc_rainfall: nc.Dataset, nc_inca_param: nc.Dataset, start_date: str, end_date: str,
+                        ffmc_0: np.array = None):
+    """Yields time and hourly ffmc for every hour after start_date up to end_date (included)
+
+    Only one time slice of the INCA NetCDF files is read per hour, so memory does not grow with the
+    length of the time window. ffmc_0 is the ffmc at start_date (FFMC_INITIAL_VALUE if None).
+    """
+    rainfall_times = get_netcdf_times(nc_rainfall)
+    parameter_window = get_time_window(nc_inca_param, start_date, end_date)
+    parameter_times = get_netcdf_times(nc_inca_param)
+
+    ffmc = ffmc_0
+    for parameter_index in range(parameter_window.start + 1, parameter_window.stop):
+        time = parameter_times[parameter_index]
+        rainfall_index = rainfall_times.get_loc(time)
+
+        rainfall_data, rh2m_data, t2m_data, wind_speed_data = extract_inca_parameters(
+            nc_rainfall, nc_inca_param, slice(rainfall_index, rainfall_index + 1), parameter_index)
+
+        if ffmc is None:
+            ffmc = np.full(wind_speed_data.shape, FFMC_INITIAL_VALUE)
+
+        ffmc = calculate_hourly_ffmc_array(
+            ffmc, rh2m_data, t2m_data, rainfall_data, wind_speed_data)
+        yield time, ffmc
+
+
+def calculate_hourly_ffmc_cube(path_to_rainfall_nc: str, path_to_other_parameters_nc: str, path_to_output_nc: str,
+                               start_date: str, end_date: str, ffmc_0: np.array = None,
+                               daily_output_hour: int = None) -> np.array:
+    """Streams hourly ffmc into a NetCDF cube (time, y, x) and returns the ffmc at end_date
+
+    Args:
+        path_to_rainfall_nc (str): NetCDF with hourly RR
+        path_to_other_parameters_nc (str): NetCDF with hourly T2M, UU, VV and RH2M
+        path_to_output_nc (str): path of the NetCDF file the ffmc cube is written to
+        start_date (str): start of time window in format 'YYYY-MM-DDTHH:MM' (time of ffmc_0)
+        end_date (str): end of time window in format 'YYYY-MM-DDTHH:MM'
+        ffmc_0 (np.array, optional): ffmc at start_date. Defaults to FFMC_INITIAL_VALUE.
+        daily_output_hour (int, optional): if given, only the ffmc at this hour of each day is written
+            (e.g. 23 for an end-of-day cube). Defaults to None (all hours are written).
+
+    Returns:
+        np.array: ffmc at end_date
+    """
+
+    with nc.Dataset(path_to_rainfall_nc, 'r') as nc_rainfall, \
+            nc.Dataset(path_to_other_parameters_nc, 'r') as nc_inca_param, \
+            nc.Dataset(path_to_output_nc, 'w') as nc_out:
+
+        lon = nc_inca_param.variables['lon'][:]
+        lat = nc_inca_param.variables['lat'][:]
+
+        nc_out.createDimension("time", None)
+        nc_out.createDimension("y", lat.shape[0])
+        nc_out.createDimension("x", lat.shape[1])
+        nc_out.createVariable("lat", "f8", ("y", "x"))[:] = lat
+        nc_out.createVariable("lon", "f8", ("y", "x"))[:] = lon
+        time_var = nc_out.createVariable("time", "i8", ("time",))
+        time_var.units = "seconds since 1970-01-01 00:00:00"
+        ffmc_var = nc_out.createVariable("FFMC", "f4", ("time", "y", "x"), zlib=True,
+                                         chunksizes=(1, lat.shape[0], lat.shape[1]), fill_value=np.nan)
+
+        ffmc = ffmc_0
+        output_index = 0
+        for time, ffmc in iterate_hourly_ffmc(nc_rainfall, nc_inca_param, start_date, end_date, ffmc_0):
+            if daily_output_hour is None or time.hour == daily_output_hour:
+                ffmc_var[output_index] = ffmc
+                time_var[output_index] = nc.date2num(time.to_pydatetime(), time_var.units)
+                output_index += 1
+
+    return ffmc
+
+
 def create_ffmc_layer_paths(paths: dict, date_str_for_file_name: str) -> tuple:
     """Creates paths to intermediate and final FFMC layers"""
     path_to_intermediate_ffmc_layer = paths["ffmc"]["intermediate"] + \
@@ -79,21 +171,32 @@ def load_ffmc_layer(paths: dict, date: str, intermediate: bool) -> np.array:
             return src.read(1)
 
 
-def create_ffmc_layer(paths: dict, date_of_interest: str, bbox: List[float]) -> None:
+def write_ffmc_layers(paths: dict, ffmc_arr: np.array, lon_arr: np.array, lat_arr: np.array,
+                      date_str_for_file_name: str) -> None:
+    """Writes intermediate FFMC layer (INCA grid) and final FFMC layer (aligned with reference grid)"""
+
+    path_to_intermediate_ffmc_layer, path_to_ffmc_layer = create_ffmc_layer_paths(paths,
+                                                                                  date_str_for_file_name)
+
+    gdal_create_geotiff_from_nc(
+        ffmc_arr, lon_arr, lat_arr, path_to_intermediate_ffmc_layer)
+
+    gdal_align_and_resample(path_to_intermediate_ffmc_layer, path_to_ffmc_layer,
+                            paths["reference_grid"]["raster"], RESAMPLE_ALGORITHM, 0)
+
+
+def create_ffmc_layer(paths: dict, date_of_interest: str, bbox: List[float], cache: IncaGridCache = None) -> None:
     """Creates FFMC layer aligned with reference grid"""
 
     date_of_interest_24h_before = calculate_date_of_interest_x_hours_before(
         date_of_interest, 24)
     date_str_for_file_name = date_of_interest.split("T")[0].replace("-", "")
 
-    path_to_intermediate_ffmc_layer, path_to_ffmc_layer = create_ffmc_layer_paths(paths,
-                                                                                  date_str_for_file_name)
-
     # TODO maybe change paths here
     path_to_rain_netcdf = get_geosphere_data_grid(
-        PARAMETER_RAINFALL, date_of_interest_24h_before, date_of_interest, bbox_to_str(bbox), paths["ffmc"]["source"])
+        PARAMETER_RAINFALL, date_of_interest_24h_before, date_of_interest, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
     path_to_inca_other_netcdf = get_geosphere_data_grid(
-        PARAMETERS_OTHER, date_of_interest_24h_before, date_of_interest, bbox_to_str(bbox), paths["ffmc"]["source"])
+        PARAMETERS_OTHER, date_of_interest_24h_before, date_of_interest, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
 
     # we need intermediate ffmc layer from previous day to calculate ffmc layer of current day
     ffmc_prev_intermediate = load_ffmc_layer(
@@ -102,17 +205,107 @@ def create_ffmc_layer(paths: dict, date_of_interest: str, bbox: List[float]) ->
     ffmc_arr, lon_arr, lat_arr = calculate_ffmc_from_inca_parameters(
         path_to_rain_netcdf, path_to_inca_other_netcdf, ffmc_prev_intermediate)
 
-    gdal_create_geotiff_from_nc(
-        ffmc_arr, lon_arr, lat_arr, path_to_intermediate_ffmc_layer)
+    write_ffmc_layers(paths, ffmc_arr, lon_arr, lat_arr, date_str_for_file_name)
 
-    gdal_align_and_resample(path_to_intermediate_ffmc_layer, path_to_ffmc_layer,
-                            paths["reference_grid"]["raster"], RESAMPLE_ALGORITHM, 0)
+
+def create_ffmc_layers_for_season(paths: dict, start_date: str, end_date: str, bbox: List[float],
+                                  path_to_rain_netcdf: str = None, path_to_inca_other_netcdf: str = None,
+                                  cache: IncaGridCache = None) -> None:
+    """Creates daily FFMC layers for every day between start_date and end_date (both included)
+
+    INCA data of the whole season is downloaded once (or read from the given NetCDF files) and the
+    FFMC of the previous day is kept in memory instead of being reloaded from the intermediate layer.
+
+    Args:
+        paths (dict): dictionary of all project paths
+        start_date (str): first date of interest in format 'YYYY-MM-DDTHH:MM'
+        end_date (str): last date of interest in format 'YYYY-MM-DDTHH:MM' (same time of day as start_date)
+        bbox (List[float]): bounding box of INCA data
+        path_to_rain_netcdf (str, optional): NetCDF with hourly RR covering the season (incl. 24h before start_date)
+        path_to_inca_other_netcdf (str, optional): NetCDF with hourly T2M, UU, VV and RH2M covering the season
+        cache (IncaGridCache, optional): cache for INCA downloads
+    """
+
+    season_start_24h_before = calculate_date_of_interest_x_hours_before(
+        start_date, 24)
+
+    if path_to_rain_netcdf is None:
+        path_to_rain_netcdf = get_geosphere_data_grid_chunked(
+            PARAMETER_RAINFALL, season_start_24h_before, end_date, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
+    if path_to_inca_other_netcdf is None:
+        path_to_inca_other_netcdf = get_geosphere_data_grid_chunked(
+            PARAMETERS_OTHER, season_start_24h_before, end_date, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
+
+    # only the first day of the season needs the intermediate ffmc layer of the previous day
+    ffmc_state = load_ffmc_layer(
+        paths, season_start_24h_before, intermediate=True)
+
+    with nc.Dataset(path_to_rain_netcdf, 'r') as nc_rainfall, nc.Dataset(path_to_inca_other_netcdf, 'r') as nc_inca_param:
+        lon_arr = nc_inca_param.variables['lon'][:]
+        lat_arr = nc_inca_param.variables['lat'][:]
+
+        for date in pd.date_range(start_date, end_date, freq="D"):
+            date_of_interest = date.strftime('%Y-%m-%dT%H:%M')
+            date_of_interest_24h_before = calculate_date_of_interest_x_hours_before(
+                date_of_interest, 24)
+
+            rainfall_window = get_time_window(
+                nc_rainfall, date_of_interest_24h_before, date_of_interest)
+            parameter_window = get_time_window(
+                nc_inca_param, date_of_interest_24h_before, date_of_interest)
+
+            rainfall_data, rh2m_data, t2m_data, wind_speed_data = extract_inca_parameters(
+                nc_rainfall, nc_inca_param, rainfall_window, parameter_window.start)
+
+            if ffmc_state is None:
+                ffmc_state = np.full(wind_speed_data.shape, FFMC_INITIAL_VALUE)
+
+            ffmc_state = calculate_ffmc_array(
+                ffmc_state, rh2m_data, t2m_data, rainfall_data, wind_speed_data)
+
+            write_ffmc_layers(paths, ffmc_state, lon_arr, lat_arr,
+                              date.strftime('%Y%m%d'))
+
+
+def create_hourly_ffmc_layer(paths: dict, start_date: str, end_date: str, bbox: List[float],
+                             path_to_rain_netcdf: str = None, path_to_inca_other_netcdf: str = None,
+                             daily_output_hour: int = None, cache: IncaGridCache = None) -> None:
+    """Creates hourly (or end-of-day) FFMC cube as NetCDF for the time window between start_date and end_date"""
+
+    if path_to_rain_netcdf is None:
+        path_to_rain_netcdf = get_geosphere_data_grid_chunked(
+            PARAMETER_RAINFALL, start_date, end_date, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
+    if path_to_inca_other_netcdf is None:
+        path_to_inca_other_netcdf = get_geosphere_data_grid_chunked(
+            PARAMETERS_OTHER, start_date, end_date, bbox_to_str(bbox), paths["ffmc"]["source"], cache=cache)
+
+    # hourly ffmc is started from the daily intermediate ffmc layer at start_date if it exists
+    ffmc_0 = load_ffmc_layer(paths, start_date, intermediate=True)
+
+    date_range_str = "_".join(date.replace(":", "").replace("-", "")
+                              for date in (start_date, end_date))
+    path_to_hourly_ffmc_cube = paths["ffmc"]["hourly"] + f"_{date_range_str}.nc"
+
+    calculate_hourly_ffmc_cube(path_to_rain_netcdf, path_to_inca_other_netcdf, path_to_hourly_ffmc_cube,
+                               start_date, end_date, ffmc_0, daily_output_hour)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Process FFMC data.')
     parser.add_argument('date_of_interest', type=str,
                         help='Date of interest in format "YYYY-MM-DDTHH:MM"')
+    parser.add_argument('--end_date', type=str, default=None,
+                        help='If given, FFMC layers are created for every day from date_of_interest to end_date (format "YYYY-MM-DDTHH:MM")')
+    parser.add_argument('--rain_nc', type=str, default=None,
+                        help='Season and hourly mode only: existing NetCDF with hourly RR instead of downloading it')
+    parser.add_argument('--other_nc', type=str, default=None,
+                        help='Season and hourly mode only: existing NetCDF with hourly T2M, UU, VV and RH2M instead of downloading it')
+    parser.add_argument('--hourly', action='store_true',
+                        help='Create hourly FFMC cube (NetCDF) instead of daily layers. Without --end_date the 24h before date_of_interest are used')
+    parser.add_argument('--daily_output_hour', type=int, default=None,
+                        help='Hourly mode only: write only the FFMC at this hour of each day (e.g. 23 for end-of-day FFMC)')
+    parser.add_argument('--offline', action='store_true',
+                        help='Only use INCA data from the local cache, never download')
 
     args = parser.parse_args()
 
@@ -121,7 +314,21 @@ def main():
     paths = load_paths_from_yaml(PATH_TO_PATH_CONFIG_FILE)
     paths = replace_base_path(paths, BASE_PATH)
 
-    create_ffmc_layer(paths, date_of_interest, BBOX_AUSTRIA)
+    cache = IncaGridCache(paths["inca_cache"], int(INCA_CACHE_MAX_SIZE_GB * 1e9), offline=args.offline)
+
+    if args.hourly:
+        if args.end_date is None:
+            start_date = calculate_date_of_interest_x_hours_before(date_of_interest, 24)
+            end_date = date_of_interest
+        else:
+            start_date, end_date = date_of_interest, args.end_date
+        create_hourly_ffmc_layer(paths, start_date, end_date, BBOX_AUSTRIA,
+                                 args.rain_nc, args.other_nc, args.daily_output_hour, cache)
+    elif args.end_date is None:
+        create_ffmc_layer(paths, date_of_interest, BBOX_AUSTRIA, cache)
+    else:
+        create_ffmc_layers_for_season(paths, date_of_interest, args.end_date, BBOX_AUSTRIA,
+                                      args.rain_nc, args.other_nc, cache)
 
 
 if __name__ == "__main__":
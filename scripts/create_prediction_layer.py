@@ -1,37 +1,46 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-import cloudpickle
 import joblib
 import rasterio
 from rasterio.features import geometry_mask
+from rasterio.windows import Window
 from shapely.geometry import shape
 
 from config.config import BASE_PATH, PATH_TO_PATH_CONFIG_FILE
+from src.data_preprocessing.feature_datacube import FeatureDatacube
 from src.utils import load_paths_from_yaml, replace_base_path
-from src.modeling.encodings import convert_aspect_to_cardinal_direction
-from src.modeling.predictions import BinaryClassification
-
-
-def load_pymc_model(path_to_model: str):
-    """loads pymc model and trace"""
-
-    with open(path_to_model, 'rb') as buff:
-        model_dict = cloudpickle.load(buff)
-    idata = model_dict['idata']
-    model = model_dict['model']
-    return model, idata
-
-
-def load_static_layers_into_df(feature_layers: list) -> pd.DataFrame:
-    """loading all feature layers and saving as dataframe 
-    using the names stored in each tuple as column names"""
+from src.modeling.bayesian_models import BLR_CLASS_FEATURES
+from src.modeling.encodings import (
+    convert_aspect_to_cardinal_direction_array,
+    convert_elevation_to_classes_array,
+    convert_population_to_classes_array,
+    convert_slope_to_classes_array,
+    map_to_binary_array,
+)
+from src.modeling.predictions import BLRPosteriorPredictor, PatternPredictionCache
+from src.modeling.utils import load_idata
+
+
+def load_static_layers_into_df(feature_layers: list, window: Window = None,
+                               datacube: FeatureDatacube = None) -> pd.DataFrame:
+    """loading all feature layers (or a window of them) and saving as dataframe 
+    using the names stored in each tuple as column names
+
+    With a datacube, the tuples hold the variable names of the datacube instead of paths."""
+
+    if datacube is not None:
+        window = window or Window(0, 0, datacube.shape[1], datacube.shape[0])
+        features_df = datacube.read_window_df(window, [variable for _, variable in feature_layers])
+        return features_df.set_axis([name for name, _ in feature_layers], axis=1)
 
     data = {}
     for name, path in feature_layers:
         with rasterio.open(path) as src:
-            print(name)
-            data[name] = src.read(1).flatten()
+            data[name] = src.read(1, window=window).flatten()
     return pd.DataFrame(data)
 
 
@@ -46,21 +55,29 @@ def add_ffmc_layer(features_df: pd.DataFrame, static_value=None) -> pd.DataFrame
 def preprocess_data(path_to_preprocessor: str, features_df: pd.DataFrame):
     """apply preprocessing steps as done in model training"""
 
-    features_df["aspect_encoded"] = features_df["aspect"].apply(
-        convert_aspect_to_cardinal_direction)
-    features_df["forest_type"] = features_df["forest_type"].astype(int)
+    return transform_features(joblib.load(path_to_preprocessor), features_df)
+
 
-    training_order_columns = ['ffmc', 'farmyard_density', 'hikingtrail_density', 'forestroad_density',
-                              'railway_density', 'elevation', 'slope', 'population_density']
-    features_df_reordered = features_df[training_order_columns]
+def transform_features(preprocessor, features_df: pd.DataFrame) -> pd.DataFrame:
+    """encode the features into the classes of the BLR training data and scale ffmc with the fitted preprocessor
 
-    preprocessor = joblib.load(path_to_preprocessor)
-    features_transformed = preprocessor.transform(features_df_reordered)
+    Returns:
+        pd.DataFrame: class index columns of BLR_CLASS_FEATURES and the scaled ffmc
+    """
 
-    features_transformed_df = pd.DataFrame(
-        features_transformed, columns=training_order_columns)
-    features_transformed_df["forest_type"] = features_df["forest_type"].values
-    features_transformed_df["aspect_encoded"] = features_df["aspect_encoded"].values
+    features_transformed_df = pd.DataFrame({
+        "elevation_encoded": convert_elevation_to_classes_array(features_df["elevation"].values),
+        "slope_encoded": convert_slope_to_classes_array(features_df["slope"].values),
+        "aspect_encoded": convert_aspect_to_cardinal_direction_array(features_df["aspect"].values),
+        "forestroad_density_bin": map_to_binary_array(features_df["forestroad_density"].values),
+        "railway_density_bin": map_to_binary_array(features_df["railway_density"].values),
+        "hikingtrail_density_bin": map_to_binary_array(features_df["hikingtrail_density"].values),
+        "farmyard_density_bin": map_to_binary_array(features_df["farmyard_density"].values),
+        "population_encoded": convert_population_to_classes_array(features_df["population_density"].values),
+        "forest_type": features_df["forest_type"].values.astype(int),
+    })
+    # the preprocessor of the BLR models only scales ffmc
+    features_transformed_df["ffmc"] = np.asarray(preprocessor.transform(features_df[["ffmc"]]))[:, 0]
 
     return features_transformed_df
 
@@ -83,58 +100,166 @@ def extract_ref_grid_ids_from_nuts_unit(path_to_nuts_data: str, path_to_ref_grid
 def make_predictions(path_to_model: str, X_new: pd.DataFrame) -> pd.DataFrame:
     """use bayesian model to make predictions"""
 
-    y_dummy = [0 for i in range(len(X_new))]
-    X_new_blr = {
-        "elevation": X_new.elevation,
-        "slope": X_new.slope,
-        "aspect": X_new.aspect_encoded,
-        "forestroad_density": X_new.forestroad_density,
-        "railway_density": X_new.railway_density,
-        "hikingtrail_density": X_new.hikingtrail_density,
-        "farmyard_density": X_new.farmyard_density,
-        "population": X_new.population_density,
-        "forest_type": X_new.forest_type,
-        "ffmc": X_new.ffmc,
-        "fire": y_dummy
-    }
-
-    model, idata = load_pymc_model(path_to_model)
-    blr_prediction_obj = BinaryClassification(
-        model, idata, X_new_blr, 0, "y_pred", "p")
-    blr_prediction_obj.extend_trace()
-    preds = blr_prediction_obj.predict()
+    idata = load_idata(path_to_model)
+    return predict_with_predictor(BLRPosteriorPredictor(idata, {}), X_new)
+
+
+def predict_with_predictor(predictor: BLRPosteriorPredictor, X_new: pd.DataFrame,
+                           cache: PatternPredictionCache = None) -> pd.DataFrame:
+    """predictions of the BLR model for preprocessed features (see transform_features), every unique feature pattern is predicted once"""
+
+    X_new_blr = {name: X_new[column] for column, name in BLR_CLASS_FEATURES}
+    X_new_blr["ffmc"] = X_new["ffmc"]
+
+    preds = predictor.with_data(X_new_blr).predict(include_z=False, deduplicate=True, cache=cache)
     return preds
 
 
-def create_prediction_layer(preds: pd.DataFrame, path_to_ref_grid: str, path_to_output: str):
-        """from model predictions and reference grid, 
-        create geotiff that stores p pred and hdi width for predicted cells"""
+# predictor, preprocessor and pattern cache of a prediction worker process, created once by the pool initializer
+_WORKER_STATE = {}
+
+
+def _init_prediction_worker(path_to_model: str, path_to_preprocessor: str, path_to_datacube: str = None):
+    idata = load_idata(path_to_model)
+    _WORKER_STATE["datacube"] = FeatureDatacube(path_to_datacube) if path_to_datacube else None
+    _WORKER_STATE["predictor"] = BLRPosteriorPredictor(idata, {})
+    _WORKER_STATE["preprocessor"] = joblib.load(path_to_preprocessor)
+    # windows share most feature patterns, so predictions of earlier windows are reused
+    _WORKER_STATE["cache"] = PatternPredictionCache()
+
+
+def iter_windows(width: int, height: int, block_size: int):
+    """yields block_size x block_size windows that tile the grid, row by row"""
+
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
 
-        with rasterio.open(path_to_ref_grid) as ref_grid_src:
-            ref_grid_data = ref_grid_src.read(1)
-            ref_grid_meta = ref_grid_src.profile
 
-        prediction_layer = np.full_like(ref_grid_data, -1, dtype="float32")
-        uncertainty_layer = np.full_like(ref_grid_data, -1, dtype="float32")
+def get_window_mask(path_to_forest_type: str, window: Window, aoi_geometry=None,
+                    datacube: FeatureDatacube = None) -> np.array:
+    """cells of the window that are forest (and inside the area of interest)
 
-        indices = np.where(np.isin(ref_grid_data, preds['ref_grid_id'].values))
+    With a datacube, path_to_forest_type is the name of the forest type variable of the datacube."""
 
-        prediction_layer[indices] = preds['p_pred']
-        uncertainty_layer[indices] = preds['hdi_width']
+    if datacube is not None:
+        mask = datacube.read_window(window, [path_to_forest_type])[path_to_forest_type] != -1
+        window_transform = rasterio.windows.transform(window, datacube.transform)
+    else:
+        with rasterio.open(path_to_forest_type) as src:
+            mask = src.read(1, window=window) != -1
+            window_transform = src.window_transform(window)
+    if aoi_geometry is not None:
+        mask &= geometry_mask([aoi_geometry], out_shape=mask.shape, transform=window_transform, invert=True)
+    return mask
 
-        out_meta = ref_grid_meta
-        out_meta.update({"nodata": -1, "dtype": "float32", "count": 2})  
-        with rasterio.open(path_to_output, "w", **out_meta) as dst:
-            dst.write(prediction_layer, 1)
-            dst.write(uncertainty_layer, 2)
+
+def predict_window(feature_layers: list, window: Window, mask: np.array, ffmc_value=None) -> tuple:
+    """predicts the masked cells of one window, runs in a worker process
+
+    Returns:
+        tuple: window, p_pred and p_hdi_width blocks (-1 outside the mask)
+    """
+
+    features_df = load_static_layers_into_df(feature_layers, window, _WORKER_STATE["datacube"])
+    features_df = add_ffmc_layer(features_df, ffmc_value)
+    features_df = features_df[mask.flatten()]
+
+    features_preproc = transform_features(_WORKER_STATE["preprocessor"], features_df)
+    preds = predict_with_predictor(_WORKER_STATE["predictor"], features_preproc, _WORKER_STATE["cache"])
+
+    prediction_block = np.full(mask.shape, -1, dtype="float32")
+    uncertainty_block = np.full(mask.shape, -1, dtype="float32")
+    prediction_block[mask] = preds["p_pred"].values
+    uncertainty_block[mask] = preds["p_hdi_width"].values
+    return window, prediction_block, uncertainty_block
+
+
+def create_prediction_layer_windowed(feature_layers: list, path_to_model: str, path_to_preprocessor: str,
+                                     path_to_ref_grid: str, path_to_output: str, ffmc_value=None,
+                                     aoi_geometry=None, block_size: int = 512, max_workers: int = None,
+                                     path_to_datacube: str = None):
+    """creates the prediction geotiff (p pred and hdi width) window by window
+
+    Windows without forest cells (inside the area of interest) are skipped, the others are
+    predicted in a process pool and written to the output as soon as they are finished. At most
+    two windows per worker are in flight, so memory depends on block_size and not on the grid size.
+    With a feature datacube (see src.data_preprocessing.feature_datacube), all features of a window
+    are read from its chunks instead of one raster per feature.
+
+    Args:
+        feature_layers (list): (name, path) tuples of the feature layers, aligned with the reference grid,
+            (name, variable) tuples if path_to_datacube is given
+        path_to_model (str): model artifact directory or pickled BLR model and trace
+        path_to_preprocessor (str): fitted preprocessor of the training data
+        path_to_ref_grid (str): reference grid raster, defines shape and georeference of the output
+        path_to_output (str): output geotiff
+        ffmc_value (optional): static ffmc value for all cells. Defaults to None.
+        aoi_geometry (optional): only cells inside this geometry are predicted. Defaults to None.
+        block_size (int, optional): edge length of the windows in cells. Defaults to 512.
+        max_workers (int, optional): number of worker processes. Defaults to os.cpu_count().
+        path_to_datacube (str, optional): feature datacube to read the features from. Defaults to None.
+    """
+
+    max_workers = max_workers or os.cpu_count()
+    path_to_forest_type = dict(feature_layers)["forest_type"]
+
+    with rasterio.open(path_to_ref_grid) as ref_grid_src:
+        out_meta = ref_grid_src.profile
+    out_meta.update({"driver": "GTiff", "nodata": -1, "dtype": "float32", "count": 2})
+    if block_size % 16 == 0:
+        out_meta.update({"tiled": True, "blockxsize": block_size, "blockysize": block_size})
+
+    with rasterio.open(path_to_output, "w", **out_meta) as dst, \
+            ProcessPoolExecutor(max_workers, initializer=_init_prediction_worker,
+                                initargs=(path_to_model, path_to_preprocessor, path_to_datacube)) as executor:
+
+        def write_finished(futures: set, n_pending_max: int) -> set:
+            while len(futures) > n_pending_max:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window, prediction_block, uncertainty_block = future.result()
+                    dst.write(prediction_block, 1, window=window)
+                    dst.write(uncertainty_block, 2, window=window)
+            return futures
+
+        pending = set()
+        for window in iter_windows(dst.width, dst.height, block_size):
+            if path_to_datacube:
+                # opened per window, so no open HDF5 file is inherited by the forked workers
+                with FeatureDatacube(path_to_datacube) as datacube:
+                    mask = get_window_mask(path_to_forest_type, window, aoi_geometry, datacube)
+            else:
+                mask = get_window_mask(path_to_forest_type, window, aoi_geometry)
+            if not mask.any():
+                empty_block = np.full(mask.shape, -1, dtype="float32")
+                dst.write(empty_block, 1, window=window)
+                dst.write(empty_block, 2, window=window)
+                continue
+            pending.add(executor.submit(predict_window, feature_layers, window, mask, ffmc_value))
+            pending = write_finished(pending, 2 * max_workers)
+        write_finished(pending, 0)
 
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Create prediction layer of the BLR model.')
+    parser.add_argument('--nuts_code', type=str, default="AT130",
+                        help='Only cells inside this NUTS unit are predicted, "all" for the whole grid')
+    parser.add_argument('--ffmc', type=float, default=85,
+                        help='Static FFMC value used for all cells')
+    parser.add_argument('--block_size', type=int, default=512,
+                        help='Edge length of the windows that are predicted at once (in cells)')
+    parser.add_argument('--max_workers', type=int, default=None,
+                        help='Number of worker processes, defaults to the number of CPUs')
+    parser.add_argument('--datacube', action='store_true',
+                        help='Read the features from the feature datacube instead of the single layers')
+    args = parser.parse_args()
+
     paths = load_paths_from_yaml(PATH_TO_PATH_CONFIG_FILE)
     paths = replace_base_path(paths, BASE_PATH)
 
-    nuts_code = "AT130"
+    nuts_code = args.nuts_code
     # TODO at later stage save those paths to paths config file
     path_to_blr_model = "models/blr_pickle.pkl"
     path_to_blr_preprocessor = "models/blr_preprocessor.pkl"
@@ -153,25 +278,20 @@ if __name__ == "__main__":
         ("forest_type", paths["forest_type"]["final"])
     ]
 
-    features_df = load_static_layers_into_df(feature_layers)
-    
-    features_df = add_ffmc_layer(features_df, 85)
-    
-    ref_grid_ids_aoi = extract_ref_grid_ids_from_nuts_unit(
-        paths["nuts_data"]["final"], paths["reference_grid"]["raster"], nuts_code)
-    
-    features_df_aoi = features_df[features_df["ref_grid_id"].isin(
-        ref_grid_ids_aoi)]
-    
-    features_df_aoi = features_df_aoi[features_df_aoi["forest_type"] != -1]
-    print(len(features_df_aoi))
-
-    features_df_preproc = preprocess_data(
-        path_to_blr_preprocessor, features_df_aoi)
-    
-    preds = make_predictions(path_to_blr_model, features_df_preproc)
-
-    preds["ref_grid_id"] = features_df_aoi["ref_grid_id"].values
-    
-    create_prediction_layer(preds, paths["reference_grid"]["raster"], path_to_prediction_layer)
-
+    path_to_datacube = None
+    if args.datacube:
+        # variables of create_feature_datacube.py
+        path_to_datacube = paths["feature_datacube"]
+        feature_layers = [(name, "population_density_2021" if name == "population_density" else name)
+                          for name, _ in feature_layers]
+
+    aoi_geometry = None
+    if nuts_code != "all":
+        nuts_gdf = gpd.read_file(paths["nuts_data"]["final"])
+        aoi_geometry = shape(nuts_gdf[nuts_gdf['NUTS_ID'] == nuts_code]['geometry'].values[0])
+
+    create_prediction_layer_windowed(feature_layers, path_to_blr_model, path_to_blr_preprocessor,
+                                     paths["reference_grid"]["raster"], path_to_prediction_layer,
+                                     ffmc_value=args.ffmc, aoi_geometry=aoi_geometry,
+                                     block_size=args.block_size, max_workers=args.max_workers,
+                                     path_to_datacube=path_to_datacube)
@@ -3,9 +3,11 @@ The goal of the script is to create a training dataset for wildfire igntiion pre
 utilizing the static feature layers and the ffmc.
 """
 
+import argparse
 import geopandas as gpd
 
 from config.config import BASE_PATH, PATH_TO_PATH_CONFIG_FILE
+from src.data_preprocessing.feature_datacube import add_static_features_from_datacube
 from src.data_preprocessing.feature_engineering import (
     add_static_features,
     add_ffmc_feature,
@@ -13,7 +15,7 @@ from src.data_preprocessing.feature_engineering import (
 from src.utils import load_paths_from_yaml, replace_base_path
 
 
-def main():
+def main(use_datacube: bool = False):
     paths = load_paths_from_yaml(PATH_TO_PATH_CONFIG_FILE)
     paths = replace_base_path(paths, BASE_PATH)
 
@@ -22,10 +24,6 @@ def main():
     event_data.reset_index(inplace=True)
 
     feature_info = [
-        ("pop_2006", paths["population_layers"]["2006"]["final"]),
-        ("pop_2011", paths["population_layers"]["2011"]["final"]),
-        ("pop_2018", paths["population_layers"]["2018"]["final"]),
-        ("pop_2021", paths["population_layers"]["2021"]["final"]),
         ("farmyard_ds", paths["farmyard_density"]["final"]),
         ("hiking_ds", paths["roads"]["hikingtrails"]["final"]),
         ("forest_ds", paths["roads"]["forestroads"]["final"]),
@@ -37,11 +35,30 @@ def main():
         ("canopy_cover", paths["canopy_cover"]["final"]),
     ]
 
-    train_data = add_static_features(BASE_PATH, event_data, feature_info)
+    # population of the census year closest to the date of the event
+    time_stamped_feature_info = {
+        "pop_dens": {int(year): paths["population_layers"][year]["final"] for year in ["2006", "2011", "2018", "2021"]},
+    }
+
+    if use_datacube:
+        # variables of create_feature_datacube.py
+        variables = {"farmyard_ds": "farmyard_density", "hiking_ds": "hikingtrail_density",
+                     "forest_ds": "forestroad_density", "rail_dens": "railway_density", "foresttype": "forest_type"}
+        train_data = add_static_features_from_datacube(
+            event_data, paths["feature_datacube"], [(name, variables.get(name, name)) for name, _ in feature_info],
+            {"pop_dens": {int(year): f"population_density_{year}" for year in ["2006", "2011", "2018", "2021"]}})
+    else:
+        train_data = add_static_features(BASE_PATH, event_data, feature_info, time_stamped_feature_info)
     train_data = add_ffmc_feature(train_data, paths["ffmc_events"]["source"])
 
     train_data.to_file(paths["training_data"])
 
 
 if __name__ == "__main__":
-    main()
+
+    parser = argparse.ArgumentParser(description='Create the training dataset of the fire events.')
+    parser.add_argument('--datacube', action='store_true',
+                        help='Read the static features from the feature datacube instead of the single layers')
+    args = parser.parse_args()
+
+    main(args.datacube)
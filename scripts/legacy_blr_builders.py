@@ -0,0 +1,354 @@
+"""
+The BLR builders with one coefficient lookup per feature, as they were before create_stacked_blr.
+They build the same models (same free variables and logp) and are kept as reference for
+benchmark_model_builders.py and the equivalence tests.
+"""
+
+import pandas as pd
+import pymc as pm
+
+from src.modeling.bayesian_models import aggregate_patterns, create_group_coefficients, create_likelihood
+
+
+def create_st_blr(
+    X: pd.DataFrame,
+    y: pd.Series,
+    coords: dict,
+    spatial_grouping_variable: str,
+    temporal_grouping_variable: str,
+    total_size: int = None,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    aggregate: bool = False,
+) -> pm.Model:
+    X, y, n_trials = aggregate_patterns(X, y, [spatial_grouping_variable, temporal_grouping_variable]) \
+        if aggregate else (X, y, None)
+    with pm.Model(coords=coords) as model:  # type: ignore
+        # data containers
+        elevation = pm.MutableData("elevation", X.elevation_encoded)
+        slope = pm.MutableData("slope", X.slope_encoded)
+        aspect = pm.MutableData("aspect", X.aspect_encoded)
+        forestroad_density = pm.MutableData(
+            "forestroad_density", X.forestroad_density_bin
+        )
+        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
+        hikingtrail_density = pm.MutableData(
+            "hikingtrail_density", X.hikingtrail_density_bin
+        )
+        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
+        population = pm.MutableData("population", X.population_encoded)
+        forest_type = pm.MutableData("forest_type", X.forest_type)
+        ffmc = pm.MutableData("ffmc", X.ffmc)
+        fire_labels = pm.MutableData("fire", y)
+        spatial_groups_idx = pm.MutableData(
+            "spatial_groups_idx", X[spatial_grouping_variable]
+        )
+        temporal_groups_idx = pm.MutableData(
+            "temporal_groups_idx", X[temporal_grouping_variable]
+        )
+
+        # Hyperpriors of features
+        mu_intercept, sigma_intercept = (
+            pm.Cauchy("mu_intercept", 0.0, 1.0),
+            pm.Exponential("sigma_intercept", 1),
+        )
+        mu_b1, sigma_b1 = pm.Cauchy("mu_b1", 0.0, 1.0), pm.Exponential("sigma_b1", 1)
+        mu_b2, sigma_b2 = pm.Cauchy("mu_b2", 0.0, 1.0), pm.Exponential("sigma_b2", 1)
+        mu_b3, sigma_b3 = pm.Cauchy("mu_b3", 0.0, 1.0), pm.Exponential("sigma_b3", 1)
+        mu_b4, sigma_b4 = pm.Cauchy("mu_b4", 0.0, 1.0), pm.Exponential("sigma_b4", 1)
+        mu_b5, sigma_b5 = pm.Cauchy("mu_b5", 0.0, 1.0), pm.Exponential("sigma_b5", 1)
+        mu_b6, sigma_b6 = pm.Cauchy("mu_b6", 0.0, 1.0), pm.Exponential("sigma_b6", 1)
+        mu_b7, sigma_b7 = pm.Cauchy("mu_b7", 0.0, 1.0), pm.Exponential("sigma_b7", 1)
+        mu_b8, sigma_b8 = pm.Cauchy("mu_b8", 0.0, 1.0), pm.Exponential("sigma_b8", 1)
+        mu_b9, sigma_b9 = pm.Cauchy("mu_b9", 0.0, 1.0), pm.Exponential("sigma_b9", 1)
+        mu_b10, sigma_b10 = (
+            pm.Cauchy("mu_b10", 0.0, 1.0),
+            pm.Exponential("sigma_b10", 1),
+        )
+
+        # specify priors for the features
+        intercept = create_group_coefficients(
+            "intercept",
+            mu_intercept,
+            sigma_intercept,
+            ("spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_elevation = create_group_coefficients(
+            "beta_elevation",
+            mu_b1,
+            sigma_b1,
+            ("elevation_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_slope = create_group_coefficients(
+            "beta_slope",
+            mu_b2,
+            sigma_b2,
+            ("slope_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_aspect = create_group_coefficients(
+            "beta_aspect",
+            mu_b3,
+            sigma_b3,
+            ("aspect_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_forestroad_density = create_group_coefficients(
+            "beta_forestroad_density",
+            mu_b4,
+            sigma_b4,
+            ("forestroad_density_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_railway_density = create_group_coefficients(
+            "beta_railway_density",
+            mu_b5,
+            sigma_b5,
+            ("railway_density_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_hikingtrail_density = create_group_coefficients(
+            "beta_hikingtrail_density",
+            mu_b6,
+            sigma_b6,
+            ("hikingtrail_density_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_farmyard_density = create_group_coefficients(
+            "beta_farmyard_density",
+            mu_b7,
+            sigma_b7,
+            ("farmyard_density_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_population = create_group_coefficients(
+            "beta_population",
+            mu_b8,
+            sigma_b8,
+            ("population_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_forest_type = create_group_coefficients(
+            "beta_forest_type",
+            mu_b9,
+            sigma_b9,
+            ("forest_type_classes", "spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_ffmc = create_group_coefficients(
+            "beta_ffmc",
+            mu_b10,
+            sigma_b10,
+            ("spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        error_var = pm.Cauchy("error_beta", 0, 1)
+
+        mean = (
+            intercept[spatial_groups_idx, temporal_groups_idx]
+            + beta_elevation[elevation, spatial_groups_idx, temporal_groups_idx]
+            + beta_slope[slope, spatial_groups_idx, temporal_groups_idx]
+            + beta_aspect[aspect, spatial_groups_idx, temporal_groups_idx]
+            + beta_forestroad_density[
+                forestroad_density, spatial_groups_idx, temporal_groups_idx
+            ]
+            + beta_railway_density[
+                railway_density, spatial_groups_idx, temporal_groups_idx
+            ]
+            + beta_hikingtrail_density[
+                hikingtrail_density, spatial_groups_idx, temporal_groups_idx
+            ]
+            + beta_farmyard_density[
+                farmyard_density, spatial_groups_idx, temporal_groups_idx
+            ]
+            + beta_population[population, spatial_groups_idx, temporal_groups_idx]
+            + beta_forest_type[forest_type, spatial_groups_idx, temporal_groups_idx]
+            + beta_ffmc[spatial_groups_idx, temporal_groups_idx] * ffmc
+            + error_var
+        )
+
+        z = pm.Deterministic("z", mean)
+        p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
+        y_pred = create_likelihood(p, fire_labels, n_trials, total_size)
+
+        return model
+
+
+def create_blr(
+    X: pd.DataFrame, y: pd.Series, coords: dict, total_size: int = None, aggregate: bool = False
+) -> pm.Model:
+    X, y, n_trials = aggregate_patterns(X, y) if aggregate else (X, y, None)
+    with pm.Model(coords=coords) as model:  # type: ignore
+        # data containers
+        elevation = pm.MutableData("elevation", X.elevation_encoded)
+        slope = pm.MutableData("slope", X.slope_encoded)
+        aspect = pm.MutableData("aspect", X.aspect_encoded)
+        forestroad_density = pm.MutableData(
+            "forestroad_density", X.forestroad_density_bin
+        )
+        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
+        hikingtrail_density = pm.MutableData(
+            "hikingtrail_density", X.hikingtrail_density_bin
+        )
+        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
+        population = pm.MutableData("population", X.population_encoded)
+        forest_type = pm.MutableData("forest_type", X.forest_type)
+        ffmc = pm.MutableData("ffmc", X.ffmc)
+        fire_labels = pm.MutableData("fire", y)
+
+        # specify priors for the features
+        intercept = pm.Cauchy("intercept", 0, 1)
+        beta_elevation = pm.Cauchy("beta_elevation", 0, 1, dims=("elevation_classes"))
+        beta_slope = pm.Cauchy("beta_slope", 0, 1, dims=("slope_classes"))
+        beta_aspect = pm.Cauchy("beta_aspect", 0, 1, dims=("aspect_classes"))
+        beta_forestroad_density = pm.Cauchy(
+            "beta_forestroad_density", 0, 1, dims=("forestroad_density_classes")
+        )
+        beta_railway_density = pm.Cauchy(
+            "beta_railway_density", 0, 1, dims=("railway_density_classes")
+        )
+        beta_hikingtrail_density = pm.Cauchy(
+            "beta_hikingtrail_density", 0, 1, dims=("hikingtrail_density_classes")
+        )
+        beta_farmyard_density = pm.Cauchy(
+            "beta_farmyard_density", 0, 1, dims=("farmyard_density_classes")
+        )
+        beta_population = pm.Cauchy(
+            "beta_population", 0, 1, dims=("population_classes")
+        )
+        beta_forest_type = pm.Cauchy(
+            "beta_forest_type", 0, 1, dims=("forest_type_classes")
+        )
+        beta_ffmc = pm.Cauchy("beta_ffmc", 0, 1)
+        error_var = pm.Cauchy("error_beta", 0, 1)
+
+        mean = (
+            intercept
+            + beta_elevation[elevation]
+            + beta_slope[slope]
+            + beta_aspect[aspect]
+            + beta_forestroad_density[forestroad_density]
+            + beta_railway_density[railway_density]
+            + beta_hikingtrail_density[hikingtrail_density]
+            + beta_farmyard_density[farmyard_density]
+            + beta_population[population]
+            + beta_forest_type[forest_type]
+            + beta_ffmc * ffmc
+            + error_var
+        )
+
+        z = pm.Deterministic("z", mean)
+        p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
+        y_pred = create_likelihood(p, fire_labels, n_trials, total_size)
+
+        return model
+
+
+def create_st_intercept_blr(
+    X: pd.DataFrame,
+    y: pd.Series,
+    coords: dict,
+    spatial_grouping_variable: str,
+    temporal_grouping_variable: str,
+    total_size: int = None,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    aggregate: bool = False,
+) -> pm.Model:
+    X, y, n_trials = aggregate_patterns(X, y, [spatial_grouping_variable, temporal_grouping_variable]) \
+        if aggregate else (X, y, None)
+    with pm.Model(coords=coords) as model:  # type: ignore
+        # data containers
+        elevation = pm.MutableData("elevation", X.elevation_encoded)
+        slope = pm.MutableData("slope", X.slope_encoded)
+        aspect = pm.MutableData("aspect", X.aspect_encoded)
+        forestroad_density = pm.MutableData(
+            "forestroad_density", X.forestroad_density_bin
+        )
+        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
+        hikingtrail_density = pm.MutableData(
+            "hikingtrail_density", X.hikingtrail_density_bin
+        )
+        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
+        population = pm.MutableData("population", X.population_encoded)
+        forest_type = pm.MutableData("forest_type", X.forest_type)
+        ffmc = pm.MutableData("ffmc", X.ffmc)
+        fire_labels = pm.MutableData("fire", y)
+        spatial_groups_idx = pm.MutableData(
+            "spatial_groups_idx", X[spatial_grouping_variable]
+        )
+        temporal_groups_idx = pm.MutableData(
+            "temporal_groups_idx", X[temporal_grouping_variable]
+        )
+
+        mu_intercept, sigma_intercept = (
+            pm.Cauchy("mu_b1", 0.0, 1.0),
+            pm.Exponential("sigma_b1", 1),
+        )
+
+        # specify priors for the features
+        intercept = create_group_coefficients(
+            "intercept",
+            mu_intercept,
+            sigma_intercept,
+            ("spatial_groups", "temporal_groups"),
+            parameterization,
+            distribution,
+        )
+        beta_elevation = pm.Cauchy("beta_elevation", 0, 1, dims=("elevation_classes"))
+        beta_slope = pm.Cauchy("beta_slope", 0, 1, dims=("slope_classes"))
+        beta_aspect = pm.Cauchy("beta_aspect", 0, 1, dims=("aspect_classes"))
+        beta_forestroad_density = pm.Cauchy(
+            "beta_forestroad_density", 0, 1, dims=("forestroad_density_classes")
+        )
+        beta_railway_density = pm.Cauchy(
+            "beta_railway_density", 0, 1, dims=("railway_density_classes")
+        )
+        beta_hikingtrail_density = pm.Cauchy(
+            "beta_hikingtrail_density", 0, 1, dims=("hikingtrail_density_classes")
+        )
+        beta_farmyard_density = pm.Cauchy(
+            "beta_farmyard_density", 0, 1, dims=("farmyard_density_classes")
+        )
+        beta_population = pm.Cauchy(
+            "beta_population", 0, 1, dims=("population_classes")
+        )
+        beta_forest_type = pm.Cauchy(
+            "beta_forest_type", 0, 1, dims=("forest_type_classes")
+        )
+        beta_ffmc = pm.Cauchy("beta_ffmc", 0, 1)
+        error_var = pm.Cauchy("error_beta", 0, 1)
+
+        mean = (
+            intercept[spatial_groups_idx, temporal_groups_idx]
+            + beta_elevation[elevation]
+            + beta_slope[slope]
+            + beta_aspect[aspect]
+            + beta_forestroad_density[forestroad_density]
+            + beta_railway_density[railway_density]
+            + beta_hikingtrail_density[hikingtrail_density]
+            + beta_farmyard_density[farmyard_density]
+            + beta_population[population]
+            + beta_forest_type[forest_type]
+            + beta_ffmc * ffmc
+            + error_var
+        )
+
+        z = pm.Deterministic("z", mean)
+        p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
+        y_pred = create_likelihood(p, fire_labels, n_trials, total_size)
+
+        return model
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import Counter
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+
+INDEX_FILE_NAME = "index.json"
+INCA_TIME_STEP = pd.Timedelta(hours=1)
+
+
+def create_request_key(parameters: list, bbox: str, output_format: str) -> str:
+    """creates hash of the request parameters that do not depend on the time range"""
+    request = json.dumps({"parameters": sorted(parameters), "bbox": str(bbox),
+                          "output_format": output_format}, sort_keys=True)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+def get_netcdf_times(nc_dataset: nc.Dataset) -> pd.DatetimeIndex:
+    """returns time axis of a NetCDF file as DatetimeIndex"""
+    time_var = nc_dataset.variables["time"]
+    return pd.to_datetime(nc.num2date(time_var[:], time_var.units,
+                                      only_use_cftime_datetimes=False, only_use_python_datetimes=True))
+
+
+def write_netcdf_time_subset(sources: list, path_to_output: str, time_steps_per_copy: int = 24) -> None:
+    """writes NetCDF file that contains the time steps of one or several NetCDF files
+
+    Sources are given as (path, start_date, end_date) tuples, sorted by time. Time steps that already
+    were written by a previous source are skipped. Variables without time dimension are copied from the
+    first source. Data is copied in blocks of time_steps_per_copy time steps to keep memory bounded.
+
+    Args:
+        sources (list): list of (path to NetCDF file, start date, end date) tuples
+        path_to_output (str): path of the NetCDF file that is written
+        time_steps_per_copy (int, optional): number of time steps copied at once. Defaults to 24.
+    """
+
+    with nc.Dataset(sources[0][0], "r") as template, nc.Dataset(path_to_output, "w") as dst:
+        dst.setncatts({attr: template.getncattr(attr) for attr in template.ncattrs()})
+        for name, dimension in template.dimensions.items():
+            dst.createDimension(name, None if name == "time" else len(dimension))
+        for name, var in template.variables.items():
+            fill_value = var.getncattr("_FillValue") if "_FillValue" in var.ncattrs() else None
+            dst_var = dst.createVariable(name, var.dtype, var.dimensions, zlib=True, fill_value=fill_value)
+            dst_var.setncatts({attr: var.getncattr(attr) for attr in var.ncattrs() if attr != "_FillValue"})
+            if "time" not in var.dimensions:
+                dst_var[:] = var[:]
+
+    n_written = 0
+    last_time_written = None
+    with nc.Dataset(path_to_output, "a") as dst:
+        for path_to_source, start_date, end_date in sources:
+            with nc.Dataset(path_to_source, "r") as src:
+                times = get_netcdf_times(src)
+                selected = (times >= pd.to_datetime(start_date)) & (times <= pd.to_datetime(end_date))
+                if last_time_written is not None:
+                    selected &= times > last_time_written
+                indices = np.flatnonzero(selected)
+                if len(indices) == 0:
+                    continue
+
+                for block_start in range(0, len(indices), time_steps_per_copy):
+                    block = indices[block_start:block_start + time_steps_per_copy]
+                    # indices are consecutive, so a slice reads the block in one go
+                    time_slice = slice(block[0], block[-1] + 1)
+                    for name, var in src.variables.items():
+                        if "time" not in var.dimensions:
+                            continue
+                        axis = var.dimensions.index("time")
+                        src_index = [slice(None)] * var.ndim
+                        dst_index = [slice(None)] * var.ndim
+                        src_index[axis] = time_slice
+                        dst_index[axis] = slice(n_written, n_written + len(block))
+                        dst.variables[name][tuple(dst_index)] = var[tuple(src_index)]
+                    n_written += len(block)
+
+                last_time_written = times[indices[-1]]
+
+
+class IncaGridCache:
+    """On-disk cache of Geosphere INCA grid downloads
+
+    Entries are keyed by a hash of parameters, bbox and output format plus the time range of the
+    download. A request is served from the cache if the cached time ranges of the same parameters
+    and bbox cover it, NetCDF entries are sliced (and concatenated) in time if needed. If the total
+    size of the cache exceeds max_size_bytes, least recently used entries are evicted (except entries
+    that are being read). In offline mode requests that can not be served from the cache raise a
+    FileNotFoundError.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int = None, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        # number of readers of each cached file, files with readers are not evicted
+        self._readers = Counter()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def path_to_index(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILE_NAME)
+
+    def _load_index(self) -> dict:
+        if not os.path.exists(self.path_to_index):
+            return {}
+        with open(self.path_to_index, "r") as file:
+            return json.load(file)
+
+    def _save_index(self, index: dict) -> None:
+        path_to_tmp_index = self.path_to_index + ".tmp"
+        with open(path_to_tmp_index, "w") as file:
+            json.dump(index, file, indent=1)
+        os.replace(path_to_tmp_index, self.path_to_index)
+
+    @staticmethod
+    def _find_covering_entries(entries: list, start_date: str, end_date: str) -> list:
+        """returns (entry, start, end) pieces that cover the time range, or None if it is not covered"""
+        start, end = pd.to_datetime(start_date), pd.to_datetime(end_date)
+        entries = sorted(entries, key=lambda entry: pd.to_datetime(entry["start"]))
+        pieces = []
+        covered_until = start - INCA_TIME_STEP
+        while covered_until < end:
+            candidates = [entry for entry in entries
+                          if pd.to_datetime(entry["start"]) <= covered_until + INCA_TIME_STEP
+                          and pd.to_datetime(entry["end"]) > covered_until]
+            if not candidates:
+                return None
+            entry = max(candidates, key=lambda entry: pd.to_datetime(entry["end"]))
+            piece_end = min(pd.to_datetime(entry["end"]), end)
+            pieces.append((entry, max(covered_until + INCA_TIME_STEP, start), piece_end))
+            covered_until = piece_end
+        return pieces
+
+    def get(self, parameters: list, start_date: str, end_date: str, bbox: str, output_format: str,
+            path_to_output: str) -> bool:
+        """writes requested data to path_to_output if it can be served from the cache
+
+        Returns:
+            bool: True if the request was served from the cache
+        """
+
+        request_key = create_request_key(parameters, bbox, output_format)
+        with self._lock:
+            index = self._load_index()
+            entries = [entry for entry in index.values() if entry["request_key"] == request_key]
+            exact = [entry for entry in entries
+                     if entry["start"] == start_date and entry["end"] == end_date]
+            pieces = [(exact[0], start_date, end_date)] if exact else None
+            if pieces is None and output_format == "netcdf":
+                pieces = self._find_covering_entries(entries, start_date, end_date)
+
+            if pieces is None:
+                if self.offline:
+                    raise FileNotFoundError(
+                        f"Offline mode: {parameters} from {start_date} to {end_date} not in cache {self.cache_dir}")
+                return False
+
+            for entry, _, _ in pieces:
+                entry["last_access"] = time.time()
+                self._readers[entry["file"]] += 1
+            self._save_index(index)
+
+        # files are read without holding the lock, the reader counts keep them from being evicted
+        try:
+            if exact:
+                shutil.copyfile(os.path.join(self.cache_dir, exact[0]["file"]), path_to_output)
+            else:
+                write_netcdf_time_subset([(os.path.join(self.cache_dir, entry["file"]), piece_start, piece_end)
+                                          for entry, piece_start, piece_end in pieces], path_to_output)
+        finally:
+            with self._lock:
+                self._readers.subtract(entry["file"] for entry, _, _ in pieces)
+        return True
+
+    def put(self, parameters: list, start_date: str, end_date: str, bbox: str, output_format: str,
+            path_to_file: str) -> None:
+        """adds downloaded file to the cache and evicts old entries if the cache is too big"""
+
+        request_key = create_request_key(parameters, bbox, output_format)
+        entry_key = hashlib.sha256(f"{request_key}_{start_date}_{end_date}".encode()).hexdigest()
+        file_name = f"{entry_key}.{output_format}"
+        # copied to a temporary file first, so readers never see a partially written entry
+        file_descriptor, path_to_tmp_file = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        os.close(file_descriptor)
+        try:
+            shutil.copyfile(path_to_file, path_to_tmp_file)
+        except BaseException:
+            os.remove(path_to_tmp_file)
+            raise
+
+        with self._lock:
+            os.replace(path_to_tmp_file, os.path.join(self.cache_dir, file_name))
+            index = self._load_index()
+            index[entry_key] = {
+                "request_key": request_key,
+                "parameters": sorted(parameters),
+                "bbox": str(bbox),
+                "start": start_date,
+                "end": end_date,
+                "file": file_name,
+                "size": os.path.getsize(path_to_file),
+                "last_access": time.time(),
+            }
+            self._evict(index, keep=entry_key)
+            self._save_index(index)
+
+    def _evict(self, index: dict, keep: str = None) -> None:
+        """removes least recently used entries until the cache is smaller than max_size_bytes"""
+        if self.max_size_bytes is None:
+            return
+        total_size = sum(entry["size"] for entry in index.values())
+        for entry_key, entry in sorted(index.items(), key=lambda item: item[1]["last_access"]):
+            if total_size <= self.max_size_bytes:
+                break
+            if entry_key == keep or self._readers[entry["file"]] > 0:
+                continue
+            path_to_entry = os.path.join(self.cache_dir, entry["file"])
+            if os.path.exists(path_to_entry):
+                os.remove(path_to_entry)
+            total_size -= entry["size"]
+            del index[entry_key]
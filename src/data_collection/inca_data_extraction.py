@@ -1,11 +1,41 @@
 import os
 import requests
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 from config.config import GEOSPHERE_INCA_GRID_URL, GEOSPHERE_INCA_TS_URL
+from src.data_collection.inca_cache import IncaGridCache, write_netcdf_time_subset
+
+DOWNLOAD_CHUNK_SIZE_BYTES = 1024 * 1024
+# Number of locations packed into one request of the timeseries API
+MAX_LOCATIONS_PER_REQUEST = 100
+
+
+def create_session(pool_size: int = 8) -> requests.Session:
+    """creates HTTP session whose connection pool can be shared by several download threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def create_inca_grid_filename(parameters: list, start_date: str, end_date: str, output_format: str,
+                              filename_prefix: str) -> str:
+    """creates filename of downloaded INCA grid data"""
+    parameter_string_for_url = ""
+    for a in parameters:
+        parameter_string_for_url += f"_{a}"
+
+    return f"{filename_prefix}_{parameter_string_for_url[1:]}_{start_date.replace(':', '').replace('-', '').replace('T', '_')}_{end_date.replace(':', '').replace('-', '').replace('T', '_')}.{output_format}"
 
 
 def get_geosphere_data_grid(parameters: list, start_date: str, end_date: str, bbox: list,
-                            base_path_output: str, output_format='netcdf', filename_prefix='INCA_analysis') -> str:
+                            base_path_output: str, output_format='netcdf', filename_prefix='INCA_analysis',
+                            cache: IncaGridCache = None, base_url: str = GEOSPHERE_INCA_GRID_URL,
+                            session: requests.Session = None) -> str:
     """gets inca data for specified time rang and bounding box from Geosphere API
 
     Args:
@@ -16,31 +46,146 @@ def get_geosphere_data_grid(parameters: list, start_date: str, end_date: str, bb
         base_path_output (str): _description_
         output_format (str, optional): Defaults to 'netcdf'.
         filename_prefix (str, optional): Defaults to 'INCA_analysis'.
+        cache (IncaGridCache, optional): if given, request is served from the cache if possible and
+            downloaded data is added to the cache. Defaults to None.
+        base_url (str, optional): Defaults to GEOSPHERE_INCA_GRID_URL.
+        session (requests.Session, optional): session whose connection pool is used. Defaults to None.
 
     Returns:
         str: path to netcdf file is returned if request successfull, otherwise None
     """
 
     parameters_str = '&'.join([f'parameters={param}' for param in parameters])
-    url = f"{GEOSPHERE_INCA_GRID_URL}?{parameters_str}&start={start_date}&end={end_date}&bbox={bbox}&output_format={output_format}"
+    url = f"{base_url}?{parameters_str}&start={start_date}&end={end_date}&bbox={bbox}&output_format={output_format}"
 
-    parameter_string_for_url = ""
-    for a in parameters:
-        parameter_string_for_url += f"_{a}"
+    filename = create_inca_grid_filename(
+        parameters, start_date, end_date, output_format, filename_prefix)
+
+    path_to_file = os.path.join(base_path_output, filename)
+
+    if cache is not None and cache.get(parameters, start_date, end_date, bbox, output_format, path_to_file):
+        print(f"Data loaded from cache to {filename}")
+        return path_to_file
+
+    # response body is streamed to disk instead of being held in memory
+    with (session or requests).get(url, stream=True) as response:
+        if response.status_code == 200:
+            with open(path_to_file, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES):
+                    file.write(chunk)
+            print(f"Data saved to {filename}")
+            if cache is not None:
+                cache.put(parameters, start_date, end_date, bbox, output_format, path_to_file)
+            return path_to_file
+        else:
+            print(f"Error: {response.status_code}, {response.text}")
+            return None
+
+
+def split_time_range(start_date: str, end_date: str, chunk_hours: int) -> list:
+    """splits time range into consecutive (start, end) windows of at most chunk_hours hours (ends included)"""
+    start, end = pd.to_datetime(start_date), pd.to_datetime(end_date)
+    step = pd.Timedelta(hours=1)
+    windows = []
+    while start <= end:
+        window_end = min(start + pd.Timedelta(hours=chunk_hours) - step, end)
+        windows.append((start.strftime('%Y-%m-%dT%H:%M'),
+                       window_end.strftime('%Y-%m-%dT%H:%M')))
+        start = window_end + step
+    return windows
+
+
+def get_geosphere_data_grid_chunked(parameters: list, start_date: str, end_date: str, bbox: list,
+                                    base_path_output: str, output_format='netcdf',
+                                    filename_prefix='INCA_analysis', chunk_hours: int = 24 * 7,
+                                    max_workers: int = 4, cache: IncaGridCache = None,
+                                    base_url: str = GEOSPHERE_INCA_GRID_URL) -> str:
+    """gets inca data for long time ranges by downloading time windows concurrently
+
+    The time range is split into windows of chunk_hours hours, which are downloaded in parallel
+    threads over one pooled HTTP session and streamed to disk. The windows are then concatenated
+    (block by block) into one NetCDF file with the same name get_geosphere_data_grid would use.
+
+    Args:
+        parameters (list): inca parameter abbreviation (e.g. RR, T2M, RH2M, UU, VV, ...)
+        start_date (str): start of time range in format 'YYYY-MM-DDTHH:MM'
+        end_date (str): end of time range in format 'YYYY-MM-DDTHH:MM'
+        bbox (list): bounding box as string (lat_min,lon_min,lat_max,lon_max)
+        base_path_output (str): directory of the output file
+        output_format (str, optional): Only 'netcdf' can be concatenated. Defaults to 'netcdf'.
+        filename_prefix (str, optional): Defaults to 'INCA_analysis'.
+        chunk_hours (int, optional): length of one download window in hours. Defaults to one week.
+        max_workers (int, optional): number of concurrent downloads. Defaults to 4.
+        cache (IncaGridCache, optional): cache used for every window. Defaults to None.
+        base_url (str, optional): Defaults to GEOSPHERE_INCA_GRID_URL.
+
+    Returns:
+        str: path to netcdf file is returned if all requests were successfull, otherwise None
+    """
+
+    time_windows = split_time_range(start_date, end_date, chunk_hours)
+    if len(time_windows) == 1:
+        return get_geosphere_data_grid(parameters, start_date, end_date, bbox, base_path_output,
+                                       output_format, filename_prefix, cache, base_url)
+
+    chunk_prefix = f"{filename_prefix}_chunk"
+    path_to_file = None
+    try:
+        with create_session(max_workers) as session, ThreadPoolExecutor(max_workers) as executor:
+            paths_to_chunks = list(executor.map(
+                lambda window: get_geosphere_data_grid(parameters, window[0], window[1], bbox, base_path_output,
+                                                       output_format, chunk_prefix, cache, base_url, session),
+                time_windows))
+
+        if any(path is None for path in paths_to_chunks):
+            print(f"Error: {paths_to_chunks.count(None)} of {len(paths_to_chunks)} chunks could not be downloaded")
+        else:
+            path_to_file = os.path.join(base_path_output, create_inca_grid_filename(
+                parameters, start_date, end_date, output_format, filename_prefix))
+            write_netcdf_time_subset([(path, window[0], window[1])
+                                      for path, window in zip(paths_to_chunks, time_windows)], path_to_file)
+            print(f"Data saved to {os.path.basename(path_to_file)}")
+    finally:
+        # chunk files are removed even if a request raised (the executor waits for all requests first)
+        for window_start, window_end in time_windows:
+            path_to_chunk = os.path.join(base_path_output, create_inca_grid_filename(
+                parameters, window_start, window_end, output_format, chunk_prefix))
+            if os.path.exists(path_to_chunk):
+                os.remove(path_to_chunk)
+
+    return path_to_file
+
+
+def request_geosphere_timeseries(parameters: list, start_date: str, end_date: str, lat_lon: list,
+                                 output_format: str = "geojson", base_url: str = GEOSPHERE_INCA_TS_URL,
+                                 session: requests.Session = None) -> dict:
+    """requests inca parameters at one or several locations from the Geosphere timeseries API
+
+    Args:
+        parameters (list): Inca parameters of interest. E.g. ["T2M", "RR"].
+        start_date (str): Start of daterange for data retrieval. E.g. '2021-08-01T00:00'.
+        end_date (str): End of daterange for data retrieval. E.g. '2021-08-01T00:00'.
+        lat_lon (list): locations as "lat,lon" strings. E.g. ['48.206248,16.367569'].
+        output_format (str, optional): Output format. Defaults to "geojson".
+        base_url (str, optional): Defaults to GEOSPHERE_INCA_TS_URL.
+        session (requests.Session, optional): session whose connection pool is used. Defaults to None.
 
-    filename = f"{filename_prefix}_{parameter_string_for_url[1:]}_{start_date.replace(':', '').replace('-', '').replace('T', '_')}_{end_date.replace(':', '').replace('-', '').replace('T', '_')}.{output_format}"
+    Returns (dict): response from Geosphere API
+    """
+
+    lat_lon_params = '&lat_lon='.join(lat_lon)
 
-    response = requests.get(url)
+    parameter_string_for_url = ""
+    for a in parameters:
+        parameter_string_for_url += f"parameters={a}&"
 
+    url = f'{base_url}?{parameter_string_for_url[:-1]}&start={start_date}&end={end_date}&lat_lon={lat_lon_params}&output_format={output_format}'
+    response = (session or requests).get(url)
     if response.status_code == 200:
-        path_to_file = os.path.join(base_path_output, filename)
-        with open(path_to_file, 'wb') as file:
-            file.write(response.content)
-        print(f"Data saved to {filename}")
-        return path_to_file
+        return response.json()
     else:
-        print(f"Error: {response.status_code}, {response.text}")
-        return None
+        raise Exception(
+            f'Request failed with status code {response.status_code}.')
 
 
 def get_geosphere_data_point(parameters: list,
@@ -61,17 +206,84 @@ def get_geosphere_data_point(parameters: list,
     Returns (dict): response from Geosphere API
     """
 
-    lat_lon = [f"{lat},{lon}"]
-    lat_lon_params = '&lat_lon='.join(lat_lon)
+    return request_geosphere_timeseries(parameters, start_date, end_date, [f"{lat},{lon}"], output_format)
 
-    parameter_string_for_url = ""
-    for a in parameters:
-        parameter_string_for_url += f"parameters={a}&"
 
-    url = f'{GEOSPHERE_INCA_TS_URL}?{parameter_string_for_url[:-1]}&start={start_date}&end={end_date}&lat_lon={lat_lon_params}&output_format={output_format}'
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(
-            f'Request failed with status code {response.status_code}.')
+def geojson_timeseries_to_df(response: dict, parameters: list, event_ids: list) -> pd.DataFrame:
+    """converts geojson response of the timeseries API into one row per event and time step
+
+    Features of the response are expected in the order of the requested locations (= event_ids).
+    """
+
+    times = pd.to_datetime(response["timestamps"])
+    n_times = len(times)
+    features = response["features"]
+    if len(features) != len(event_ids):
+        raise ValueError(f"Response contains {len(features)} locations, {len(event_ids)} were requested")
+
+    data = {
+        "event_id": np.repeat(np.asarray(event_ids), n_times),
+        "time": np.tile(times, len(features)),
+    }
+    for parameter in parameters:
+        data[parameter] = np.concatenate(
+            [np.asarray(feature["properties"]["parameters"][parameter]["data"], dtype=float)
+             for feature in features])
+    return pd.DataFrame(data)
+
+
+def get_geosphere_data_points(events: pd.DataFrame, parameters: list, hours_before: int = 24,
+                              hours_after: int = 0, id_col: str = "index", date_col: str = "date",
+                              lat_col: str = "lat", lon_col: str = "lon",
+                              max_locations_per_request: int = MAX_LOCATIONS_PER_REQUEST,
+                              max_workers: int = 4, base_url: str = GEOSPHERE_INCA_TS_URL) -> pd.DataFrame:
+    """gets inca parameter time series for many events with few batched requests
+
+    Events with the same time window (date - hours_before to date + hours_after) are grouped and up to
+    max_locations_per_request locations are packed into one request. Requests are sent concurrently
+    over one pooled HTTP session.
+
+    Args:
+        events (pd.DataFrame): events with id, date and WGS84 coordinates
+            (e.g. event_data.to_crs("EPSG:4326") with lat/lon columns taken from the geometry)
+        parameters (list): Inca parameters of interest. E.g. ["T2M", "RR"].
+        hours_before (int, optional): start of time window relative to event date. Defaults to 24.
+        hours_after (int, optional): end of time window relative to event date. Defaults to 0.
+        id_col (str, optional): column with event id. Defaults to "index".
+        date_col (str, optional): column with event date. Defaults to "date".
+        lat_col (str, optional): column with latitude. Defaults to "lat".
+        lon_col (str, optional): column with longitude. Defaults to "lon".
+        max_locations_per_request (int, optional): Defaults to MAX_LOCATIONS_PER_REQUEST.
+        max_workers (int, optional): number of concurrent requests. Defaults to 4.
+        base_url (str, optional): Defaults to GEOSPHERE_INCA_TS_URL.
+
+    Returns:
+        pd.DataFrame: columns event_id, time and one column per parameter, one row per event and hour
+    """
+
+    dates = pd.to_datetime(events[date_col])
+    windows = pd.DataFrame({
+        "event_id": events[id_col].values,
+        "start": (dates - pd.Timedelta(hours=hours_before)).dt.strftime('%Y-%m-%dT%H:%M').values,
+        "end": (dates + pd.Timedelta(hours=hours_after)).dt.strftime('%Y-%m-%dT%H:%M').values,
+        "lat_lon": (events[lat_col].astype(str) + "," + events[lon_col].astype(str)).values,
+    })
+
+    batches = []
+    for (start_date, end_date), group in windows.groupby(["start", "end"], sort=True):
+        for batch_start in range(0, len(group), max_locations_per_request):
+            batch = group.iloc[batch_start:batch_start + max_locations_per_request]
+            batches.append((start_date, end_date, batch))
+
+    def request_batch(batch: tuple) -> pd.DataFrame:
+        start_date, end_date, batch_events = batch
+        response = request_geosphere_timeseries(parameters, start_date, end_date, list(batch_events["lat_lon"]),
+                                                base_url=base_url, session=session)
+        return geojson_timeseries_to_df(response, parameters, list(batch_events["event_id"]))
+
+    with create_session(max_workers) as session, ThreadPoolExecutor(max_workers) as executor:
+        results = list(executor.map(request_batch, batches))
+
+    if not results:
+        return pd.DataFrame(columns=["event_id", "time"] + list(parameters))
+    return pd.concat(results, ignore_index=True)
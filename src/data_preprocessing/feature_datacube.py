@@ -0,0 +1,325 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import netCDF4 as nc
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, from_bounds
+
+from src.data_preprocessing.feature_engineering import (
+    get_nearest_idx,
+    get_nearest_vintage_idx,
+    get_pixel_indices,
+    sample_pixels,
+)
+
+TIME_UNITS = "days since 1970-01-01"
+INTEGER_DTYPES = ["int8", "uint8", "int16", "uint16", "int32", "uint32", "int64"]
+
+
+def get_compact_dtype(dtype, min_value, max_value, nodata=None) -> np.dtype:
+    """smallest integer dtype that holds the values and the nodata value, float32 for floats"""
+
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return np.dtype("float32")
+    values = [min_value, max_value] + ([nodata] if nodata is not None else [])
+    for integer_dtype in INTEGER_DTYPES:
+        info = np.iinfo(integer_dtype)
+        if info.min <= min(values) and max(values) <= info.max:
+            return np.dtype(integer_dtype)
+    return np.dtype("int64")
+
+
+def _iter_row_strips(height: int, width: int, strip_height: int):
+    for row_off in range(0, height, strip_height):
+        yield Window(0, row_off, width, min(strip_height, height - row_off))
+
+
+def _get_value_range(src, strip_height: int) -> tuple:
+    """min and max of a raster band without nodata, read strip by strip"""
+
+    min_value, max_value = np.inf, -np.inf
+    for window in _iter_row_strips(src.height, src.width, strip_height):
+        data = src.read(1, window=window)
+        if src.nodata is not None:
+            data = data[data != src.nodata]
+        if data.dtype.kind == "f":
+            data = data[~np.isnan(data)]
+        if data.size:
+            min_value, max_value = min(min_value, data.min()), max(max_value, data.max())
+    return (0, 0) if min_value > max_value else (min_value, max_value)
+
+
+def _check_integer_dtype(name: str, dtype: np.dtype, min_value, max_value, nodata) -> None:
+    """raises a ValueError if the values or the nodata value of a layer do not fit into an integer dtype"""
+
+    if nodata is not None and np.isnan(nodata):
+        raise ValueError(f"nodata of {name} is nan, which cannot be stored as {dtype}")
+    values = [min_value, max_value] + ([nodata] if nodata is not None else [])
+    info = np.iinfo(dtype)
+    if min(values) < info.min or max(values) > info.max:
+        raise ValueError(f"Values of {name} ({min_value} to {max_value}, nodata {nodata}) do not fit into {dtype}")
+
+
+def write_feature_datacube(
+    path_to_datacube: str,
+    static_layers: list,
+    path_to_ref_grid: str,
+    ffmc_layers: dict = None,
+    chunk_size: int = 256,
+    dtypes: dict = None,
+) -> None:
+    """writes the static feature layers (and daily ffmc layers) into one chunked, compressed NetCDF datacube
+
+    All layers must be aligned to the reference grid. Every static layer becomes a variable (y, x)
+    stored with the smallest integer dtype that holds its values (float32 for float layers) and its
+    nodata value as _FillValue, ffmc becomes a variable (time, y, x). Only integer layers are read twice,
+    the first pass finds their value range. Chunks are chunk_size x chunk_size
+    cells (one date per chunk for ffmc), so a window of all variables is read with a few chunk reads.
+
+    Args:
+        path_to_datacube (str): output NetCDF file
+        static_layers (list): (variable name, path to raster) pairs
+        path_to_ref_grid (str): path to the reference grid raster
+        ffmc_layers (dict, optional): date (YYYY-MM-DD) -> path to the ffmc raster of that day. Defaults to None.
+        chunk_size (int, optional): edge length of the chunks. Defaults to 256.
+        dtypes (dict, optional): variable name -> dtype, overrides the compact dtypes. Defaults to None.
+
+    Raises:
+        ValueError: if a layer is not aligned to the reference grid or its values do not fit into the
+            integer dtype of dtypes
+    """
+
+    with rasterio.open(path_to_ref_grid) as ref_grid_src:
+        transform, crs = ref_grid_src.transform, ref_grid_src.crs
+        height, width = ref_grid_src.shape
+    ffmc_layers = dict(sorted((ffmc_layers or {}).items()))
+    dtypes = dtypes or {}
+
+    with nc.Dataset(path_to_datacube, "w") as ds:
+        ds.crs_wkt = crs.to_wkt()
+        ds.geotransform = list(transform)[:6]
+        ds.createDimension("y", height)
+        ds.createDimension("x", width)
+        ds.createVariable("y", "f8", ("y",))[:] = transform.f + (np.arange(height) + 0.5) * transform.e
+        ds.createVariable("x", "f8", ("x",))[:] = transform.c + (np.arange(width) + 0.5) * transform.a
+        chunks = (min(chunk_size, height), min(chunk_size, width))
+
+        layers = [(name, path, ("y", "x"), chunks) for name, path in static_layers]
+        if ffmc_layers:
+            ds.createDimension("time", len(ffmc_layers))
+            time_var = ds.createVariable("time", "i4", ("time",))
+            time_var.units = TIME_UNITS
+            time_var[:] = nc.date2num(pd.to_datetime(list(ffmc_layers)).to_pydatetime(), TIME_UNITS)
+            layers.append(("ffmc", list(ffmc_layers.values()), ("time", "y", "x"), (1, *chunks)))
+
+        for name, paths, dims, chunksizes in layers:
+            paths = [paths] if isinstance(paths, str) else paths
+            with rasterio.open(paths[0]) as src:
+                source_dtype, nodata = np.dtype(src.dtypes[0]), src.nodata
+            dtype = np.dtype(dtypes[name]) if name in dtypes else None
+            if dtype is None and source_dtype.kind == "f":
+                dtype = np.dtype("float32")
+            elif dtype is None or dtype.kind in "iu":
+                value_ranges = []
+                for path in paths:
+                    with rasterio.open(path) as src:
+                        value_ranges.append(_get_value_range(src, chunk_size))
+                min_value, max_value = min(r[0] for r in value_ranges), max(r[1] for r in value_ranges)
+                if dtype is None:
+                    dtype = get_compact_dtype(source_dtype, min_value, max_value, nodata)
+                else:
+                    _check_integer_dtype(name, dtype, min_value, max_value, nodata)
+            fill_value = None if nodata is None or (np.isnan(nodata) and dtype.kind != "f") else dtype.type(nodata)
+            var = ds.createVariable(name, dtype, dims, zlib=True, chunksizes=chunksizes, fill_value=fill_value)
+            var.set_auto_maskandscale(False)
+
+            for time_idx, path in enumerate(paths):
+                with rasterio.open(path) as src:
+                    if src.shape != (height, width) or not src.transform.almost_equals(transform):
+                        raise ValueError(f"Layer {path} is not aligned to the reference grid")
+                    for window in _iter_row_strips(height, width, chunk_size):
+                        rows = slice(window.row_off, window.row_off + window.height)
+                        data = src.read(1, window=window).astype(dtype)
+                        if len(dims) == 3:
+                            var[time_idx, rows, :] = data
+                        else:
+                            var[rows, :] = data
+
+
+class FeatureDatacube:
+    """
+    reader of a datacube written by write_feature_datacube, with window, point and region queries
+
+    Values are returned with the dtype and nodata value of the datacube (see nodata), except for
+    point queries, which return floats with nan for nodata.
+    """
+
+    def __init__(self, path_to_datacube: str):
+        self.ds = nc.Dataset(path_to_datacube, "r")
+        self.ds.set_auto_maskandscale(False)
+        self.transform = Affine(*self.ds.geotransform)
+        self.crs = CRS.from_wkt(self.ds.crs_wkt)
+        self.shape = (len(self.ds.dimensions["y"]), len(self.ds.dimensions["x"]))
+        self.dates = []
+        if "time" in self.ds.variables:
+            times = nc.num2date(self.ds.variables["time"][:], TIME_UNITS, only_use_cftime_datetimes=False)
+            self.dates = [time.strftime("%Y-%m-%d") for time in times]
+        self.static_variables = [name for name, var in self.ds.variables.items() if var.dimensions == ("y", "x")]
+        self.time_variables = [name for name, var in self.ds.variables.items()
+                               if var.dimensions == ("time", "y", "x")]
+        self.nodata = {name: getattr(self.ds.variables[name], "_FillValue", None)
+                       for name in self.static_variables + self.time_variables}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.ds.close()
+
+    def _select_variables(self, variables: list, date: str) -> list:
+        if variables is None:
+            variables = self.static_variables + (self.time_variables if date is not None else [])
+        for name in variables:
+            if name in self.time_variables and date is None:
+                raise ValueError(f"{name} has a time dimension, a date is required")
+        return variables
+
+    def _get_time_idx(self, date: str) -> int:
+        if date not in self.dates:
+            raise KeyError(f"No layers of {date} in the datacube")
+        return self.dates.index(date)
+
+    def _read(self, name: str, window: Window, time_idx: int = None) -> np.array:
+        rows = slice(window.row_off, window.row_off + window.height)
+        cols = slice(window.col_off, window.col_off + window.width)
+        var = self.ds.variables[name]
+        return var[time_idx, rows, cols] if name in self.time_variables else var[rows, cols]
+
+    def read_window(self, window: Window, variables: list = None, date: str = None) -> dict:
+        """values of the variables in a window of the grid
+
+        Args:
+            window (Window): window of the reference grid
+            variables (list, optional): variables to read. Defaults to all static variables
+                (and the variables with time dimension if a date is given).
+            date (str, optional): date (YYYY-MM-DD) of the variables with time dimension. Defaults to None.
+
+        Returns:
+            dict: variable name -> 2d array
+        """
+
+        variables = self._select_variables(variables, date)
+        time_idx = self._get_time_idx(date) if date is not None else None
+        return {name: self._read(name, window, time_idx) for name in variables}
+
+    def read_window_df(self, window: Window, variables: list = None, date: str = None) -> pd.DataFrame:
+        """values of the variables in a window as dataframe (one row per cell), like load_static_layers_into_df"""
+
+        return pd.DataFrame({name: values.flatten()
+                             for name, values in self.read_window(window, variables, date).items()})
+
+    def read_points(self, xs: np.array, ys: np.array, variables: list = None, dates=None) -> pd.DataFrame:
+        """values of the variables at point coordinates, nan for nodata and points outside of the grid
+
+        Args:
+            xs (np.array): x coordinates (crs of the datacube)
+            ys (np.array): y coordinates
+            variables (list, optional): variables to read. Defaults to all static variables
+                (and the variables with time dimension if dates are given).
+            dates (optional): one date for all points or the date of each point (YYYY-MM-DD). The
+                layers of the closest date in the datacube are used. Defaults to None.
+
+        Returns:
+            pd.DataFrame: one column per variable
+        """
+
+        variables = self._select_variables(variables, dates)
+        rows, cols = get_pixel_indices(self.transform, xs, ys)
+        if dates is not None:
+            dates = pd.Series(np.broadcast_to(np.asarray(dates, dtype=object), rows.shape))
+            time_idx = self._nearest_date_idx(dates)
+
+        data = {}
+        for name in variables:
+            block_size = self.ds.variables[name].chunking()[-1]
+            if name in self.static_variables:
+                values = sample_pixels(lambda window: self._read(name, window), rows, cols, self.shape, block_size)
+            else:
+                values = np.full(len(rows), np.nan)
+                for i in np.unique(time_idx):
+                    selected = np.flatnonzero(time_idx == i)
+                    values[selected] = sample_pixels(lambda window: self._read(name, window, i), rows[selected],
+                                                     cols[selected], self.shape, block_size)
+            if self.nodata[name] is not None:
+                values[values == self.nodata[name]] = np.nan
+            data[name] = values
+        return pd.DataFrame(data)
+
+    def _nearest_date_idx(self, dates: pd.Series) -> np.array:
+        """index of the closest date of the datacube for every date"""
+
+        days = (pd.to_datetime(self.dates) - pd.Timestamp("1970-01-01")).days.values
+        return get_nearest_idx(days, (pd.to_datetime(dates) - pd.Timestamp("1970-01-01")).dt.days.values)
+
+    def read_region(self, geometry, variables: list = None, date: str = None) -> tuple:
+        """values of the variables in the bounding window of a geometry and the mask of the cells inside it
+
+        Returns:
+            tuple: window, variable name -> 2d array, boolean mask (True inside the geometry)
+        """
+
+        height, width = self.shape
+        bounds = from_bounds(*geometry.bounds, transform=self.transform)
+        col_start, row_start = int(np.floor(bounds.col_off)), int(np.floor(bounds.row_off))
+        col_stop = int(np.ceil(bounds.col_off + bounds.width))
+        row_stop = int(np.ceil(bounds.row_off + bounds.height))
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start).intersection(
+            Window(0, 0, width, height))
+        window_transform = rasterio.windows.transform(window, self.transform)
+        mask = geometry_mask([geometry], out_shape=(window.height, window.width), transform=window_transform,
+                             invert=True)
+        return window, self.read_window(window, variables, date), mask
+
+
+def add_static_features_from_datacube(
+    event_data: gpd.GeoDataFrame, path_to_datacube: str, feature_info: list, time_stamped_feature_info: dict = None,
+    date_col: str = "date"
+) -> gpd.GeoDataFrame:
+    """adds static features from a feature datacube to dataframe, like add_static_features does from single rasters
+
+    Args:
+        event_data (gpd.GeoDataFrame): point geometries (crs of the datacube) with dates
+        path_to_datacube (str): datacube written by write_feature_datacube
+        feature_info (list): (column name, variable of the datacube) pairs
+        time_stamped_feature_info (dict, optional): column name -> {year: variable}, the variable of the
+            year closest to the date of an event is used (e.g. population census years). Defaults to None.
+        date_col (str, optional): column of the dates. Defaults to "date".
+
+    Returns:
+        gpd.GeoDataFrame: dataframe with labels and static features (nan for nodata)
+    """
+
+    xs, ys = event_data.geometry.x.values, event_data.geometry.y.values
+    with FeatureDatacube(path_to_datacube) as datacube:
+        features = datacube.read_points(xs, ys, [variable for _, variable in feature_info])
+        features.columns = [name for name, _ in feature_info]
+        for feature_name, variables in (time_stamped_feature_info or {}).items():
+            vintages = sorted(variables)
+            vintage_idx = get_nearest_vintage_idx(event_data[date_col], vintages)
+            values = np.full(len(event_data), np.nan)
+            for i, vintage in enumerate(vintages):
+                selected = np.flatnonzero(vintage_idx == i)
+                values[selected] = datacube.read_points(xs[selected], ys[selected], [variables[vintage]]).iloc[:, 0]
+            features[feature_name] = values
+    features.index = event_data.index
+
+    return gpd.GeoDataFrame(
+        pd.concat([event_data.drop(columns=features.columns, errors="ignore"), features], axis=1),
+        geometry="geometry", crs=event_data.crs
+    )
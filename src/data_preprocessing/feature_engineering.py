@@ -1,8 +1,10 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rasterio
 import pandas as pd
 import geopandas as gpd
+from rasterio.windows import Window
 
 
 def add_static_feature_from_raster(
@@ -31,45 +33,159 @@ def add_static_feature_from_raster(
     return gpd.GeoDataFrame(events_updated, geometry="geometry", crs="EPSG:31287")  # type: ignore
 
 
-def get_nearest_pop_value(row) -> float:
-    """choose population data from closest year
+def sample_pixels(read_window, rows: np.array, cols: np.array, shape: tuple, block_size: int = 512) -> np.array:
+    """values of a grid at pixel indices, nan for indices outside of the grid
+
+    Only blocks of block_size x block_size pixels that contain indices are read.
 
     Args:
-        row (str): one row of dataframe
+        read_window: function Window -> 2d array of the values in the window
+        rows (np.array): row indices
+        cols (np.array): column indices
+        shape (tuple): shape of the grid
+        block_size (int, optional): edge length of the blocks. Defaults to 512.
+    """
+
+    values = np.full(len(rows), np.nan)
+    height, width = shape
+    inside = np.flatnonzero((rows >= 0) & (rows < height) & (cols >= 0) & (cols < width))
+
+    block_ids = (rows[inside] // block_size) * (width // block_size + 1) + cols[inside] // block_size
+    order = np.argsort(block_ids, kind="stable")
+    _, starts = np.unique(block_ids[order], return_index=True)
+    for block_points in np.split(inside[order], starts[1:]):
+        if len(block_points) == 0:
+            continue
+        row_off = rows[block_points[0]] // block_size * block_size
+        col_off = cols[block_points[0]] // block_size * block_size
+        window = Window(col_off, row_off, min(block_size, width - col_off), min(block_size, height - row_off))
+        data = read_window(window)
+        values[block_points] = data[rows[block_points] - row_off, cols[block_points] - col_off]
+    return values
+
+
+def get_pixel_indices(transform, xs: np.array, ys: np.array) -> tuple:
+    """rows and columns of the pixels that contain the coordinates (same pixel as src.index / src.sample)"""
+
+    cols, rows = ~transform * (np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+    return np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+
+
+def sample_raster(path_to_raster: str, xs: np.array, ys: np.array, block_size: int = 512) -> np.array:
+    """values of a raster at point coordinates, nan for nodata and points outside of the raster
+
+    The coordinates are converted to pixel indices with the affine transform of the raster, only
+    blocks of block_size x block_size pixels that contain points are read.
+    """
+
+    with rasterio.open(path_to_raster) as src:
+        rows, cols = get_pixel_indices(src.transform, xs, ys)
+        values = sample_pixels(lambda window: src.read(1, window=window), rows, cols, src.shape, block_size)
+        if src.nodata is not None:
+            values[values == src.nodata] = np.nan
+    return values
+
+
+def sample_rasters(
+    events: gpd.GeoDataFrame, feature_info: list, block_size: int = 512, max_workers: int = None
+) -> pd.DataFrame:
+    """values of several rasters at the locations of the point geometries, rasters are read in parallel threads
+
+    Args:
+        events (gpd.GeoDataFrame): point geometries
+        feature_info (list): (column name, path to raster) pairs
+        block_size (int, optional): size of the blocks that are read around the points. Defaults to 512.
+        max_workers (int, optional): number of threads. Defaults to the number of rasters.
 
     Returns:
-        float: population number per square km
+        pd.DataFrame: one column per raster (nan for nodata), index of events
     """
-    year = pd.to_datetime(row.date).year
-    nearest_year = min([2006, 2011, 2018, 2021], key=lambda x: abs(x - year))
-    pop_col_name = f"pop_{nearest_year}"
-    return row[pop_col_name]
+
+    xs, ys = events.geometry.x.values, events.geometry.y.values
+    with ThreadPoolExecutor(max_workers or len(feature_info) or 1) as executor:
+        columns = executor.map(lambda info: sample_raster(info[1], xs, ys, block_size), feature_info)
+        return pd.DataFrame(dict(zip([name for name, _ in feature_info], columns)), index=events.index)
+
+
+def get_nearest_vintage_idx(dates: pd.Series, vintages: list) -> np.array:
+    """index of the vintage (year) closest to the year of each date, the earlier vintage on ties
+
+    Args:
+        dates (pd.Series): dates of the events
+        vintages (list): years of the layers, sorted
+
+    Returns:
+        np.array: index into vintages for every date
+    """
+
+    return get_nearest_idx(np.asarray(vintages), pd.to_datetime(dates).dt.year.values)
+
+
+def get_nearest_idx(sorted_values: np.array, values: np.array) -> np.array:
+    """index of the closest of sorted_values for every value, the smaller one on ties"""
+
+    right = np.clip(np.searchsorted(sorted_values, values), 0, len(sorted_values) - 1)
+    left = np.clip(right - 1, 0, len(sorted_values) - 1)
+    return np.where(np.abs(values - sorted_values[left]) <= np.abs(sorted_values[right] - values), left, right)
+
+
+def sample_time_stamped_rasters(
+    events: gpd.GeoDataFrame, layers: dict, date_col: str = "date", block_size: int = 512, max_workers: int = None
+) -> np.array:
+    """values of a family of time-stamped rasters (e.g. population census years), every event is
+    sampled from the raster of the year closest to its date only
+
+    Args:
+        events (gpd.GeoDataFrame): point geometries with dates
+        layers (dict): year -> path to raster
+        date_col (str, optional): column of the dates. Defaults to "date".
+        block_size (int, optional): size of the blocks that are read around the points. Defaults to 512.
+        max_workers (int, optional): number of threads. Defaults to the number of rasters.
+
+    Returns:
+        np.array: values (nan for nodata)
+    """
+
+    vintages = sorted(layers)
+    vintage_idx = get_nearest_vintage_idx(events[date_col], vintages)
+    xs, ys = events.geometry.x.values, events.geometry.y.values
+
+    def sample_vintage(i: int) -> tuple:
+        selected = np.flatnonzero(vintage_idx == i)
+        return selected, sample_raster(layers[vintages[i]], xs[selected], ys[selected], block_size)
+
+    values = np.full(len(events), np.nan)
+    with ThreadPoolExecutor(max_workers or len(vintages)) as executor:
+        for selected, vintage_values in executor.map(sample_vintage, range(len(vintages))):
+            values[selected] = vintage_values
+    return values
 
 
 def add_static_features(
-    base_path: str, event_data: gpd.GeoDataFrame, feature_info: list
+    base_path: str, event_data: gpd.GeoDataFrame, feature_info: list, time_stamped_feature_info: dict = None
 ) -> gpd.GeoDataFrame:
     """adds static features from rasters to dataframe.
 
     Args:
         feature_info (list): Column names and paths to rasters are defined in feature_info list
+        time_stamped_feature_info (dict, optional): column name -> {year: path to raster}, the raster of
+            the year closest to the date of an event is used (e.g. population census years). Defaults to None.
 
     Returns:
         gpd.GeoDataFrame: dataframe with labels and static features
     """
 
-    for feature_name, rel_feature_layer_path in feature_info:
-        path_to_feature_layer = os.path.join(base_path, rel_feature_layer_path)
-        event_data = add_static_feature_from_raster(
-            event_data, path_to_feature_layer, feature_name
-        )
-
-    # creating population column, with population values closest to event data (drop others)
-    event_data["pop_dens"] = event_data.apply(get_nearest_pop_value, axis=1)
-    event_data = event_data.drop(
-        ["pop_2006", "pop_2011", "pop_2018", "pop_2021"], axis=1
-    )  # type: ignore
+    feature_info = [(feature_name, os.path.join(base_path, rel_feature_layer_path))
+                    for feature_name, rel_feature_layer_path in feature_info]
+    features = sample_rasters(event_data, feature_info)
+    for feature_name, layers in (time_stamped_feature_info or {}).items():
+        layers = {year: os.path.join(base_path, path) for year, path in layers.items()}
+        features[feature_name] = sample_time_stamped_rasters(event_data, layers)
 
+    event_data = gpd.GeoDataFrame(
+        pd.concat([event_data.drop(columns=features.columns, errors="ignore"), features], axis=1),
+        geometry="geometry", crs="EPSG:31287"
+    )
     return event_data
 
 
@@ -68,3 +68,144 @@ def calculate_ffmc(ffmc0, rhum, temp, prcp, wind):
     if ffmc <= 0.0:
         ffmc = 0.0
     return ffmc
+
+
+def _as_float_array(values) -> np.ndarray:
+    """converts scalars, arrays and masked arrays to float arrays, masked cells are set to NaN"""
+    if np.ma.isMaskedArray(values):
+        return values.astype(np.float64).filled(np.nan)
+    return np.asarray(values, dtype=np.float64)
+
+
+def _prepare_ffmc_inputs(ffmc0, rhum, temp, prcp, wind) -> tuple:
+    """broadcasts ffmc inputs to float arrays and applies the clipping of rhum and prcp
+
+    Returns:
+        tuple: is_masked, invalid (NaN in any input), ffmc0, rhum, temp, prcp, wind
+    """
+    is_masked = any(np.ma.isMaskedArray(a) for a in (ffmc0, rhum, temp, prcp, wind))
+    ffmc0, rhum, temp, prcp, wind = np.broadcast_arrays(
+        *[_as_float_array(a) for a in (ffmc0, rhum, temp, prcp, wind)])
+
+    with np.errstate(invalid="ignore"):
+        invalid = np.isnan(ffmc0 + rhum + temp + prcp + wind)
+    rhum = np.minimum(rhum, 100.0)
+    prcp = np.where(np.isinf(prcp), 0.0, prcp)
+    return is_masked, invalid, ffmc0, rhum, temp, prcp, wind
+
+
+def _finalize_ffmc(ffmc: np.ndarray, invalid: np.ndarray, is_masked: bool):
+    """clips ffmc to [0, 101] and sets cells with invalid input to NaN (or masks them)"""
+    ffmc = np.where(invalid, np.nan, np.clip(ffmc, 0.0, 101.0))
+    if is_masked:
+        return np.ma.masked_invalid(ffmc)
+    return ffmc
+
+
+def _add_rain_to_moisture(mo: np.ndarray, rain: np.ndarray, rf: np.ndarray) -> np.ndarray:
+    """rain phase of the ffmc calculation, only evaluated for cells where rain is True"""
+    if not rain.any():
+        return mo
+    mo_r = mo[rain]
+    rf = rf[rain]
+    mo_rain = mo_r + 42.5 * rf * np.exp(-100.0 / (251.0 - mo_r)) * (1.0 - np.exp(-6.93 / rf))
+    mo_rain = np.where(mo_r > 150.0, mo_rain + (.0015 * (mo_r - 150.0) ** 2) * np.sqrt(rf), mo_rain)
+    mo = np.array(mo, copy=True)
+    mo[rain] = np.minimum(mo_rain, 250.0)
+    return mo
+
+
+def _equilibrium_moisture_contents(rhum: np.ndarray, temp: np.ndarray) -> tuple:
+    """equilibrium moisture content for drying (ed) and wetting (ew)"""
+    humidity_term = np.exp((rhum - 100.0) / 10.0)
+    temperature_term = (21.1 - temp) * (1.0 - 1.0 / np.exp(.115 * rhum))
+    ed = .942 * (rhum ** .679) + 11.0 * humidity_term + 0.18 * temperature_term
+    ew = .618 * (rhum ** .753) + 10.0 * humidity_term + .18 * temperature_term
+    return ed, ew
+
+
+def _log_moisture_rate(rhum: np.ndarray, temp: np.ndarray, wind: np.ndarray, drying: np.ndarray,
+                       temperature_factor: float) -> np.ndarray:
+    """log drying rate (drying cells) or log wetting rate (all other cells)"""
+    # drying uses rhum, wetting uses (100 - rhum)
+    rhum_fraction = np.where(drying, rhum, 100.0 - rhum) / 100.0
+    kl = .424 * (1.0 - rhum_fraction ** 1.7) + (.0694 * np.sqrt(wind)) * (1.0 - rhum_fraction ** 8)
+    return kl * (temperature_factor * np.exp(.0365 * temp))
+
+
+def calculate_ffmc_array(ffmc0, rhum, temp, prcp, wind):
+    """array implementation of calculate_ffmc (Van Wagner FFMC equations)
+
+    Computes the same branches as the scalar reference calculate_ffmc, but for whole grids
+    (or stacks of grids) at once. Inputs are broadcast against each other. NaN in any input
+    results in NaN, masked cells in any input result in masked cells.
+
+    Args:
+        ffmc0 (array_like): ffmc of the previous day
+        rhum (array_like): relative humidity in %
+        temp (array_like): temperature in °C
+        prcp (array_like): precipitation in mm
+        wind (array_like): wind speed
+
+    Returns:
+        np.ndarray: ffmc values (np.ma.MaskedArray if any input is a masked array)
+    """
+
+    is_masked, invalid, ffmc0, rhum, temp, prcp, wind = _prepare_ffmc_inputs(
+        ffmc0, rhum, temp, prcp, wind)
+
+    with np.errstate(all="ignore"):
+        mo = (147.2 * (101.0 - ffmc0)) / (59.5 + ffmc0)
+
+        # daily rain phase only for cells with more than 0.5 mm of rain
+        mo = _add_rain_to_moisture(mo, prcp > 0.5, prcp - 0.5)
+
+        ed, ew = _equilibrium_moisture_contents(rhum, temp)
+        drying = mo > ed
+        wetting = (mo < ed) & (mo <= ew)
+
+        kw = _log_moisture_rate(rhum, temp, wind, drying, .581)
+        m = np.where(drying, ed + (mo - ed) / 10.0 ** kw,
+                     np.where(wetting, ew - (ew - mo) / 10.0 ** kw, mo))
+
+        ffmc = (59.5 * (250.0 - m)) / (147.2 + m)
+
+    return _finalize_ffmc(ffmc, invalid, is_masked)
+
+
+def calculate_hourly_ffmc_array(ffmc0, rhum, temp, prcp, wind, hours: float = 1.0):
+    """hourly ffmc after Van Wagner (1977), array version
+
+    Same formulation as the hffmc routine of the cffdrs package: rain of the time step is added
+    without the 0.5 mm interception of the daily code and drying/wetting rates are given per hour.
+
+    Args:
+        ffmc0 (array_like): ffmc of the previous time step
+        rhum (array_like): relative humidity in %
+        temp (array_like): temperature in °C
+        prcp (array_like): precipitation of the time step in mm
+        wind (array_like): wind speed
+        hours (float, optional): length of the time step in hours. Defaults to 1.0.
+
+    Returns:
+        np.ndarray: ffmc values (np.ma.MaskedArray if any input is a masked array)
+    """
+
+    is_masked, invalid, ffmc0, rhum, temp, prcp, wind = _prepare_ffmc_inputs(
+        ffmc0, rhum, temp, prcp, wind)
+
+    with np.errstate(all="ignore"):
+        mo = (147.27723 * (101.0 - ffmc0)) / (59.5 + ffmc0)
+        mo = _add_rain_to_moisture(mo, prcp > 0.0, prcp)
+
+        ed, ew = _equilibrium_moisture_contents(rhum, temp)
+        drying = mo > ed
+        wetting = ~drying & (mo < ew)
+
+        k = _log_moisture_rate(rhum, temp, wind, drying, .0579)
+        m = np.where(drying, ed + (mo - ed) * 10.0 ** (-k * hours),
+                     np.where(wetting, ew - (ew - mo) * 10.0 ** (-k * hours), mo))
+
+        ffmc = (59.5 * (250.0 - m)) / (147.27723 + m)
+
+    return _finalize_ffmc(ffmc, invalid, is_masked)
@@ -1,4 +1,8 @@
+import numpy as np
 import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.windows import Window
 
 
 def create_density_layer_vector(input_layer: gpd.GeoDataFrame, ref_grid_vector: gpd.GeoDataFrame, path_to_density_vector_layer: str, density_function, attribute_name: str = "density"):
@@ -40,3 +44,191 @@ def calculate_area(feature_overlay):
 def calculate_length(feature_overlay):
     """Calculate the length of intersecting features."""
     return feature_overlay.geometry.length
+
+
+def _get_pixel_coordinates(transform, xs: np.array, ys: np.array) -> tuple:
+    """fractional column and row of coordinates (north up grids only)"""
+
+    return (xs - transform.c) / transform.a, (ys - transform.f) / transform.e
+
+
+def _get_cell_ranges(transform, shape: tuple, geometries: np.array) -> tuple:
+    """first and last (exclusive) row and column of the cells touched by the bounding box of each geometry"""
+
+    bounds = shapely.bounds(geometries)
+    col_start, row_start = _get_pixel_coordinates(transform, bounds[:, 0], bounds[:, 3])
+    col_stop, row_stop = _get_pixel_coordinates(transform, bounds[:, 2], bounds[:, 1])
+    row_start = np.clip(np.floor(row_start), 0, shape[0] - 1).astype(int)
+    col_start = np.clip(np.floor(col_start), 0, shape[1] - 1).astype(int)
+    # geometries on a grid line still cover one cell
+    row_stop = np.clip(np.ceil(row_stop), row_start + 1, shape[0]).astype(int)
+    col_stop = np.clip(np.ceil(col_stop), col_start + 1, shape[1]).astype(int)
+    return row_start, row_stop, col_start, col_stop
+
+
+def _expand_ranges(starts: np.array, stops: np.array) -> tuple:
+    """index of the range and value for every value of the ranges [start, stop)"""
+
+    counts = stops - starts
+    range_idx = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return range_idx, starts[range_idx] + offsets
+
+
+def accumulate_length(geometries: np.array, transform, shape: tuple, window: Window = None) -> np.array:
+    """length of the lines in each cell of a grid
+
+    Every line segment is split at the grid lines it crosses and the length of each piece is added to the
+    cell of its midpoint, so no cell polygons are needed. Cells are half-open, a piece on a grid line
+    belongs to the cell right of or below it (left of or above it on the outer edge of the grid). Pieces
+    outside of the grid are ignored.
+
+    Args:
+        geometries (np.array): (multi)linestrings in the crs of the grid
+        transform (Affine): transform of the grid
+        shape (tuple): rows and columns of the grid
+        window (Window, optional): only the cells of this window are returned, the lines may extend
+            beyond it. Pieces on the edge between two windows are counted in one of them. Defaults to None.
+
+    Returns:
+        np.array: grid (or window) with the line length per cell
+    """
+
+    coords, line_idx = shapely.get_coordinates(shapely.get_parts(geometries), return_index=True)
+    # segments between consecutive vertices of the same part
+    same_line = line_idx[1:] == line_idx[:-1]
+    start, end = coords[:-1][same_line], coords[1:][same_line]
+    cols_0, rows_0 = _get_pixel_coordinates(transform, start[:, 0], start[:, 1])
+    cols_1, rows_1 = _get_pixel_coordinates(transform, end[:, 0], end[:, 1])
+    lengths = np.hypot(*(end - start).T)
+
+    # segment parameters t in [0, 1] at the segment ends and at every crossed column and row line
+    t = [np.zeros(len(start)), np.ones(len(start))]
+    segment_idx = [np.arange(len(start))] * 2
+    for pixel_0, pixel_1 in ((cols_0, cols_1), (rows_0, rows_1)):
+        first_line = np.floor(np.minimum(pixel_0, pixel_1)) + 1
+        last_line = np.ceil(np.maximum(pixel_0, pixel_1))
+        idx, lines = _expand_ranges(first_line.astype(int), np.maximum(last_line, first_line).astype(int))
+        t.append((lines - pixel_0[idx]) / (pixel_1[idx] - pixel_0[idx]))
+        segment_idx.append(idx)
+    t, segment_idx = np.concatenate(t), np.concatenate(segment_idx)
+    order = np.lexsort((t, segment_idx))
+    t, segment_idx = t[order], segment_idx[order]
+
+    # pieces between consecutive parameters of the same segment
+    same_segment = segment_idx[1:] == segment_idx[:-1]
+    idx, t_0, t_1 = segment_idx[:-1][same_segment], t[:-1][same_segment], t[1:][same_segment]
+    t_mid = (t_0 + t_1) / 2
+    cols = cols_0[idx] + t_mid * (cols_1[idx] - cols_0[idx])
+    rows = rows_0[idx] + t_mid * (rows_1[idx] - rows_0[idx])
+    weights = (t_1 - t_0) * lengths[idx]
+    inside = (cols >= 0) & (cols <= shape[1]) & (rows >= 0) & (rows <= shape[0])
+    cols = np.minimum(np.floor(cols[inside]), shape[1] - 1).astype(int)
+    rows = np.minimum(np.floor(rows[inside]), shape[0] - 1).astype(int)
+    weights = weights[inside]
+
+    if window is not None:
+        inside = (cols >= window.col_off) & (cols < window.col_off + window.width) & \
+            (rows >= window.row_off) & (rows < window.row_off + window.height)
+        cols, rows, weights = cols[inside] - window.col_off, rows[inside] - window.row_off, weights[inside]
+        shape = (window.height, window.width)
+    density = np.bincount(rows * shape[1] + cols, weights=weights, minlength=shape[0] * shape[1])
+    return density.reshape(shape)
+
+
+def accumulate_area(geometries: np.array, transform, shape: tuple, window: Window = None) -> np.array:
+    """area of the polygons in each cell of a grid
+
+    The polygons are clipped to the rows of the grid they touch and the row pieces to the cells they touch,
+    so only cells in the bounding box of a row piece are intersected.
+
+    Args:
+        geometries (np.array): (multi)polygons in the crs of the grid
+        transform (Affine): transform of the grid
+        shape (tuple): rows and columns of the grid
+        window (Window, optional): only the cells of this window are returned, the polygons may extend
+            beyond it. Defaults to None.
+
+    Returns:
+        np.array: grid (or window) with the polygon area per cell
+    """
+
+    if window is not None:
+        # the edges between windows have no area, so the polygons can be clipped to the window
+        geometries = shapely.clip_by_rect(geometries, *rasterio.windows.bounds(window, transform))
+        transform, shape = rasterio.windows.transform(window, transform), (window.height, window.width)
+    density = np.zeros(shape[0] * shape[1])
+    geometries = geometries[~shapely.is_empty(geometries)]
+    if not len(geometries):
+        return density.reshape(shape)
+    xmin, ymax = transform.c, transform.f
+    xmax = xmin + shape[1] * transform.a
+
+    row_start, row_stop, _, _ = _get_cell_ranges(transform, shape, geometries)
+    geometry_idx, rows = _expand_ranges(row_start, row_stop)
+    row_pieces = shapely.intersection(geometries[geometry_idx], shapely.box(xmin, ymax + (rows + 1) * transform.e,
+                                                               xmax, ymax + rows * transform.e))
+    non_empty = ~shapely.is_empty(row_pieces)
+    row_pieces, rows = row_pieces[non_empty], rows[non_empty]
+
+    _, _, col_start, col_stop = _get_cell_ranges(transform, shape, row_pieces)
+    piece_idx, cols = _expand_ranges(col_start, col_stop)
+    rows = rows[piece_idx]
+    cells = shapely.box(xmin + cols * transform.a, ymax + (rows + 1) * transform.e,
+                        xmin + (cols + 1) * transform.a, ymax + rows * transform.e)
+    areas = shapely.area(shapely.intersection(row_pieces[piece_idx], cells))
+    density += np.bincount(rows * shape[1] + cols, weights=areas, minlength=len(density))
+    return density.reshape(shape)
+
+
+DENSITY_ACCUMULATORS = {
+    "length": accumulate_length,
+    "area": accumulate_area,
+}
+
+
+def create_density_layer_raster(input_layer: gpd.GeoDataFrame, path_to_ref_grid: str, path_to_density_layer: str,
+                                measure: str = "length", tile_size: int = 1024):
+    """Creates a raster layer storing the length or area of intersecting features for each cell.
+
+    Raster version of create_density_layer_vector followed by gdal_rasterize_vector_layer: the features of
+    each tile of the reference grid are clipped to the tile (plus a margin of one cell) and their length or
+    area is accumulated into the cells of the tile directly, without a vectorized reference grid or an
+    intermediate shapefile. Lines on the edge between two tiles are counted once. Cells without features are 0.
+
+    Args:
+        input_layer (gpd.GeoDataFrame): Vector layer containing features (lines for "length", polygons for "area").
+        path_to_ref_grid (str): Path to the reference grid raster.
+        path_to_density_layer (str): Path of the density layer (GeoTIFF).
+        measure (str, optional): "length" or "area". Defaults to "length".
+        tile_size (int, optional): Edge length of the tiles in cells. Defaults to 1024.
+    """
+
+    if measure not in DENSITY_ACCUMULATORS:
+        raise ValueError(f"Unknown measure {measure}, use one of {list(DENSITY_ACCUMULATORS)}")
+    accumulate = DENSITY_ACCUMULATORS[measure]
+
+    with rasterio.open(path_to_ref_grid) as ref_grid_src:
+        profile = ref_grid_src.profile
+        transform, crs = ref_grid_src.transform, ref_grid_src.crs
+        height, width = ref_grid_src.shape
+    if transform.b != 0 or transform.d != 0:
+        raise ValueError("Rotated reference grids are not supported")
+    if input_layer.crs is not None and crs is not None and input_layer.crs != crs:
+        input_layer = input_layer.to_crs(crs)
+
+    geometries = input_layer.geometry.values
+    spatial_index = input_layer.sindex
+    profile.update(driver="GTiff", count=1, dtype="float64", nodata=None, compress="deflate")
+
+    with rasterio.open(path_to_density_layer, "w", **profile) as dst:
+        for row_off in range(0, height, tile_size):
+            for col_off in range(0, width, tile_size):
+                window = Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+                # lines on the tile edges are inside the margin, clip_by_rect drops lines on the clip edges
+                tile_bounds = rasterio.windows.bounds(Window(col_off - 1, row_off - 1, window.width + 2,
+                                                             window.height + 2), transform)
+                tile_geometries = np.asarray(geometries[spatial_index.query(shapely.box(*tile_bounds))])
+                tile_geometries = shapely.clip_by_rect(tile_geometries, *tile_bounds)
+                density = accumulate(tile_geometries, transform, (height, width), window)
+                dst.write(density, 1, window=window)
@@ -1,222 +1,239 @@
 import pandas as pd
 import pymc as pm
 import numpy as np
-
-
-# For FFMC adjustment. Grouping based on CC, EXP & FT
-
-
-def create_st_blr(
+import pytensor.tensor as pt
+
+
+def create_group_coefficients(
+    name: str,
+    mu,
+    sigma,
+    dims,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    nu: float = 4,
+):
+    """
+    group level coefficients with location mu and scale sigma
+
+    "centered" draws the coefficients directly (pm.Cauchy/pm.StudentT/pm.Normal named name).
+    "non_centered" draws standardized offsets name_offset and returns the deterministic
+    name = mu + sigma * offset, which removes the funnel between sigma and the coefficients that makes
+    NUTS take tiny steps. Cauchy and Student-t offsets are drawn as normal scale mixtures
+    (offset = normal / sqrt(Gamma(nu / 2, nu / 2))), which are easier to sample than the heavy tails.
+
+    Args:
+        name (str): name of the coefficients
+        mu: location (hyperprior)
+        sigma: scale (hyperprior)
+        dims: dims of the coefficients
+        parameterization (str, optional): "centered" or "non_centered". Defaults to "centered".
+        distribution (str, optional): "cauchy", "student_t" or "normal". Defaults to "cauchy".
+        nu (float, optional): degrees of freedom of "student_t". Defaults to 4.
+    """
+
+    if distribution not in ("cauchy", "student_t", "normal"):
+        raise ValueError(f"Unknown distribution {distribution}")
+    if parameterization == "centered":
+        if distribution == "cauchy":
+            return pm.Cauchy(name, mu, sigma, dims=dims)
+        if distribution == "student_t":
+            return pm.StudentT(name, nu=nu, mu=mu, sigma=sigma, dims=dims)
+        return pm.Normal(name, mu, sigma, dims=dims)
+    if parameterization != "non_centered":
+        raise ValueError(f"Unknown parameterization {parameterization}")
+
+    offset = pm.Normal(f"{name}_offset", 0, 1, dims=dims)
+    if distribution != "normal":
+        nu = 1 if distribution == "cauchy" else nu
+        precision = pm.Gamma(f"{name}_precision", nu / 2, nu / 2, dims=dims)
+        offset = offset / pm.math.sqrt(precision)
+    return pm.Deterministic(name, mu + sigma * offset, dims=dims)
+
+
+# (column in the training data, feature name) of the categorical features of the BLR models, the
+# data container of a feature is called <name>, its coefficient beta_<name> with the dim <name>_classes.
+# The data columns of training and the coefficients of the predictors are derived from this list.
+BLR_CLASS_FEATURES = [
+    ("elevation_encoded", "elevation"),
+    ("slope_encoded", "slope"),
+    ("aspect_encoded", "aspect"),
+    ("forestroad_density_bin", "forestroad_density"),
+    ("railway_density_bin", "railway_density"),
+    ("hikingtrail_density_bin", "hikingtrail_density"),
+    ("farmyard_density_bin", "farmyard_density"),
+    ("population_encoded", "population"),
+    ("forest_type", "forest_type"),
+]
+
+
+# with aggregate=None, the builders fit the aggregated rows if there are at most this fraction of unique rows
+AUTO_AGGREGATE_MAX_UNIQUE_FRACTION = 0.5
+
+
+def aggregate_patterns(X: pd.DataFrame, y: pd.Series, grouping_variables: list = None) -> tuple:
+    """
+    collapses training rows with the same features (class features, ffmc and grouping variables)
+    into one row with the number of fires and the number of rows
+
+    The Binomial likelihood of the unique rows has the same gradient as the Bernoulli likelihood of
+    all rows (the logp differs by the constant sum of log binomial coefficients), its cost depends
+    on the number of unique rows only. ffmc is matched exactly, rounding it beforehand gives fewer
+    rows but an approximate model.
+
+    Returns:
+        tuple: unique rows, number of fires and number of rows of each unique row
+    """
+
+    columns = [column for column, _ in BLR_CLASS_FEATURES] + ["ffmc"] + \
+        [column for column in grouping_variables or [] if column is not None]
+    counts = X[columns].assign(fire_labels=np.asarray(y)).groupby(columns, sort=False, dropna=False)[
+        "fire_labels"].agg(["sum", "count"]).reset_index()
+    return counts[columns], counts["sum"], counts["count"].values
+
+
+def create_likelihood(p, fire_labels, n_trials: np.array = None, total_size: int = None):
+    """Bernoulli likelihood of the fire labels, Binomial likelihood of fire counts of n_trials rows"""
+
+    if n_trials is None:
+        return pm.Bernoulli("y_pred", p, observed=fire_labels, total_size=total_size)
+    if total_size is not None:
+        raise ValueError("Aggregated rows cannot be used as minibatches (total_size)")
+    trials = pm.MutableData("n_trials", n_trials)
+    return pm.Binomial("y_pred", trials, p, observed=fire_labels)
+
+
+def _gather_and_sum(coefficients, idx):
+    """sum of coefficients[idx] over the features, idx (obs, features) into a vector of coefficients"""
+
+    # a 1d gather has faster (C) implementations of the op and its gradient than a 2d one
+    return coefficients[idx.flatten()].reshape(idx.shape).sum(axis=1)
+
+
+def create_stacked_blr(
     X: pd.DataFrame,
     y: pd.Series,
     coords: dict,
-    spatial_grouping_variable: str,
-    temporal_grouping_variable: str,
+    grouping: str = "none",
+    spatial_grouping_variable: str = None,
+    temporal_grouping_variable: str = None,
+    total_size: int = None,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    aggregate: bool = None,
 ) -> pm.Model:
+    """
+    BLR model with the class coefficients of all categorical features concatenated in the graph, so
+    the linear predictor is a single gather and sum
+
+    The categorical features have one data container each (named like the features), they are
+    stacked into one index matrix in the graph. The free variables have the names of the original
+    builders (beta_<name> with the dims <name>_classes plus the group dims if grouped, hyperpriors
+    mu_b<i>/sigma_b<i>), so traces of these builders can warm start the models.
+
+    Args:
+        X (pd.DataFrame): training data
+        y (pd.Series): fire labels
+        coords (dict): coords of the model, <name>_classes of every feature (and the groups if grouped)
+        grouping (str, optional): "none" (one coefficient per class), "intercept" (intercept per
+            spatial and temporal group) or "all" (all coefficients per group, with hyperpriors per
+            feature). Defaults to "none".
+        spatial_grouping_variable (str, optional): column of the spatial groups. Defaults to None.
+        temporal_grouping_variable (str, optional): column of the temporal groups. Defaults to None.
+        total_size (int, optional): number of training samples if X and y are only a minibatch of
+            them, the likelihood is scaled accordingly. Defaults to None.
+        parameterization (str, optional): of the group level coefficients, see create_group_coefficients.
+            Defaults to "centered".
+        distribution (str, optional): of the group level coefficients, see create_group_coefficients.
+            Defaults to "cauchy".
+        aggregate (bool, optional): fit the Binomial likelihood of the unique rows, see
+            aggregate_patterns. None aggregates if the data is not a minibatch (total_size) and there
+            are at most AUTO_AGGREGATE_MAX_UNIQUE_FRACTION unique rows. Defaults to None.
+    """
+
+    if grouping not in ("none", "intercept", "all"):
+        raise ValueError(f"Unknown grouping {grouping}")
+    n_trials = None
+    if aggregate or (aggregate is None and total_size is None):
+        X_unique, fires, trials = aggregate_patterns(X, y, [spatial_grouping_variable, temporal_grouping_variable])
+        if aggregate or len(X_unique) <= AUTO_AGGREGATE_MAX_UNIQUE_FRACTION * len(X):
+            X, y, n_trials = X_unique, fires, trials
+
+    n_classes = [len(coords[f"{name}_classes"]) for _, name in BLR_CLASS_FEATURES]
+    offsets = np.concatenate([[0], np.cumsum(n_classes)[:-1]])
+    group_dims = ("spatial_groups", "temporal_groups")
+
     with pm.Model(coords=coords) as model:  # type: ignore
         # data containers
-        elevation = pm.MutableData("elevation", X.elevation_encoded)
-        slope = pm.MutableData("slope", X.slope_encoded)
-        aspect = pm.MutableData("aspect", X.aspect_encoded)
-        forestroad_density = pm.MutableData(
-            "forestroad_density", X.forestroad_density_bin
-        )
-        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
-        hikingtrail_density = pm.MutableData(
-            "hikingtrail_density", X.hikingtrail_density_bin
-        )
-        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
-        population = pm.MutableData("population", X.population_encoded)
-        forest_type = pm.MutableData("forest_type", X.forest_type)
+        class_features = [pm.MutableData(name, X[column]) for column, name in BLR_CLASS_FEATURES]
         ffmc = pm.MutableData("ffmc", X.ffmc)
         fire_labels = pm.MutableData("fire", y)
-        spatial_groups_idx = pm.MutableData(
-            "spatial_groups_idx", X[spatial_grouping_variable]
-        )
-        temporal_groups_idx = pm.MutableData(
-            "temporal_groups_idx", X[temporal_grouping_variable]
-        )
-
-        # Hyperpriors of features
-        mu_intercept, sigma_intercept = (
-            pm.Cauchy("mu_intercept", 0.0, 1.0),
-            pm.Exponential("sigma_intercept", 1),
-        )
-        mu_b1, sigma_b1 = pm.Cauchy("mu_b1", 0.0, 1.0), pm.Exponential("sigma_b1", 1)
-        mu_b2, sigma_b2 = pm.Cauchy("mu_b2", 0.0, 1.0), pm.Exponential("sigma_b2", 1)
-        mu_b3, sigma_b3 = pm.Cauchy("mu_b3", 0.0, 1.0), pm.Exponential("sigma_b3", 1)
-        mu_b4, sigma_b4 = pm.Cauchy("mu_b4", 0.0, 1.0), pm.Exponential("sigma_b4", 1)
-        mu_b5, sigma_b5 = pm.Cauchy("mu_b5", 0.0, 1.0), pm.Exponential("sigma_b5", 1)
-        mu_b6, sigma_b6 = pm.Cauchy("mu_b6", 0.0, 1.0), pm.Exponential("sigma_b6", 1)
-        mu_b7, sigma_b7 = pm.Cauchy("mu_b7", 0.0, 1.0), pm.Exponential("sigma_b7", 1)
-        mu_b8, sigma_b8 = pm.Cauchy("mu_b8", 0.0, 1.0), pm.Exponential("sigma_b8", 1)
-        mu_b9, sigma_b9 = pm.Cauchy("mu_b9", 0.0, 1.0), pm.Exponential("sigma_b9", 1)
-        mu_b10, sigma_b10 = (
-            pm.Cauchy("mu_b10", 0.0, 1.0),
-            pm.Exponential("sigma_b10", 1),
-        )
+        stacked_idx = pt.stack(class_features, axis=1).astype("int64") + offsets
+        if grouping != "none":
+            spatial_groups_idx = pm.MutableData(
+                "spatial_groups_idx", X[spatial_grouping_variable]
+            )
+            temporal_groups_idx = pm.MutableData(
+                "temporal_groups_idx", X[temporal_grouping_variable]
+            )
+
+        # hyperpriors, named (and created in the order) of the original builders
+        if grouping != "none":
+            mu_name, sigma_name = ("mu_b1", "sigma_b1") if grouping == "intercept" else \
+                ("mu_intercept", "sigma_intercept")
+            mu_intercept, sigma_intercept = pm.Cauchy(mu_name, 0.0, 1.0), pm.Exponential(sigma_name, 1)
+        if grouping == "all":
+            # mu_b1..mu_b9 of the class features, mu_b10 of ffmc
+            hyperpriors = [
+                (pm.Cauchy(f"mu_b{i}", 0.0, 1.0), pm.Exponential(f"sigma_b{i}", 1))
+                for i in range(1, len(BLR_CLASS_FEATURES) + 2)
+            ]
 
-        # specify priors for the features
-        intercept = pm.Cauchy(
-            "intercept",
-            mu_intercept,
-            sigma_intercept,
-            dims=("spatial_groups", "temporal_groups"),
-        )
-        beta_elevation = pm.Cauchy(
-            "beta_elevation",
-            mu_b1,
-            sigma_b1,
-            dims=("elevation_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_slope = pm.Cauchy(
-            "beta_slope",
-            mu_b2,
-            sigma_b2,
-            dims=("slope_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_aspect = pm.Cauchy(
-            "beta_aspect",
-            mu_b3,
-            sigma_b3,
-            dims=("aspect_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_forestroad_density = pm.Cauchy(
-            "beta_forestroad_density",
-            mu_b4,
-            sigma_b4,
-            dims=("forestroad_density_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_railway_density = pm.Cauchy(
-            "beta_railway_density",
-            mu_b5,
-            sigma_b5,
-            dims=("railway_density_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_hikingtrail_density = pm.Cauchy(
-            "beta_hikingtrail_density",
-            mu_b6,
-            sigma_b6,
-            dims=("hikingtrail_density_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_farmyard_density = pm.Cauchy(
-            "beta_farmyard_density",
-            mu_b7,
-            sigma_b7,
-            dims=("farmyard_density_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_population = pm.Cauchy(
-            "beta_population",
-            mu_b8,
-            sigma_b8,
-            dims=("population_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_forest_type = pm.Cauchy(
-            "beta_forest_type",
-            mu_b9,
-            sigma_b9,
-            dims=("forest_type_classes", "spatial_groups", "temporal_groups"),
-        )
-        beta_ffmc = pm.Cauchy(
-            "beta_ffmc", mu_b10, sigma_b10, dims=("spatial_groups", "temporal_groups")
-        )
+        if grouping == "none":
+            intercept = pm.Cauchy("intercept", 0, 1)
+        else:
+            intercept = create_group_coefficients(
+                "intercept", mu_intercept, sigma_intercept, group_dims, parameterization, distribution
+            )[spatial_groups_idx, temporal_groups_idx]
+
+        if grouping == "all":
+            betas = [
+                create_group_coefficients(
+                    f"beta_{name}", mu, sigma, (f"{name}_classes", *group_dims), parameterization, distribution
+                )
+                for (_, name), (mu, sigma) in zip(BLR_CLASS_FEATURES, hyperpriors)
+            ]
+            beta_ffmc = create_group_coefficients(
+                "beta_ffmc", *hyperpriors[-1], group_dims, parameterization, distribution
+            )
+            n_spatial, n_temporal = len(coords["spatial_groups"]), len(coords["temporal_groups"])
+            stacked_idx = (
+                stacked_idx * n_spatial + spatial_groups_idx[:, None]
+            ) * n_temporal + temporal_groups_idx[:, None]
+            class_effects = _gather_and_sum(pt.concatenate(betas).flatten(), stacked_idx)
+            ffmc_effect = beta_ffmc[spatial_groups_idx, temporal_groups_idx] * ffmc
+        else:
+            betas = [pm.Cauchy(f"beta_{name}", 0, 1, dims=f"{name}_classes") for _, name in BLR_CLASS_FEATURES]
+            beta_ffmc = pm.Cauchy("beta_ffmc", 0, 1)
+            class_effects = _gather_and_sum(pt.concatenate(betas), stacked_idx)
+            ffmc_effect = beta_ffmc * ffmc
         error_var = pm.Cauchy("error_beta", 0, 1)
 
-        mean = (
-            intercept[spatial_groups_idx, temporal_groups_idx]
-            + beta_elevation[elevation, spatial_groups_idx, temporal_groups_idx]
-            + beta_slope[slope, spatial_groups_idx, temporal_groups_idx]
-            + beta_aspect[aspect, spatial_groups_idx, temporal_groups_idx]
-            + beta_forestroad_density[
-                forestroad_density, spatial_groups_idx, temporal_groups_idx
-            ]
-            + beta_railway_density[
-                railway_density, spatial_groups_idx, temporal_groups_idx
-            ]
-            + beta_hikingtrail_density[
-                hikingtrail_density, spatial_groups_idx, temporal_groups_idx
-            ]
-            + beta_farmyard_density[
-                farmyard_density, spatial_groups_idx, temporal_groups_idx
-            ]
-            + beta_population[population, spatial_groups_idx, temporal_groups_idx]
-            + beta_forest_type[forest_type, spatial_groups_idx, temporal_groups_idx]
-            + beta_ffmc[spatial_groups_idx, temporal_groups_idx] * ffmc
-            + error_var
-        )
+        mean = intercept + class_effects + ffmc_effect + error_var
 
         z = pm.Deterministic("z", mean)
         p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
-        y_pred = pm.Bernoulli("y_pred", p, observed=fire_labels)
+        y_pred = create_likelihood(p, fire_labels, n_trials, total_size)
 
         return model
 
 
-def create_blr(X: pd.DataFrame, y: pd.Series, coords: dict) -> pm.Model:
-    with pm.Model(coords=coords) as model:  # type: ignore
-        # data containers
-        elevation = pm.MutableData("elevation", X.elevation_encoded)
-        slope = pm.MutableData("slope", X.slope_encoded)
-        aspect = pm.MutableData("aspect", X.aspect_encoded)
-        forestroad_density = pm.MutableData(
-            "forestroad_density", X.forestroad_density_bin
-        )
-        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
-        hikingtrail_density = pm.MutableData(
-            "hikingtrail_density", X.hikingtrail_density_bin
-        )
-        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
-        population = pm.MutableData("population", X.population_encoded)
-        forest_type = pm.MutableData("forest_type", X.forest_type)
-        ffmc = pm.MutableData("ffmc", X.ffmc)
-        fire_labels = pm.MutableData("fire", y)
-
-        # specify priors for the features
-        intercept = pm.Cauchy("intercept", 0, 1)
-        beta_elevation = pm.Cauchy("beta_elevation", 0, 1, dims=("elevation_classes"))
-        beta_slope = pm.Cauchy("beta_slope", 0, 1, dims=("slope_classes"))
-        beta_aspect = pm.Cauchy("beta_aspect", 0, 1, dims=("aspect_classes"))
-        beta_forestroad_density = pm.Cauchy(
-            "beta_forestroad_density", 0, 1, dims=("forestroad_density_classes")
-        )
-        beta_railway_density = pm.Cauchy(
-            "beta_railway_density", 0, 1, dims=("railway_density_classes")
-        )
-        beta_hikingtrail_density = pm.Cauchy(
-            "beta_hikingtrail_density", 0, 1, dims=("hikingtrail_density_classes")
-        )
-        beta_farmyard_density = pm.Cauchy(
-            "beta_farmyard_density", 0, 1, dims=("farmyard_density_classes")
-        )
-        beta_population = pm.Cauchy(
-            "beta_population", 0, 1, dims=("population_classes")
-        )
-        beta_forest_type = pm.Cauchy(
-            "beta_forest_type", 0, 1, dims=("forest_type_classes")
-        )
-        beta_ffmc = pm.Cauchy("beta_ffmc", 0, 1)
-        error_var = pm.Cauchy("error_beta", 0, 1)
-
-        mean = (
-            intercept
-            + beta_elevation[elevation]
-            + beta_slope[slope]
-            + beta_aspect[aspect]
-            + beta_forestroad_density[forestroad_density]
-            + beta_railway_density[railway_density]
-            + beta_hikingtrail_density[hikingtrail_density]
-            + beta_farmyard_density[farmyard_density]
-            + beta_population[population]
-            + beta_forest_type[forest_type]
-            + beta_ffmc * ffmc
-            + error_var
-        )
+def create_blr(
+    X: pd.DataFrame, y: pd.Series, coords: dict, total_size: int = None, aggregate: bool = None
+) -> pm.Model:
+    """BLR model with one coefficient per feature class, see create_stacked_blr (grouping "none")"""
 
-        z = pm.Deterministic("z", mean)
-        p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
-        y_pred = pm.Bernoulli("y_pred", p, observed=fire_labels)
-
-        return model
+    return create_stacked_blr(X, y, coords, "none", total_size=total_size, aggregate=aggregate)
 
 
 def create_st_intercept_blr(
@@ -225,90 +242,38 @@ def create_st_intercept_blr(
     coords: dict,
     spatial_grouping_variable: str,
     temporal_grouping_variable: str,
+    total_size: int = None,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    aggregate: bool = None,
 ) -> pm.Model:
-    with pm.Model(coords=coords) as model:  # type: ignore
-        # data containers
-        elevation = pm.MutableData("elevation", X.elevation_encoded)
-        slope = pm.MutableData("slope", X.slope_encoded)
-        aspect = pm.MutableData("aspect", X.aspect_encoded)
-        forestroad_density = pm.MutableData(
-            "forestroad_density", X.forestroad_density_bin
-        )
-        railway_density = pm.MutableData("railway_density", X.railway_density_bin)
-        hikingtrail_density = pm.MutableData(
-            "hikingtrail_density", X.hikingtrail_density_bin
-        )
-        farmyard_density = pm.MutableData("farmyard_density", X.farmyard_density_bin)
-        population = pm.MutableData("population", X.population_encoded)
-        forest_type = pm.MutableData("forest_type", X.forest_type)
-        ffmc = pm.MutableData("ffmc", X.ffmc)
-        fire_labels = pm.MutableData("fire", y)
-        spatial_groups_idx = pm.MutableData(
-            "spatial_groups_idx", X[spatial_grouping_variable]
-        )
-        temporal_groups_idx = pm.MutableData(
-            "temporal_groups_idx", X[temporal_grouping_variable]
-        )
+    """BLR model with an intercept per spatial and temporal group, see create_stacked_blr (grouping "intercept")"""
 
-        mu_intercept, sigma_intercept = (
-            pm.Cauchy("mu_b1", 0.0, 1.0),
-            pm.Exponential("sigma_b1", 1),
-        )
+    return create_stacked_blr(X, y, coords, "intercept", spatial_grouping_variable, temporal_grouping_variable,
+                              total_size, parameterization, distribution, aggregate)
 
-        # specify priors for the features
-        intercept = pm.Cauchy(
-            "intercept",
-            mu_intercept,
-            sigma_intercept,
-            dims=("spatial_groups", "temporal_groups"),
-        )
-        beta_elevation = pm.Cauchy("beta_elevation", 0, 1, dims=("elevation_classes"))
-        beta_slope = pm.Cauchy("beta_slope", 0, 1, dims=("slope_classes"))
-        beta_aspect = pm.Cauchy("beta_aspect", 0, 1, dims=("aspect_classes"))
-        beta_forestroad_density = pm.Cauchy(
-            "beta_forestroad_density", 0, 1, dims=("forestroad_density_classes")
-        )
-        beta_railway_density = pm.Cauchy(
-            "beta_railway_density", 0, 1, dims=("railway_density_classes")
-        )
-        beta_hikingtrail_density = pm.Cauchy(
-            "beta_hikingtrail_density", 0, 1, dims=("hikingtrail_density_classes")
-        )
-        beta_farmyard_density = pm.Cauchy(
-            "beta_farmyard_density", 0, 1, dims=("farmyard_density_classes")
-        )
-        beta_population = pm.Cauchy(
-            "beta_population", 0, 1, dims=("population_classes")
-        )
-        beta_forest_type = pm.Cauchy(
-            "beta_forest_type", 0, 1, dims=("forest_type_classes")
-        )
-        beta_ffmc = pm.Cauchy("beta_ffmc", 0, 1)
-        error_var = pm.Cauchy("error_beta", 0, 1)
 
-        mean = (
-            intercept[spatial_groups_idx, temporal_groups_idx]
-            + beta_elevation[elevation]
-            + beta_slope[slope]
-            + beta_aspect[aspect]
-            + beta_forestroad_density[forestroad_density]
-            + beta_railway_density[railway_density]
-            + beta_hikingtrail_density[hikingtrail_density]
-            + beta_farmyard_density[farmyard_density]
-            + beta_population[population]
-            + beta_forest_type[forest_type]
-            + beta_ffmc * ffmc
-            + error_var
-        )
+# For FFMC adjustment. Grouping based on CC, EXP & FT
 
-        z = pm.Deterministic("z", mean)
-        p = pm.Deterministic("p", pm.math.invlogit(z))  # type: ignore
-        y_pred = pm.Bernoulli("y_pred", p, observed=fire_labels)
 
-        return model
+def create_st_blr(
+    X: pd.DataFrame,
+    y: pd.Series,
+    coords: dict,
+    spatial_grouping_variable: str,
+    temporal_grouping_variable: str,
+    total_size: int = None,
+    parameterization: str = "centered",
+    distribution: str = "cauchy",
+    aggregate: bool = None,
+) -> pm.Model:
+    """BLR model with all coefficients per spatial and temporal group, see create_stacked_blr (grouping "all")"""
+
+    return create_stacked_blr(X, y, coords, "all", spatial_grouping_variable, temporal_grouping_variable,
+                              total_size, parameterization, distribution, aggregate)
 
 
-def create_bnn(X: np.array, y: np.array, random_seed: int = 42):
+def create_bnn(X: np.array, y: np.array, random_seed: int = 42, total_size: int = None):
     rng = np.random.default_rng(random_seed)
     n_hidden = 10
 
@@ -369,7 +334,7 @@ def create_bnn(X: np.array, y: np.array, random_seed: int = 42):
             "y_pred",
             act_out,
             observed=ann_output,
-            total_size=y.shape[0],  # IMPORTANT for minibatches
+            total_size=total_size or y.shape[0],  # IMPORTANT for minibatches
             dims="obs_id",
         )
     return bayesian_neural_network
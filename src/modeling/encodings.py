@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+
+
 def convert_aspect_to_cardinal_direction(aspect: float) -> int:
     """converts aspect degree values to cardinal direction classes
 
@@ -151,6 +155,75 @@ def convert_ffmc_to_classes(cc: float) -> int:
         return -1
 
 
+def _classify(values, bin_edges: list, right: bool = False, nodata: float = None,
+              invalid_below: float = None, bin_classes: list = None):
+    """assigns classes to values based on bin edges, NaN, masked and nodata values get class -1
+
+    Args:
+        values (array_like): np.ndarray, np.ma.MaskedArray (e.g. raster block) or pd.Series
+        bin_edges (list): increasing class boundaries (see np.digitize)
+        right (bool, optional): if True, upper boundaries are included in the class. Defaults to False.
+        nodata (float, optional): nodata value of a raster. Defaults to None.
+        invalid_below (float, optional): values below get class -1. Defaults to None.
+        bin_classes (list, optional): class of each bin if it is not the bin index. Defaults to None.
+
+    Returns:
+        np.ndarray | pd.Series: int8 classes with the same shape (and index) as values
+    """
+
+    if np.ma.isMaskedArray(values):
+        array = values.astype(np.float64).filled(np.nan)
+    else:
+        array = np.asarray(values, dtype=np.float64)
+
+    invalid = np.isnan(array)
+    if nodata is not None:
+        invalid |= array == nodata
+    if invalid_below is not None:
+        invalid |= array < invalid_below
+
+    bins = np.digitize(array, bin_edges, right=right)
+    if bin_classes is not None:
+        bins = np.asarray(bin_classes)[bins]
+    classes = np.where(invalid, -1, bins).astype(np.int8)
+
+    if isinstance(values, pd.Series):
+        return pd.Series(classes, index=values.index, name=values.name)
+    return classes
+
+
+def convert_aspect_to_cardinal_direction_array(aspect, nodata: float = None):
+    """array version of convert_aspect_to_cardinal_direction (N=0, NE=1, ..., NW=7, NaN/nodata=-1)"""
+    # values >= 337.5 are north again
+    return _classify(aspect, [22.5, 67.5, 112.5, 157.5, 202.5, 247.5, 292.5, 337.5], nodata=nodata,
+                     bin_classes=[0, 1, 2, 3, 4, 5, 6, 7, 0])
+
+
+def convert_slope_to_classes_array(slope, nodata: float = None):
+    """array version of convert_slope_to_classes"""
+    return _classify(slope, [10, 20, 30, 40], nodata=nodata)
+
+
+def convert_elevation_to_classes_array(elevation, nodata: float = None):
+    """array version of convert_elevation_to_classes"""
+    return _classify(elevation, [500, 800, 1500, 1800, 2200], nodata=nodata)
+
+
+def convert_population_to_classes_array(population, nodata: float = None):
+    """array version of convert_population_to_classes (negative values get class -1)"""
+    return _classify(population, [0, 50, 100, 500, 1000], right=True, nodata=nodata, invalid_below=0)
+
+
+def convert_canopy_cover_to_classes_array(cc, nodata: float = None):
+    """array version of convert_canopy_cover_to_classes"""
+    return _classify(cc, [20, 40, 60, 80], right=True, nodata=nodata)
+
+
+def convert_ffmc_to_classes_array(ffmc, nodata: float = None):
+    """array version of convert_ffmc_to_classes"""
+    return _classify(ffmc, [78, 87, 91, 93], nodata=nodata)
+
+
 def apply_encoding(original_value: str, mapping: dict):
     """encodes nuts id to numerical id
 
@@ -166,6 +239,11 @@ def map_to_binary(x):
     return 1 if x > 0 else 0
 
 
+def map_to_binary_array(x, nodata: float = None):
+    """array version of map_to_binary (NaN/nodata=-1)"""
+    return _classify(x, [0], right=True, nodata=nodata)
+
+
 naturraumregionen_encoding = {
     "Pannonische Flach- und Hügelländer": 0,
     "Südöstliches Alpenvorland": 1,
@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+from scipy.special import expit, xlogy
+
+# cells of one block of the hdi search of PosteriorSummaryReducer
+HDI_CELLS_PER_BLOCK = 1024
+
+
+def hdi_of_sorted_samples(sorted_samples: np.array, prob: float) -> np.array:
+    """
+    high density interval of samples sorted along the last axis, same definition as arviz.hdi
+    (narrowest interval that contains floor(prob * n_samples) + 1 samples)
+
+    Returns:
+        np.array: lower and upper bound, shape (..., 2)
+    """
+
+    n_samples = sorted_samples.shape[-1]
+    interval_idx_inc = int(np.floor(prob * n_samples))
+    n_intervals = n_samples - interval_idx_inc
+    interval_width = sorted_samples[..., interval_idx_inc:] - sorted_samples[..., :n_intervals]
+    min_idx = np.expand_dims(np.argmin(interval_width, axis=-1), -1)
+    lower = np.take_along_axis(sorted_samples, min_idx, axis=-1)
+    upper = np.take_along_axis(sorted_samples, min_idx + interval_idx_inc, axis=-1)
+    return np.concatenate([lower, upper], axis=-1)
+
+
+def binary_entropy(p: np.array) -> np.array:
+    """entropy (in bits) of a bernoulli distribution with probability p"""
+
+    return -(xlogy(p, p) + xlogy(1 - p, 1 - p)) / np.log(2)
+
+
+def summarize_sorted_samples(
+    p_sorted: np.array,
+    z_sorted: np.array = None,
+    pred_threshold: float = 0.5,
+    hdi_prob: float = 0.95,
+    include_z: bool = True,
+) -> pd.DataFrame:
+    """
+    prediction dataframe from posterior samples of p (and z), sorted along the last axis (cells, samples)
+
+    predictive_entropy is the entropy of the mean prediction (total uncertainty), mutual_information
+    the part of it that is caused by the uncertainty of the model parameters (epistemic uncertainty).
+    """
+
+    p_pred = p_sorted.mean(axis=1)
+    p_hdi = hdi_of_sorted_samples(p_sorted, hdi_prob)
+    df = pd.DataFrame({
+        "y_pred": (p_pred >= pred_threshold).astype("int"),
+        "p_pred": p_pred,
+    })
+    if z_sorted is not None:
+        df["z_pred"] = z_sorted.mean(axis=1)
+    df["p_hdi_lower"] = p_hdi[:, 0]
+    df["p_hdi_upper"] = p_hdi[:, 1]
+    df["p_hdi_width"] = p_hdi[:, 1] - p_hdi[:, 0]
+    if z_sorted is not None and include_z:
+        z_hdi = hdi_of_sorted_samples(z_sorted, hdi_prob)
+        df["z_hdi_lower"] = z_hdi[:, 0]
+        df["z_hdi_upper"] = z_hdi[:, 1]
+        df["z_hdi_width"] = z_hdi[:, 1] - z_hdi[:, 0]
+    df["predictive_entropy"] = binary_entropy(p_pred)
+    df["mutual_information"] = df["predictive_entropy"] - binary_entropy(p_sorted).mean(axis=1)
+    return df
+
+
+class PosteriorSummaryReducer:
+    """
+    Summary of the posterior predictions of many cells, computed in one pass over chunks of draws
+
+    Mean of p and z and the entropies are accumulated exactly. For the HDIs a histogram of z with
+    n_bins bins is kept for every cell. Its range starts at the (padded) range of the first chunk of
+    draws of the cell and is doubled (merging neighbouring bins) whenever later draws fall outside of it, so
+    every draw is counted in the right bin. The HDI bounds are bin edges (the outermost edges are
+    the smallest and largest draw), so their resolution is about 1 / n_bins of the range of the draws
+    of a cell, for p it is at most a quarter of that. Memory is proportional to n_cells * n_bins and
+    does not depend on the number of draws.
+    """
+
+    def __init__(self, n_cells: int, hdi_prob: float = 0.95, n_bins: int = 128):
+        if n_bins < 2 or n_bins % 2:
+            raise ValueError(f"n_bins must be an even number >= 2, got {n_bins}")
+        self.n_cells = n_cells
+        self.hdi_prob = hdi_prob
+        self.n_bins = n_bins
+        self.n_draws = 0
+        self.z_sum = np.zeros(n_cells)
+        self.p_sum = np.zeros(n_cells)
+        self.entropy_sum = np.zeros(n_cells)
+        self.z_min = np.full(n_cells, np.inf)
+        self.z_max = np.full(n_cells, -np.inf)
+        # histogram of cell i covers [z_lower[i], z_lower[i] + z_range[i]]
+        self.z_lower = np.zeros(n_cells)
+        self.z_range = np.zeros(n_cells)
+        self.counts = np.zeros((n_cells, n_bins), dtype=np.uint32)
+
+    def _extend_ranges(self, chunk_min: np.array, chunk_max: np.array) -> None:
+        """doubles the histogram ranges until they contain the draws of the chunk"""
+
+        half = self.n_bins // 2
+        while True:
+            below = chunk_min < self.z_lower
+            above = ~below & (chunk_max > self.z_lower + self.z_range)
+            if not (below.any() or above.any()):
+                return
+            for cells, new_half in ((np.flatnonzero(below), slice(half, None)),
+                                    (np.flatnonzero(above), slice(None, half))):
+                if not len(cells):
+                    continue
+                merged = self.counts[cells].reshape(len(cells), half, 2).sum(axis=2, dtype=np.uint32)
+                self.counts[cells] = 0
+                self.counts[cells, new_half] = merged
+                if new_half.start is not None:
+                    self.z_lower[cells] -= self.z_range[cells]
+                self.z_range[cells] *= 2
+
+    def update(self, z: np.array) -> None:
+        """adds a chunk of draws of the linear predictor, shape (draws, cells)"""
+
+        z = np.asarray(z, dtype=np.float64)
+        if not np.isfinite(z).all():
+            raise ValueError("Draws of z must be finite")
+        p = expit(z)
+        self.z_sum += z.sum(axis=0)
+        self.p_sum += p.sum(axis=0)
+        self.entropy_sum += binary_entropy(p).sum(axis=0)
+
+        chunk_min, chunk_max = z.min(axis=0), z.max(axis=0)
+        if self.n_draws == 0:
+            # padded by a quarter of the range on both sides, as later draws usually spread a bit further,
+            # cells with equal draws get a small range, which is extended if needed
+            chunk_range = np.maximum(chunk_max - chunk_min, 1e-6 * np.maximum(np.abs(chunk_min), 1))
+            self.z_lower = chunk_min - chunk_range / 4
+            self.z_range = 1.5 * chunk_range
+        else:
+            self._extend_ranges(chunk_min, chunk_max)
+        self.n_draws += z.shape[0]
+        np.minimum(self.z_min, chunk_min, out=self.z_min)
+        np.maximum(self.z_max, chunk_max, out=self.z_max)
+
+        bins = ((z - self.z_lower) * (self.n_bins / self.z_range)).astype(np.int64)
+        np.clip(bins, 0, self.n_bins - 1, out=bins)
+        # cell i uses the bins i * n_bins ... (i + 1) * n_bins - 1 of the flattened counts
+        bins += np.arange(self.n_cells) * self.n_bins
+        np.add.at(self.counts.reshape(-1), bins.ravel(), 1)
+
+    def _z_edges(self, cells: slice) -> np.array:
+        """bin edges of the cells, shape (cells, n_bins + 1), outermost edges are the smallest and largest draw"""
+
+        z_min, z_max = self.z_min[cells, None], self.z_max[cells, None]
+        edges = self.z_lower[cells, None] + self.z_range[cells, None] * np.linspace(0, 1, self.n_bins + 1)
+        edges[:, 0], edges[:, -1] = z_min[:, 0], z_max[:, 0]
+        return np.clip(edges, z_min, z_max)
+
+    def _hdi(self, cumulative: np.array, edges: np.array) -> np.array:
+        """narrowest range of bins (measured with edges) that contains floor(hdi_prob * n) + 1 draws"""
+
+        n_bins = self.n_bins
+        rows = np.arange(len(cumulative))[:, None]
+        n_required = int(np.floor(self.hdi_prob * self.n_draws)) + 1
+
+        # offset every row, so that all rows can be searched with one searchsorted call
+        offsets = rows * (self.n_draws + 1)
+        end = np.searchsorted((cumulative + offsets).ravel(), (cumulative + offsets + n_required).ravel(),
+                              side="left")
+        end = end.reshape(cumulative.shape) - rows * (n_bins + 1)
+        valid = (cumulative[:, -1:] - cumulative >= n_required) & (end <= n_bins)
+
+        width = np.where(valid, edges[rows, np.minimum(end, n_bins)] - edges, np.inf)
+        start = np.argmin(width, axis=1)
+        stop = end[rows[:, 0], start]
+        return np.stack([edges[rows[:, 0], start], edges[rows[:, 0], stop]], axis=1)
+
+    def hdis(self) -> tuple:
+        """hdi bounds of p and z, shape (cells, 2) each
+
+        The cells are processed in blocks of HDI_CELLS_PER_BLOCK cells, so the temporary arrays of the
+        search do not grow with the number of cells.
+        """
+
+        p_hdi, z_hdi = np.zeros((self.n_cells, 2)), np.zeros((self.n_cells, 2))
+        for block_start in range(0, self.n_cells, HDI_CELLS_PER_BLOCK):
+            cells = slice(block_start, block_start + HDI_CELLS_PER_BLOCK)
+            counts = self.counts[cells]
+            cumulative = np.zeros((len(counts), self.n_bins + 1), dtype=np.int64)
+            np.cumsum(counts, axis=1, out=cumulative[:, 1:])
+            z_edges = self._z_edges(cells)
+            z_hdi[cells] = self._hdi(cumulative, z_edges)
+            p_hdi[cells] = self._hdi(cumulative, expit(z_edges))
+        return p_hdi, z_hdi
+
+    def summary(self, pred_threshold: float = 0.5, include_z: bool = True) -> pd.DataFrame:
+        """prediction dataframe with the same columns as summarize_sorted_samples"""
+
+        p_pred = self.p_sum / self.n_draws
+        p_hdi, z_hdi = self.hdis()
+        df = pd.DataFrame({
+            "y_pred": (p_pred >= pred_threshold).astype("int"),
+            "p_pred": p_pred,
+            "z_pred": self.z_sum / self.n_draws,
+            "p_hdi_lower": p_hdi[:, 0],
+            "p_hdi_upper": p_hdi[:, 1],
+            "p_hdi_width": p_hdi[:, 1] - p_hdi[:, 0],
+        })
+        if include_z:
+            df["z_hdi_lower"] = z_hdi[:, 0]
+            df["z_hdi_upper"] = z_hdi[:, 1]
+            df["z_hdi_width"] = z_hdi[:, 1] - z_hdi[:, 0]
+        df["predictive_entropy"] = binary_entropy(p_pred)
+        df["mutual_information"] = df["predictive_entropy"] - self.entropy_sum / self.n_draws
+        return df
@@ -1,7 +1,20 @@
+import os
+import copy
+import hashlib
+import cloudpickle
 import pandas as pd
 import numpy as np
 import pymc as pm
 import arviz as az
+import pytensor
+import pytensor.tensor as pt
+from pytensor.compile.sharedvalue import SharedVariable
+from pytensor.graph.basic import ancestors
+from pytensor.graph.replace import clone_replace, vectorize_graph
+from scipy.special import expit
+from src.modeling.bayesian_models import BLR_CLASS_FEATURES
+
+from src.modeling.posterior_summary import PosteriorSummaryReducer, summarize_sorted_samples
 
 
 class BayesianPrediction:
@@ -19,9 +32,13 @@ class BayesianPrediction:
         """add posterior predictive samples to trace"""
 
         trace_new = self.trace.copy()
+        x_new = dict(self.x_new)
+        if "n_trials" in self.model.named_vars and "n_trials" not in x_new:
+            # models fitted on aggregated rows (aggregate_patterns) predict one trial per new row
+            x_new["n_trials"] = np.ones(len(next(iter(x_new.values()))), dtype=int)
 
         with self.model:
-            pm.set_data(self.x_new)
+            pm.set_data(x_new)
             ppc = pm.sample_posterior_predictive(
                 trace_new, var_names=self.var_names_pred, random_seed=self.seed
             )
@@ -73,6 +90,12 @@ class BinaryClassification(BayesianPrediction):
         hdi_width = hdi[:, 1] - hdi[:, 0]
         return hdi, hdi_width
 
+    def get_samples(self, var: str) -> np.array:
+        """posterior predictive samples of a variable, shape (cells, samples)"""
+
+        samples = self.trace_pred.posterior_predictive[getattr(self, var)].values
+        return samples.reshape(-1, samples.shape[-1]).T
+
     def predict(
         self,
         pred_threshold: float = 0.5,
@@ -83,23 +106,393 @@ class BinaryClassification(BayesianPrediction):
         combines y and p predictions, hdi and binary entropy into one dataframe
         """
 
-        df = pd.DataFrame()
-        y_pred, p_pred, z_pred = self.get_predictions(pred_threshold)
-        p_hdi, p_hdi_width = self.get_hdi("p_var_name", hdi_prob)
-        df["y_pred"] = y_pred
-        df["p_pred"] = p_pred
-        df["z_pred"] = z_pred
-        df["p_hdi_lower"] = p_hdi[:, 0]
-        df["p_hdi_upper"] = p_hdi[:, 1]
-        df["p_hdi_width"] = p_hdi_width
+        p_sorted = np.sort(self.get_samples("p_var_name"), axis=1)
+        z_sorted = np.sort(self.get_samples("z_var_name"), axis=1)
+        return summarize_sorted_samples(p_sorted, z_sorted, pred_threshold, hdi_prob, include_z)
 
-        if include_z:
-            z_hdi, z_hdi_width = self.get_hdi("z_var_name", hdi_prob)
-            df["z_hdi_lower"] = z_hdi[:, 0]
-            df["z_hdi_upper"] = z_hdi[:, 1]
-            df["z_hdi_width"] = z_hdi_width
 
-        return df
+# data container name of each class feature and the name of its coefficient in the BLR models
+BLR_FEATURE_COEFFICIENTS = {name: f"beta_{name}" for _, name in BLR_CLASS_FEATURES}
+
+
+def find_unique_rows(columns: list) -> tuple:
+    """
+    unique rows of equally long columns
+
+    Returns:
+        tuple: unique rows (n_unique, n_columns) and inverse index that maps every row to its unique row
+    """
+
+    rows = np.ascontiguousarray(np.column_stack([np.asarray(column, dtype=np.float64) for column in columns]))
+    # compare whole rows as one opaque value, much faster than np.unique(axis=0)
+    row_view = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, unique_idx, inverse = np.unique(row_view, return_index=True, return_inverse=True)
+    return rows[unique_idx], inverse.ravel()
+
+
+class PatternPredictionCache:
+    """
+    predictions of unique feature patterns, kept per model (and prediction settings)
+
+    Patterns are identified by the bytes of their float64 feature values. Each cached pattern is one
+    dict entry that holds its key and its row of predictions, so at most max_patterns entries of about
+    8 * (n_features + n_columns) + 250 bytes are kept (roughly 80 MB for the BLR predictions with the
+    default). When the cache is full, the least recently used patterns are evicted.
+    """
+
+    def __init__(self, max_patterns: int = 200_000):
+        """
+        Args:
+            max_patterns (int, optional): maximal number of cached patterns of all models. Defaults to 200_000.
+        """
+        if max_patterns < 1:
+            raise ValueError(f"max_patterns must be positive, got {max_patterns}")
+        self.max_patterns = max_patterns
+        # model key -> dtypes of the prediction columns
+        self.dtypes = {}
+        # (model key, pattern key) -> row of predictions, ordered from least to most recently used
+        self.rows = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def lookup(self, model_key: str, pattern_keys: list) -> pd.DataFrame:
+        """cached predictions of the patterns, rows of patterns that are not cached are NaN"""
+
+        dtypes = self.dtypes.get(model_key)
+        if dtypes is None:
+            return None
+
+        values = np.full((len(pattern_keys), len(dtypes)), np.nan)
+        found = np.zeros(len(pattern_keys), dtype=bool)
+        for i, pattern_key in enumerate(pattern_keys):
+            row = self.rows.pop((model_key, pattern_key), None)
+            if row is not None:
+                # reinserted as most recently used
+                self.rows[(model_key, pattern_key)] = row
+                values[i] = row
+                found[i] = True
+
+        predictions = pd.DataFrame(values, index=pattern_keys, columns=dtypes.index)
+        return predictions.astype(dtypes) if found.all() else predictions
+
+    def add(self, model_key: str, pattern_keys: list, predictions: pd.DataFrame) -> None:
+        self.dtypes[model_key] = predictions.dtypes
+        for pattern_key, row in zip(pattern_keys, predictions.to_numpy(dtype=np.float64)):
+            self.rows.pop((model_key, pattern_key), None)
+            self.rows[(model_key, pattern_key)] = row
+        while len(self.rows) > self.max_patterns:
+            del self.rows[next(iter(self.rows))]
+
+
+class BLRPosteriorPredictor:
+    """
+    predictions of the bayesian logistic regression models (create_blr, create_st_intercept_blr,
+    create_st_blr) computed directly from the posterior samples with numpy
+
+    The linear predictor of these models is a sum of coefficient lookups, so z and p are calculated
+    by indexing the posterior coefficient tables, cells are processed in chunks to bound memory.
+    No Bernoulli draws are generated. predict() returns the same dataframe as
+    BinaryClassification.predict().
+    """
+
+    def __init__(self, trace: object, x_new: dict, max_chunk_mb: float = 256):
+        """
+        Args:
+            trace (object): inference data with posterior samples of the model
+            x_new (dict): new data, same keys as the data containers of the model
+                ("spatial_groups_idx" and "temporal_groups_idx" only for grouped models)
+            max_chunk_mb (float, optional): memory used per chunk of cells. Defaults to 256.
+        """
+        self.trace = trace
+        self.x_new = x_new
+        self.max_chunk_mb = max_chunk_mb
+        self.coefficients = self._load_coefficients(trace.posterior)
+        self.n_samples = self.coefficients["error_beta"].shape[-1]
+        self._model_key = None
+
+    @property
+    def model_key(self) -> str:
+        """hash of the posterior coefficients, identifies the model in a PatternPredictionCache"""
+
+        if self._model_key is None:
+            sha = hashlib.sha256()
+            for var_name, table in sorted(self.coefficients.items()):
+                sha.update(var_name.encode())
+                sha.update(str(table.shape).encode())
+                sha.update(table.tobytes())
+            self._model_key = sha.hexdigest()
+        return self._model_key
+
+    @property
+    def data_names(self) -> list:
+        """keys of x_new that are used by the model"""
+
+        names = [*BLR_FEATURE_COEFFICIENTS, "ffmc"]
+        grouped = self.coefficients["intercept"].ndim == 3 or self.coefficients["beta_ffmc"].ndim == 3 or \
+            any(self.coefficients[var_name].ndim == 4 for var_name in BLR_FEATURE_COEFFICIENTS.values())
+        if grouped:
+            names += ["spatial_groups_idx", "temporal_groups_idx"]
+        return names
+
+    def with_data(self, x_new: dict):
+        """predictor for other data that shares the posterior coefficients"""
+
+        predictor = copy.copy(self)
+        predictor.x_new = x_new
+        return predictor
+
+    @staticmethod
+    def _load_coefficients(posterior) -> dict:
+        """coefficient tables with the (chain, draw) samples flattened into the last axis"""
+
+        coefficients = {}
+        for var_name in ["intercept", "beta_ffmc", "error_beta", *BLR_FEATURE_COEFFICIENTS.values()]:
+            samples = posterior[var_name].values
+            samples = samples.reshape(-1, *samples.shape[2:])
+            # samples last, so that the lookup of one cell returns contiguous memory
+            coefficients[var_name] = np.ascontiguousarray(np.moveaxis(samples, 0, -1), dtype=np.float64)
+        return coefficients
+
+    def _get_indices(self, name: str, cells: slice, n: int) -> np.array:
+        """class or group indices of a categorical input, a ValueError if they are not integers from 0 to n - 1"""
+
+        values = np.asarray(self.x_new[name][cells])
+        indices = values.astype(np.intp)
+        if (indices != values).any() or (indices < 0).any() or (indices >= n).any():
+            raise ValueError(f"{name} must contain integer indices from 0 to {n - 1}")
+        return indices
+
+    def _lookup(self, var_name: str, cells: slice, draws: slice, class_idx: np.array = None) -> np.array:
+        """samples of the coefficient for each cell, shape (cells, samples) or (samples,)"""
+
+        table = self.coefficients[var_name][..., draws]
+        index = [] if class_idx is None else [class_idx]
+        n_group_dims = table.ndim - 1 - len(index)
+        if n_group_dims == 2:
+            index += [self._get_indices("spatial_groups_idx", cells, table.shape[-3]),
+                      self._get_indices("temporal_groups_idx", cells, table.shape[-2])]
+        return table[tuple(index)] if index else table
+
+    def calculate_z(self, cells: slice, draws: slice = slice(None)) -> np.array:
+        """posterior samples of the linear predictor, shape (cells, samples)"""
+
+        ffmc = np.asarray(self.x_new["ffmc"][cells], dtype=np.float64)
+        z = self._lookup("intercept", cells, draws) + self.coefficients["error_beta"][draws]
+        z = np.broadcast_to(z, (len(ffmc), z.shape[-1])).copy()
+        for feature, var_name in BLR_FEATURE_COEFFICIENTS.items():
+            class_idx = self._get_indices(feature, cells, len(self.coefficients[var_name]))
+            z += self._lookup(var_name, cells, draws, class_idx)
+        z += self._lookup("beta_ffmc", cells, draws) * ffmc[:, None]
+        return z
+
+    def iter_chunks(self, bytes_per_cell: int = None):
+        """yields slices of cells, sized so that one chunk uses about max_chunk_mb"""
+
+        n_cells = len(self.x_new["ffmc"])
+        if bytes_per_cell is None:
+            # z, p and temporary arrays of the hdi calculation
+            bytes_per_cell = 4 * self.n_samples * np.dtype(np.float64).itemsize
+        chunk_size = max(1, int(self.max_chunk_mb * 2**20 // bytes_per_cell))
+        for start in range(0, n_cells, chunk_size):
+            yield slice(start, min(start + chunk_size, n_cells))
+
+    def predict(
+        self,
+        pred_threshold: float = 0.5,
+        hdi_prob: float = 0.95,
+        include_z: bool = True,
+        draws_per_chunk: int = None,
+        deduplicate: bool = False,
+        cache: PatternPredictionCache = None,
+    ) -> pd.DataFrame:
+        """
+        combines y and p predictions, hdi and binary entropy into one dataframe
+
+        By default all samples of a chunk of cells are held in memory and the hdi is exact. With
+        draws_per_chunk the samples are streamed through a PosteriorSummaryReducer instead, memory
+        then does not depend on the number of samples but the hdi is binned.
+
+        With deduplicate (or a cache) every unique feature pattern is predicted only once and the
+        predictions are scattered back to the cells. Predictions of patterns that are in the cache
+        are reused, new ones are added to it.
+        """
+
+        if deduplicate or cache is not None:
+            return self._predict_unique_patterns(pred_threshold, hdi_prob, include_z, draws_per_chunk, cache)
+        if draws_per_chunk is not None:
+            return self._predict_streaming(pred_threshold, hdi_prob, include_z, draws_per_chunk)
+
+        chunks = []
+        for cells in self.iter_chunks():
+            z = self.calculate_z(cells)
+            z.sort(axis=1)
+            # invlogit is monotonic, so the sorted samples of p follow from the sorted samples of z
+            chunks.append(summarize_sorted_samples(expit(z), z, pred_threshold, hdi_prob, include_z))
+        return pd.concat(chunks, ignore_index=True)
+
+    def _predict_unique_patterns(self, pred_threshold: float, hdi_prob: float, include_z: bool,
+                                 draws_per_chunk: int, cache: PatternPredictionCache) -> pd.DataFrame:
+        data_names = self.data_names
+        patterns, inverse = find_unique_rows([self.x_new[name] for name in data_names])
+        pattern_keys = [pattern.tobytes() for pattern in patterns]
+        settings_key = f"{self.model_key}_{pred_threshold}_{hdi_prob}_{include_z}_{draws_per_chunk}"
+
+        predictions = cache.lookup(settings_key, pattern_keys) if cache is not None else None
+        missing = np.ones(len(patterns), dtype=bool) if predictions is None else \
+            predictions["p_pred"].isna().values
+        if missing.any():
+            x_missing = {name: patterns[missing, i] for i, name in enumerate(data_names)}
+            new_predictions = self.with_data(x_missing).predict(pred_threshold, hdi_prob, include_z, draws_per_chunk)
+            missing_keys = [key for key, is_missing in zip(pattern_keys, missing) if is_missing]
+            if cache is not None:
+                cache.add(settings_key, missing_keys, new_predictions)
+            if predictions is None:
+                predictions = new_predictions.set_axis(missing_keys)
+            else:
+                predictions.iloc[np.flatnonzero(missing)] = new_predictions.values
+                predictions = predictions.astype(new_predictions.dtypes)
+
+        return predictions.iloc[inverse].reset_index(drop=True)
+
+    def _predict_streaming(self, pred_threshold: float, hdi_prob: float, include_z: bool,
+                           draws_per_chunk: int, n_bins: int = 128) -> pd.DataFrame:
+        # histogram counts, edges and cumulative counts of the hdi search and z, p, bins of one chunk of draws
+        bytes_per_cell = n_bins * (4 + 6 * 8) + 4 * draws_per_chunk * np.dtype(np.float64).itemsize
+        chunks = []
+        for cells in self.iter_chunks(bytes_per_cell):
+            reducer = PosteriorSummaryReducer(cells.stop - cells.start, hdi_prob, n_bins=n_bins)
+            for draw_start in range(0, self.n_samples, draws_per_chunk):
+                draws = slice(draw_start, draw_start + draws_per_chunk)
+                reducer.update(self.calculate_z(cells, draws).T)
+            chunks.append(reducer.summary(pred_threshold, include_z))
+        return pd.concat(chunks, ignore_index=True)
+
+
+class CompiledPredictor:
+    """
+    posterior predictions of a pymc model with a forward graph that is compiled only once
+
+    The graph of the requested variables is cut at the free random variables and the data containers
+    they depend on, these become inputs of one pytensor function that is vectorized over draws.
+    The posterior samples are read once into read-only arrays, the trace is not copied and the model
+    context is not entered again, so the predictor can be called repeatedly on new data. With a
+    cache_dir the compiled function is pickled and loaded again by later processes.
+    """
+
+    def __init__(
+        self,
+        model: pm.Model,
+        trace: object,
+        var_names: list,
+        cache_dir: str = None,
+        draws_per_call: int = 100,
+        max_chunk_mb: float = 256,
+    ):
+        """
+        Args:
+            model (pm.Model): pymc model
+            trace (object): inference data with posterior samples of the model
+            var_names (list): deterministic variables to predict, e.g. ["z", "p"]
+            cache_dir (str, optional): directory of the compiled function cache. Defaults to None.
+            draws_per_call (int, optional): number of draws evaluated per function call. Defaults to 100.
+            max_chunk_mb (float, optional): memory used for the samples of a chunk of cells. Defaults to 256.
+        """
+        self.var_names = var_names
+        self.draws_per_call = draws_per_call
+        self.max_chunk_mb = max_chunk_mb
+
+        outputs = [model[var_name] for var_name in var_names]
+        graph_inputs = set(ancestors(outputs, blockers=model.free_RVs))
+        self.rvs = [rv for rv in model.free_RVs if rv in graph_inputs]
+        self.data = [var for var in model.named_vars.values()
+                     if isinstance(var, SharedVariable) and var in graph_inputs]
+
+        self.posterior = {}
+        for rv in self.rvs:
+            samples = trace.posterior[rv.name].values
+            samples = samples.reshape(-1, *samples.shape[2:]).astype(rv.dtype)
+            samples.flags.writeable = False
+            self.posterior[rv.name] = samples
+        self.n_samples = len(next(iter(self.posterior.values())))
+
+        self.from_cache = False
+        self.fn = self._compile(outputs, cache_dir)
+
+    def _compile(self, outputs: list, cache_dir: str = None):
+        """pytensor function (rv samples with leading draw axis, data) -> outputs with leading draw axis"""
+
+        rv_inputs = {rv: rv.type() for rv in self.rvs}
+        data_inputs = {var: var.type() for var in self.data}
+        for var, var_input in {**rv_inputs, **data_inputs}.items():
+            var_input.name = var.name
+        single_draw_outputs = clone_replace(outputs, replace={**rv_inputs, **data_inputs})
+
+        batched_inputs = {var_input: pt.tensor(name=var_input.name, dtype=var_input.dtype,
+                                               shape=(None, *var_input.type.shape))
+                          for var_input in rv_inputs.values()}
+        batched_outputs = vectorize_graph(single_draw_outputs, replace=batched_inputs)
+        inputs = [*batched_inputs.values(), *data_inputs.values()]
+
+        path_to_cache = None
+        if cache_dir is not None:
+            graph = pytensor.printing.debugprint(batched_outputs, file="str", print_type=True)
+            key = hashlib.sha256(f"{pytensor.__version__}{graph}".encode()).hexdigest()
+            path_to_cache = os.path.join(cache_dir, f"{key}.pkl")
+            if os.path.exists(path_to_cache):
+                with open(path_to_cache, "rb") as buff:
+                    self.from_cache = True
+                    return cloudpickle.load(buff)
+
+        fn = pytensor.function(inputs, batched_outputs)
+        if path_to_cache is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path_to_cache + ".tmp", "wb") as buff:
+                cloudpickle.dump(fn, buff)
+            os.replace(path_to_cache + ".tmp", path_to_cache)
+        return fn
+
+    def iter_chunks(self, n_cells: int):
+        """yields slices of cells, sized so that the samples of a chunk use about max_chunk_mb"""
+
+        bytes_per_cell = 2 * len(self.var_names) * self.n_samples * np.dtype(np.float64).itemsize
+        chunk_size = max(1, int(self.max_chunk_mb * 2**20 // bytes_per_cell))
+        for start in range(0, n_cells, chunk_size):
+            yield slice(start, min(start + chunk_size, n_cells))
+
+    def sample(self, x_new: dict, cells: slice = slice(None)) -> dict:
+        """posterior samples of the variables for new data, shape (cells, samples)"""
+
+        data_values = [np.asarray(x_new[var.name], dtype=var.dtype)[cells] for var in self.data]
+        samples = {var_name: [] for var_name in self.var_names}
+        for draw_start in range(0, self.n_samples, self.draws_per_call):
+            draws = slice(draw_start, draw_start + self.draws_per_call)
+            outputs = self.fn(*[self.posterior[rv.name][draws] for rv in self.rvs], *data_values)
+            for var_name, output in zip(self.var_names, outputs):
+                samples[var_name].append(output)
+        return {var_name: np.concatenate(values).T for var_name, values in samples.items()}
+
+    def predict(
+        self,
+        x_new: dict,
+        pred_threshold: float = 0.5,
+        hdi_prob: float = 0.95,
+        p_var_name: str = "p",
+        z_var_name: str = "z",
+        include_z: bool = True,
+    ) -> pd.DataFrame:
+        """
+        same dataframe as BinaryClassification.predict() (without z columns if z is not predicted)
+        """
+
+        n_cells = len(x_new[self.data[0].name])
+        chunks = []
+        for cells in self.iter_chunks(n_cells):
+            samples = self.sample(x_new, cells)
+            p_sorted = np.sort(samples[p_var_name], axis=1)
+            z_sorted = np.sort(samples[z_var_name], axis=1) if z_var_name in samples else None
+            chunks.append(summarize_sorted_samples(p_sorted, z_sorted, pred_threshold, hdi_prob, include_z))
+        return pd.concat(chunks, ignore_index=True)
 
 
 class BinaryClassificationBNN:
@@ -178,3 +571,92 @@ class BinaryClassificationBNN:
         df["p_hdi_width"] = p_hdi_width
 
         return df
+
+
+# weights of create_bnn, input layer first
+BNN_WEIGHTS = ["w_in_1", "w_1_2", "w_2_3", "w_3_out"]
+
+
+class BNNPosteriorPredictor:
+    """
+    predictions of create_bnn computed with a batched numpy forward pass over the posterior samples
+
+    The network is evaluated for all samples at once with batched matrix products
+    (samples x cells x units), cells are processed in chunks to bound memory. The weights are read
+    from a trace or drawn directly from a fitted ADVI approximation, without building a trace or
+    sampling the posterior predictive. predict() returns the columns of
+    BinaryClassificationBNN.predict() and the entropies of summarize_sorted_samples.
+    """
+
+    def __init__(self, weights: dict, max_chunk_mb: float = 256):
+        """
+        Args:
+            weights (dict): samples of the BNN_WEIGHTS, leading sample axis
+            max_chunk_mb (float, optional): memory used per chunk of cells. Defaults to 256.
+        """
+        self.weights = [np.asarray(weights[name], dtype=np.float64) for name in BNN_WEIGHTS]
+        self.n_samples = len(self.weights[0])
+        self.max_chunk_mb = max_chunk_mb
+
+    @classmethod
+    def from_trace(cls, trace: object, max_chunk_mb: float = 256):
+        """predictor with the posterior samples of a trace"""
+
+        weights = {}
+        for name in BNN_WEIGHTS:
+            samples = trace.posterior[name].values
+            weights[name] = samples.reshape(-1, *samples.shape[2:])
+        return cls(weights, max_chunk_mb)
+
+    @classmethod
+    def from_approximation(cls, approx, draws: int = 1000, random_seed: int = None, max_chunk_mb: float = 256):
+        """predictor with draws samples of a mean-field or full-rank approximation (pm.fit)"""
+
+        group = approx.groups[0]
+        missing = [name for name in BNN_WEIGHTS if name not in group.ordering]
+        if missing:
+            raise ValueError(f"Approximation has no samples of {missing}")
+
+        rng = np.random.default_rng(random_seed)
+        mean = group.mean.eval()
+        standard_normal = rng.standard_normal((draws, len(mean)))
+        if hasattr(group, "L"):
+            flat = mean + standard_normal @ group.L.eval().T
+        else:
+            flat = mean + standard_normal * group.std.eval()
+
+        weights = {}
+        for name in BNN_WEIGHTS:
+            _, flat_slice, shape, _ = group.ordering[name]
+            weights[name] = flat[:, flat_slice].reshape(draws, *shape)
+        return cls(weights, max_chunk_mb)
+
+    def calculate_p(self, x: np.array) -> np.array:
+        """posterior samples of p, shape (cells, samples)"""
+
+        w_in_1, w_1_2, w_2_3, w_3_out = self.weights
+        act = np.tanh(np.asarray(x, dtype=np.float64) @ w_in_1)
+        act = np.tanh(act @ w_1_2)
+        act = np.tanh(act @ w_2_3)
+        return expit(np.einsum("sch,sh->cs", act, w_3_out))
+
+    def iter_chunks(self, n_cells: int):
+        """yields slices of cells, sized so that one chunk uses about max_chunk_mb"""
+
+        n_units = max(weights.shape[-1] for weights in self.weights)
+        # activations of two layers, p and temporary arrays of the hdi calculation
+        bytes_per_cell = (2 * n_units + 4) * self.n_samples * np.dtype(np.float64).itemsize
+        chunk_size = max(1, int(self.max_chunk_mb * 2**20 // bytes_per_cell))
+        for start in range(0, n_cells, chunk_size):
+            yield slice(start, min(start + chunk_size, n_cells))
+
+    def predict(self, x_new: np.array, pred_threshold: float = 0.5, hdi_prob: float = 0.95) -> pd.DataFrame:
+        """
+        combines y and p predictions, hdi and binary entropy into one dataframe
+        """
+
+        chunks = []
+        for cells in self.iter_chunks(len(x_new)):
+            p_sorted = np.sort(self.calculate_p(x_new[cells]), axis=1)
+            chunks.append(summarize_sorted_samples(p_sorted, None, pred_threshold, hdi_prob))
+        return pd.concat(chunks, ignore_index=True)
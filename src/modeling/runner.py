@@ -0,0 +1,149 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from src.modeling.predictions import BLRPosteriorPredictor, BNNPosteriorPredictor
+from src.modeling.training import fit, get_blr_data_columns
+from src.modeling.utils import build_model_from_spec, load_model_artifact, save_model_artifact
+
+# environment variables of the BLAS/OpenMP thread pools (read by processes started afterwards)
+BLAS_THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def pin_blas_threads(n_threads: int) -> None:
+    """limits the BLAS/OpenMP threads of this process and of the processes it starts (e.g. pm.sample chains)"""
+
+    for variable in BLAS_THREAD_VARIABLES:
+        os.environ[variable] = str(n_threads)
+    threadpool_limits(n_threads)
+
+
+def split_cores(n_models: int, n_cores: int = None) -> list:
+    """cores of each model if all models run at the same time (at least one core per model)"""
+
+    n_cores = n_cores or os.cpu_count()
+    if n_models >= n_cores:
+        return [1] * n_models
+    cores, remainder = divmod(n_cores, n_models)
+    return [cores + 1 if i < remainder else cores for i in range(n_models)]
+
+
+def get_model_inputs(spec: dict, X: pd.DataFrame) -> object:
+    """model input of the builder: the dataframe for the BLR builders, the feature matrix for create_bnn"""
+
+    if spec["builder"] == "create_bnn":
+        return X[spec["feature_columns"]].to_numpy(dtype="float32")
+    return X
+
+
+def get_blr_prediction_data(spec: dict, X: pd.DataFrame) -> dict:
+    """data container name -> values of the BLR predictor"""
+
+    builder_kwargs = spec.get("builder_kwargs", {})
+    data_columns = get_blr_data_columns(
+        spatial_grouping_variable=builder_kwargs.get("spatial_grouping_variable"),
+        temporal_grouping_variable=builder_kwargs.get("temporal_grouping_variable"),
+    )
+    return {name: X[column].values for name, column in data_columns.items() if name != "fire"}
+
+
+def fit_model_spec(spec: dict, X_train: pd.DataFrame, y_train: pd.Series, path_to_artifact: str,
+                   n_cores: int = 1) -> dict:
+    """
+    fits the model of a spec with n_cores cores and saves it as model artifact
+
+    NUTS chains run in min(chains, n_cores) processes with n_cores // processes BLAS threads each,
+    ADVI uses n_cores BLAS threads.
+
+    Returns:
+        dict: name, path of the artifact and the fit statistics of src.modeling.training.fit
+    """
+
+    fit_kwargs = dict(spec.get("fit_kwargs", {}))
+    backend = spec.get("backend", "pymc")
+    n_processes = 1
+    if backend != "advi":
+        n_processes = min(fit_kwargs.get("chains", 4), n_cores)
+        fit_kwargs.setdefault("cores", n_processes)
+    pin_blas_threads(max(1, n_cores // n_processes))
+
+    model = build_model_from_spec({"coords": {}, "builder_kwargs": {}, **spec},
+                                  get_model_inputs(spec, X_train), y_train.values)
+    idata = fit(model, backend, **fit_kwargs)
+    save_model_artifact(path_to_artifact, idata, spec["builder"], spec.get("coords", {}),
+                        spec.get("builder_kwargs"), drop_vars=("z", "p"))
+    return {"name": spec["name"], "path_to_artifact": path_to_artifact, **idata.attrs}
+
+
+def predict_model_spec(spec: dict, path_to_artifact: str, X_test: pd.DataFrame, n_cores: int = 1) -> pd.DataFrame:
+    """test set predictions of a saved model artifact, computed from the posterior samples with numpy"""
+
+    pin_blas_threads(n_cores)
+    artifact = load_model_artifact(path_to_artifact)
+    if spec["builder"] != "create_bnn":
+        return BLRPosteriorPredictor(artifact["idata"], get_blr_prediction_data(spec, X_test)).predict()
+    return BNNPosteriorPredictor.from_trace(artifact["idata"]).predict(get_model_inputs(spec, X_test))
+
+
+def run_models(specs: list, X_train: pd.DataFrame, y_train: pd.Series, X_test: pd.DataFrame,
+               path_to_output_dir: str, n_cores: int = None) -> tuple:
+    """
+    fits several models at the same time and predicts the test set with each of them
+
+    The cores are split between the models (see split_cores) and every model is fitted in its own
+    spawned worker process with pinned BLAS threads, so the comparison takes about as long as the
+    slowest model. The test set prediction of a model starts as soon as its fit is finished.
+    Artifacts are saved to path_to_output_dir/<name>, predictions to path_to_output_dir/<name>_test_predictions.csv.
+
+    Args:
+        specs (list): model specs, dicts with
+            "name": name of the model, e.g. "st_blr"
+            "builder": name of the builder in src.modeling.bayesian_models, e.g. "create_st_blr"
+            "coords" and "builder_kwargs" (optional): other arguments of the builder
+            "backend" and "fit_kwargs" (optional): arguments of src.modeling.training.fit
+            "feature_columns": input columns of create_bnn (only for create_bnn)
+        X_train (pd.DataFrame): training data
+        y_train (pd.Series): training labels
+        X_test (pd.DataFrame): test data
+        path_to_output_dir (str): output directory
+        n_cores (int, optional): cores to use. Defaults to os.cpu_count().
+
+    Returns:
+        tuple: model name -> test predictions, model name -> fit statistics
+    """
+
+    os.makedirs(path_to_output_dir, exist_ok=True)
+    cores = dict(zip([spec["name"] for spec in specs], split_cores(len(specs), n_cores)))
+    specs_by_name = {spec["name"]: spec for spec in specs}
+    max_workers = min(len(specs), n_cores or os.cpu_count())
+
+    predictions, fit_stats = {}, {}
+    # spawned workers do not inherit compiled functions or thread pools of the parent
+    with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        fit_futures = [executor.submit(fit_model_spec, spec, X_train, y_train,
+                                       os.path.join(path_to_output_dir, spec["name"]), cores[spec["name"]])
+                       for spec in specs]
+        predict_futures = {}
+        for future in as_completed(fit_futures):
+            stats = future.result()
+            name = stats["name"]
+            fit_stats[name] = stats
+            predict_futures[executor.submit(predict_model_spec, specs_by_name[name], stats["path_to_artifact"],
+                                            X_test, cores[name])] = name
+
+        for future in as_completed(predict_futures):
+            name = predict_futures[future]
+            predictions[name] = future.result()
+            predictions[name].to_csv(os.path.join(path_to_output_dir, f"{name}_test_predictions.csv"), index=False)
+
+    return {spec["name"]: predictions[spec["name"]] for spec in specs}, fit_stats
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import importlib.util
+import numpy as np
+import pandas as pd
+import pymc as pm
+import arviz as az
+import xarray as xr
+from pymc.logprob.transforms import LogTransform
+from pymc.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+
+from src.modeling.bayesian_models import BLR_CLASS_FEATURES
+
+COLUMNS_FILE_NAME = "columns.json"
+
+# backend of fit -> modules it needs (all NUTS backends are run through pm.sample)
+SAMPLER_BACKENDS = {
+    "pymc": [],
+    "nutpie": ["nutpie"],
+    "numpyro": ["jax", "numpyro"],
+    "blackjax": ["jax", "blackjax"],
+    "advi": [],
+}
+
+# data container name of the BLR builders -> column of the training data
+BLR_DATA_COLUMNS = {**{name: column for column, name in BLR_CLASS_FEATURES}, "ffmc": "ffmc"}
+
+
+def get_blr_data_columns(
+    label_col: str = "fire",
+    spatial_grouping_variable: str = None,
+    temporal_grouping_variable: str = None,
+) -> dict:
+    """data container name -> column (or list of columns for matrices) of the BLR builders
+
+    Args:
+        label_col (str, optional): column of the fire labels. Defaults to "fire".
+        spatial_grouping_variable (str, optional): column of the spatial groups (st models). Defaults to None.
+        temporal_grouping_variable (str, optional): column of the temporal groups (st models). Defaults to None.
+    """
+
+    data_columns = dict(BLR_DATA_COLUMNS)
+    data_columns["fire"] = label_col
+    if spatial_grouping_variable is not None:
+        data_columns["spatial_groups_idx"] = spatial_grouping_variable
+    if temporal_grouping_variable is not None:
+        data_columns["temporal_groups_idx"] = temporal_grouping_variable
+    return data_columns
+
+
+def write_columnar_training_set(chunks, path_to_dir: str) -> int:
+    """writes training data chunk by chunk as one raw binary file per column
+
+    Only one chunk is held in memory, so training sets that do not fit into memory can be written
+    from an iterator of dataframes (e.g. pd.read_csv(..., chunksize=...)).
+
+    Args:
+        chunks: dataframe or iterable of dataframes with the same columns
+        path_to_dir (str): output directory
+
+    Returns:
+        int: number of rows
+    """
+
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    os.makedirs(path_to_dir, exist_ok=True)
+
+    files, dtypes, n_rows = {}, {}, 0
+    try:
+        for chunk in chunks:
+            for column in chunk.columns:
+                values = np.ascontiguousarray(chunk[column].values)
+                if column not in files:
+                    files[column] = open(os.path.join(path_to_dir, f"{column}.bin"), "wb")
+                    dtypes[column] = values.dtype.str
+                files[column].write(values.astype(dtypes[column]).tobytes())
+            n_rows += len(chunk)
+    finally:
+        for file in files.values():
+            file.close()
+
+    with open(os.path.join(path_to_dir, COLUMNS_FILE_NAME), "w") as file:
+        json.dump({"n_rows": n_rows, "dtypes": dtypes}, file, indent=1)
+    return n_rows
+
+
+class ColumnarTrainingSet:
+    """training data written by write_columnar_training_set, columns are memory-mapped"""
+
+    def __init__(self, path_to_dir: str):
+        with open(os.path.join(path_to_dir, COLUMNS_FILE_NAME), "r") as file:
+            meta = json.load(file)
+        self.n_rows = meta["n_rows"]
+        self.columns = {column: np.memmap(os.path.join(path_to_dir, f"{column}.bin"), dtype=dtype,
+                                          mode="r", shape=(self.n_rows,))
+                        for column, dtype in meta["dtypes"].items()}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def read_rows(self, idx: np.array) -> pd.DataFrame:
+        """rows at the given indices (sorted indices read the files sequentially)"""
+
+        return pd.DataFrame({column: values[idx] for column, values in self.columns.items()})
+
+    def sample_batch(self, batch_size: int, rng: np.random.Generator) -> pd.DataFrame:
+        """random rows (with replacement, so the cost does not depend on the size of the training set)"""
+
+        return self.read_rows(np.sort(rng.integers(0, self.n_rows, batch_size)))
+
+
+class MinibatchFeeder:
+    """
+    pm.fit callback that replaces the values of the data containers by a new random minibatch
+    after every iteration
+    """
+
+    def __init__(self, model: pm.Model, training_set: ColumnarTrainingSet, data_columns: dict,
+                 batch_size: int, random_seed: int = None):
+        self.model = model
+        self.training_set = training_set
+        self.data_columns = data_columns
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(random_seed)
+
+    def set_batch(self, batch: pd.DataFrame) -> None:
+        for name, columns in self.data_columns.items():
+            container = self.model[name]
+            values = batch[columns].values
+            container.set_value(values.astype(container.get_value().dtype))
+
+    def __call__(self, approx, losses, i) -> None:
+        self.set_batch(self.training_set.sample_batch(self.batch_size, self.rng))
+
+
+def fit_minibatch_advi(
+    build_model,
+    training_set: ColumnarTrainingSet,
+    data_columns: dict,
+    batch_size: int = 1000,
+    n: int = 20000,
+    method: str = "advi",
+    random_seed: int = None,
+    **fit_kwargs,
+) -> tuple:
+    """fits a model with minibatch variational inference on a (memory-mapped) columnar training set
+
+    The model is built for a first random minibatch with total_size set to the size of the training
+    set, afterwards every iteration uses a new random minibatch. Memory and the cost of an
+    iteration depend on batch_size only.
+
+    Args:
+        build_model: function (minibatch dataframe, total_size) -> pm.Model, e.g.
+            lambda X, total_size: create_blr(X, X.fire, coords, total_size=total_size)
+        training_set (ColumnarTrainingSet): training data
+        data_columns (dict): data container name -> column(s) of the training data, see get_blr_data_columns
+        batch_size (int, optional): samples per minibatch. Defaults to 1000.
+        n (int, optional): number of iterations. Defaults to 20000.
+        method (str, optional): variational method of pm.fit. Defaults to "advi".
+        random_seed (int, optional): seed of the minibatches and of pm.fit. Defaults to None.
+
+    Returns:
+        tuple: model and fitted approximation
+    """
+
+    rng = np.random.default_rng(random_seed)
+    model = build_model(training_set.sample_batch(batch_size, rng), len(training_set))
+    feeder = MinibatchFeeder(model, training_set, data_columns, batch_size, rng.integers(2**31))
+    with model:
+        approx = pm.fit(n=n, method=method, random_seed=random_seed,
+                        callbacks=[feeder, *fit_kwargs.pop("callbacks", [])], **fit_kwargs)
+    return model, approx
+
+
+def check_backend(backend: str) -> None:
+    """raises an error if the backend is unknown or its packages are not installed"""
+
+    if backend not in SAMPLER_BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, use one of {list(SAMPLER_BACKENDS)}")
+    missing = [module for module in SAMPLER_BACKENDS[backend] if importlib.util.find_spec(module) is None]
+    if missing:
+        raise ImportError(f"Backend {backend} requires {', '.join(missing)} (pip install {' '.join(missing)})")
+
+
+def _reshape_chains(posterior: xr.Dataset, chains: int) -> xr.Dataset:
+    """splits the single chain of approximation samples into chains, like the NUTS backends return them"""
+
+    n_draws = posterior.sizes["draw"] // chains
+    data_vars = {}
+    for name, values in posterior.data_vars.items():
+        dims = values.dims[2:]
+        data_vars[name] = (("chain", "draw", *dims),
+                           values.values[0, :chains * n_draws].reshape(chains, n_draws, *values.shape[2:]))
+    coords = {name: coord for name, coord in posterior.coords.items() if name not in ("chain", "draw")}
+    coords.update(chain=np.arange(chains), draw=np.arange(n_draws))
+    return xr.Dataset(data_vars, coords=coords, attrs=posterior.attrs)
+
+
+def min_ess_bulk(idata: az.InferenceData, var_names: list = None) -> float:
+    """smallest bulk effective sample size of all posterior variables (or of var_names)"""
+
+    ess = az.ess(idata, var_names=var_names, method="bulk")
+    return min(float(ess[name].min()) for name in ess.data_vars)
+
+
+def get_unconstrained_posterior(model: pm.Model, idata: az.InferenceData) -> dict:
+    """
+    mean and standard deviation of the posterior of every free variable of the model in the
+    unconstrained space of its value variable (e.g. log(sigma))
+
+    Variables that are not in the posterior or have another shape (e.g. coefficients of the
+    groups of a new season) are skipped.
+
+    Returns:
+        dict: free variable -> (mean, std), arrays with the shape of the variable
+    """
+
+    initial_point = model.initial_point()
+    moments = {}
+    for rv in model.free_RVs:
+        value_var = model.rvs_to_values[rv]
+        if rv.name not in idata.posterior or \
+                idata.posterior[rv.name].shape[2:] != initial_point[value_var.name].shape:
+            continue
+        samples = idata.posterior[rv.name].values.reshape(-1, *initial_point[value_var.name].shape)
+        transform = model.rvs_to_transforms.get(rv)
+        if transform is not None:
+            samples = transform.forward(samples, *rv.owner.inputs).eval()
+        moments[rv] = (samples.mean(axis=0), samples.std(axis=0))
+    return moments
+
+
+def get_warm_start_kwargs(model: pm.Model, idata: az.InferenceData, backend: str = "pymc",
+                          mass_matrix_weight: int = 100) -> dict:
+    """
+    arguments of pm.sample / pm.fit that start the fit of a model from the posterior of a previous fit
+
+    "pymc": the chains start at the posterior mean and NUTS starts with the posterior variances as
+    diagonal mass matrix (counted as mass_matrix_weight tuning draws), so a short tuning phase is
+    enough. "numpyro" and "blackjax": initial values only. "advi": the approximation starts with
+    the posterior mean and standard deviation. Variables without matching posterior samples start
+    at their default initial values (and unit mass).
+
+    Args:
+        model (pm.Model): model to fit, e.g. built with the data of all seasons
+        idata (az.InferenceData): posterior of the previous fit
+        backend (str, optional): key of SAMPLER_BACKENDS. Defaults to "pymc".
+        mass_matrix_weight (int, optional): weight of the previous variances in the mass matrix adaptation. Defaults to 100.
+    """
+
+    if backend == "nutpie":
+        raise ValueError("Warm start is not supported by the nutpie backend")
+    moments = get_unconstrained_posterior(model, idata)
+
+    initvals = {}
+    for rv, (mean, _) in moments.items():
+        transform = model.rvs_to_transforms.get(rv)
+        initvals[rv.name] = mean if transform is None else transform.backward(mean, *rv.owner.inputs).eval()
+    if backend == "advi":
+        return {"start": initvals,
+                "start_sigma": {model.rvs_to_values[rv].name: np.ravel(std) for rv, (_, std) in moments.items()}}
+    if backend != "pymc":
+        return {"initvals": initvals}
+
+    initial_point = model.initial_point()
+    means, variances = [], []
+    for value_var in model.value_vars:
+        rv = model.values_to_rvs[value_var]
+        mean, std = moments.get(rv, (initial_point[value_var.name], np.ones_like(initial_point[value_var.name])))
+        means.append(np.ravel(mean))
+        variances.append(np.ravel(std) ** 2)
+    mean, variance = np.concatenate(means), np.concatenate(variances)
+    potential = QuadPotentialDiagAdapt(len(mean), mean, variance, mass_matrix_weight)
+    step = pm.NUTS(vars=model.value_vars, potential=potential, model=model)
+    return {"initvals": initvals, "step": step}
+
+
+def add_posterior_as_prior(model: pm.Model, idata: az.InferenceData, var_names: list = None) -> pm.Model:
+    """
+    replaces the priors of variables by a normal approximation of their previous posterior, so that
+    the model can be updated with new data only
+
+    The approximation is normal in the unconstrained space (lognormal for positive variables)
+    and independent between the variables, i.e. correlations of the posterior are lost. By default
+    the hierarchical parameters (mu_*, sigma_*) are replaced. If all free variables are replaced,
+    the model only needs the data of the new season.
+
+    Args:
+        model (pm.Model): model (modified in place)
+        idata (az.InferenceData): posterior of the previous fit
+        var_names (list, optional): variables to replace. Defaults to the mu_* and sigma_* variables.
+
+    Returns:
+        pm.Model: model
+    """
+
+    if var_names is None:
+        var_names = [rv.name for rv in model.free_RVs if rv.name.startswith(("mu_", "sigma_"))]
+    moments = get_unconstrained_posterior(model, idata)
+
+    with model:
+        for var_name in var_names:
+            rv = model[var_name]
+            if rv not in moments:
+                raise ValueError(f"No posterior samples of {var_name} with the shape of the model")
+            transform = model.rvs_to_transforms.get(rv)
+            mean, std = moments[rv]
+            if transform is None:
+                approximation = pm.Normal.dist(mean, std)
+            elif isinstance(transform, LogTransform):
+                approximation = pm.LogNormal.dist(mean, std)
+            else:
+                raise ValueError(f"Transform {transform} of {var_name} is not supported")
+            # the previous posterior already contains the prior
+            pm.Potential(f"{var_name}_posterior_as_prior",
+                         pm.logp(approximation, rv).sum() - pm.logp(rv, rv).sum())
+    return model
+
+
+def fit(
+    model: pm.Model,
+    backend: str = "pymc",
+    draws: int = 1000,
+    tune: int = 1000,
+    chains: int = 4,
+    random_seed: int = None,
+    n: int = 30000,
+    warm_start: az.InferenceData = None,
+    **kwargs,
+) -> az.InferenceData:
+    """
+    fits a model with one of the SAMPLER_BACKENDS and returns the posterior as InferenceData
+
+    "pymc", "nutpie", "numpyro" and "blackjax" run NUTS through pm.sample (nutpie compiles the logp
+    with numba, numpyro and blackjax with jax, all of them on the CPU). "advi" fits a mean-field
+    approximation with n iterations and draws chains * draws samples from it. The posterior of all
+    backends has the dims (chain, draw, ...), so the result can be used by the prediction classes
+    and plots like a pm.sample trace.
+
+    The wall time (sampling_time), the smallest bulk ESS of the free variables (min_ess_bulk) and
+    min_ess_bulk / sampling_time (ess_per_second) are stored in idata.attrs together with the backend.
+    For "advi" the draws are independent, so the ESS only reflects the number of draws.
+
+    With warm_start (the posterior of a previous fit, e.g. of the last season) the fit starts from
+    that posterior, see get_warm_start_kwargs. Fewer tuning steps (NUTS) or iterations (advi) are
+    needed then.
+
+    Args:
+        model (pm.Model): model to fit
+        backend (str, optional): key of SAMPLER_BACKENDS. Defaults to "pymc".
+        draws (int, optional): draws per chain. Defaults to 1000.
+        tune (int, optional): tuning steps per chain (NUTS). Defaults to 1000.
+        chains (int, optional): number of chains. Defaults to 4.
+        random_seed (int, optional): seed. Defaults to None.
+        n (int, optional): number of iterations (advi). Defaults to 30000.
+        warm_start (az.InferenceData, optional): posterior to start from. Defaults to None.
+        kwargs: passed to pm.sample or pm.fit
+
+    Raises:
+        ValueError: if the backend is unknown
+        ImportError: if the packages of the backend are not installed
+    """
+
+    check_backend(backend)
+    kwargs.setdefault("progressbar", False)
+    if warm_start is not None:
+        kwargs = {**get_warm_start_kwargs(model, warm_start, backend), **kwargs}
+    start = time.perf_counter()
+    with model:
+        if backend == "advi":
+            approx = pm.fit(n=n, method="advi", random_seed=random_seed, **kwargs)
+            idata = approx.sample(draws * chains, random_seed=random_seed)
+            idata.posterior = _reshape_chains(idata.posterior, chains)
+        else:
+            idata = pm.sample(draws=draws, tune=tune, chains=chains, random_seed=random_seed,
+                              nuts_sampler=backend, **kwargs)
+    sampling_time = time.perf_counter() - start
+
+    ess = min_ess_bulk(idata, [rv.name for rv in model.free_RVs])
+    idata.attrs.update(backend=backend, sampling_time=sampling_time, min_ess_bulk=ess,
+                       ess_per_second=ess / sampling_time)
+    return idata
@@ -1,6 +1,18 @@
+import os
+import json
+import joblib
+import numpy as np
 import pandas as pd
+import xarray as xr
+import arviz as az
 import cloudpickle
 
+from src.modeling import bayesian_models
+
+POSTERIOR_FILE_NAME = "posterior.nc"
+SPEC_FILE_NAME = "spec.json"
+PREPROCESSOR_FILE_NAME = "preprocessor.joblib"
+
 def temporal_train_test_split(train_data: pd.DataFrame, date_col: str, train_size: float) -> tuple:
     """function splits dataframe into train and test dataframe. Split criteria is the date. Newer samples are contained in the testset. Older samples in the training set.
     Args:
@@ -28,3 +40,94 @@ def load_model(path_to_file):
     idata = model_dict['idata']
     model = model_dict['model']
     return model, idata
+
+
+def save_model_artifact(
+    path_to_artifact: str,
+    idata,
+    builder: str,
+    coords: dict,
+    builder_kwargs: dict = None,
+    preprocessor=None,
+    encodings: dict = None,
+    float32: bool = False,
+    drop_vars: tuple = ("z", "p"),
+    draws_per_chunk: int = 250,
+) -> None:
+    """saves a fitted model as directory with the posterior (chunked NetCDF), a json spec and the preprocessor
+
+    Instead of pickling the pymc model, the spec stores the name of the model builder in
+    src.modeling.bayesian_models with its arguments, so the model can be built again if needed.
+
+    Args:
+        path_to_artifact (str): directory of the artifact
+        idata: inference data of the fitted model
+        builder (str): name of the model builder function, e.g. "create_st_blr"
+        coords (dict): coords the model was built with
+        builder_kwargs (dict, optional): other arguments of the builder (without X, y, coords). Defaults to None.
+        preprocessor (optional): fitted preprocessor of the training data. Defaults to None.
+        encodings (dict, optional): encodings of the features, e.g. {"aspect": "convert_aspect_to_cardinal_direction"}. Defaults to None.
+        float32 (bool, optional): store float64 samples as float32. Defaults to False.
+        drop_vars (tuple, optional): variables that are not stored, e.g. deterministics of the training set. Defaults to ("z", "p").
+        draws_per_chunk (int, optional): draws per NetCDF chunk. Defaults to 250.
+    """
+
+    os.makedirs(path_to_artifact, exist_ok=True)
+    posterior = idata.posterior.drop_vars([var for var in drop_vars if var in idata.posterior])
+
+    encoding = {}
+    for var_name, var in posterior.data_vars.items():
+        if float32 and var.dtype == np.float64:
+            posterior[var_name] = var.astype(np.float32)
+        # one chain and draws_per_chunk draws per chunk, so that variables and draw subsets are read on their own
+        chunksizes = tuple(1 if dim == "chain" else min(draws_per_chunk, size) if dim == "draw" else size
+                           for dim, size in zip(var.dims, var.shape))
+        encoding[var_name] = {"zlib": True, "chunksizes": chunksizes}
+    posterior.to_netcdf(os.path.join(path_to_artifact, POSTERIOR_FILE_NAME), encoding=encoding, engine="netcdf4")
+
+    spec = {
+        "builder": builder,
+        "builder_kwargs": builder_kwargs or {},
+        "coords": {name: np.asarray(values).tolist() for name, values in coords.items()},
+        "encodings": encodings or {},
+        "posterior_vars": list(posterior.data_vars),
+    }
+    with open(os.path.join(path_to_artifact, SPEC_FILE_NAME), "w") as file:
+        json.dump(spec, file, indent=2)
+
+    if preprocessor is not None:
+        joblib.dump(preprocessor, os.path.join(path_to_artifact, PREPROCESSOR_FILE_NAME))
+
+
+def load_model_artifact(path_to_artifact: str) -> dict:
+    """opens model artifact, posterior samples are read lazily when a variable is accessed
+
+    Returns:
+        dict: "spec", "idata" (with lazily loaded posterior) and "preprocessor" (None if not saved)
+    """
+
+    with open(os.path.join(path_to_artifact, SPEC_FILE_NAME), "r") as file:
+        spec = json.load(file)
+    posterior = xr.open_dataset(os.path.join(path_to_artifact, POSTERIOR_FILE_NAME), engine="netcdf4")
+
+    path_to_preprocessor = os.path.join(path_to_artifact, PREPROCESSOR_FILE_NAME)
+    preprocessor = joblib.load(path_to_preprocessor) if os.path.exists(path_to_preprocessor) else None
+    return {"spec": spec, "idata": az.InferenceData(posterior=posterior), "preprocessor": preprocessor}
+
+
+def build_model_from_spec(spec: dict, X: pd.DataFrame, y: pd.Series):
+    """builds the pymc model of a model artifact for data X, y (feature matrix and labels for create_bnn)"""
+
+    builder = getattr(bayesian_models, spec["builder"])
+    if spec["builder"] == "create_bnn":
+        return builder(X, y, **spec["builder_kwargs"])
+    return builder(X, y, spec["coords"], **spec["builder_kwargs"])
+
+
+def load_idata(path_to_model: str):
+    """inference data of a model artifact directory or of a pickled model (see save_model)"""
+
+    if os.path.isdir(path_to_model):
+        return load_model_artifact(path_to_model)["idata"]
+    _, idata = load_model(path_to_model)
+    return idata
@@ -0,0 +1,220 @@
+import unittest
+import numpy as np
+import pandas as pd
+import pymc as pm
+from scipy.special import gammaln
+
+from src.modeling import bayesian_models
+from src.modeling.bayesian_models import (
+    BLR_CLASS_FEATURES,
+    aggregate_patterns,
+    create_blr,
+    create_group_coefficients,
+    create_st_blr,
+    create_st_intercept_blr,
+    create_stacked_blr,
+)
+from src.modeling.predictions import BLRPosteriorPredictor
+from scripts import legacy_blr_builders
+from tests.test_predictions import COORDS, fake_posterior, random_features, to_model_data
+
+GROUPING_VARIABLES = {"spatial_grouping_variable": "spatial_group", "temporal_grouping_variable": "temporal_group"}
+FEATURE_NAMES = [name for _, name in BLR_CLASS_FEATURES]
+
+
+def random_point(model, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    return {name: rng.normal(0, 0.5, np.shape(value)) for name, value in model.initial_point().items()}
+
+
+def linear_predictor(X: pd.DataFrame, coefficients: dict, grouping: str) -> np.array:
+    """z of the BLR models computed feature by feature from the beta_<name> coefficients"""
+    if grouping == "none":
+        groups = ()
+        z = coefficients["intercept"] + coefficients["beta_ffmc"] * X.ffmc.values
+    else:
+        groups = (X.spatial_group.values, X.temporal_group.values)
+        z = coefficients["intercept"][groups]
+        z = z + (coefficients["beta_ffmc"][groups] if grouping == "all" else coefficients["beta_ffmc"]) * X.ffmc.values
+    for column, name in BLR_CLASS_FEATURES:
+        idx = (X[column].values, *groups) if grouping == "all" else X[column].values
+        z = z + coefficients[f"beta_{name}"][idx]
+    return z + coefficients["error_beta"]
+
+
+class TestBLRBuilders(unittest.TestCase):
+
+    def setUp(self):
+        self.X = random_features(200, 0)
+        self.y = pd.Series(np.random.default_rng(1).integers(0, 2, len(self.X)))
+
+    def assert_linear_predictor(self, model, grouping: str):
+        names = ["z", "intercept", "beta_ffmc", "error_beta"] + [f"beta_{name}" for name in FEATURE_NAMES]
+        outputs = model.replace_rvs_by_values([model[name] for name in names])
+        evaluate = model.compile_fn(outputs, inputs=model.value_vars, on_unused_input="ignore")
+        for seed in range(3):
+            coefficients = dict(zip(names, evaluate(random_point(model, seed))))
+            np.testing.assert_allclose(coefficients["z"], linear_predictor(self.X, coefficients, grouping))
+
+    def test_blr(self):
+        model = create_blr(self.X, self.y, COORDS)
+        self.assertEqual(set(model.initial_point()),
+                         {"intercept", "beta_ffmc", "error_beta"} | {f"beta_{name}" for name in FEATURE_NAMES})
+        self.assert_linear_predictor(model, "none")
+
+    def test_st_intercept_blr(self):
+        model = create_st_intercept_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values())
+        self.assertEqual(model.named_vars_to_dims["intercept"], ("spatial_groups", "temporal_groups"))
+        self.assert_linear_predictor(model, "intercept")
+
+    def test_st_blr(self):
+        for parameterization in ("centered", "non_centered"):
+            with self.subTest(parameterization=parameterization):
+                model = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(),
+                                      parameterization=parameterization)
+                self.assertEqual(model.named_vars_to_dims["beta_slope"],
+                                 ("slope_classes", "spatial_groups", "temporal_groups"))
+                self.assert_linear_predictor(model, "all")
+
+    def test_wrappers_build_the_stacked_model(self):
+        wrapped = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values())
+        stacked = create_stacked_blr(self.X, self.y, COORDS, "all", **GROUPING_VARIABLES)
+        self.assertEqual(set(wrapped.named_vars), set(stacked.named_vars))
+        point = random_point(stacked, 0)
+        self.assertAlmostEqual(float(wrapped.compile_logp()(point)), float(stacked.compile_logp()(point)))
+        with self.assertRaises(ValueError):
+            create_stacked_blr(self.X, self.y, COORDS, "other")
+
+    def test_equivalent_to_legacy_builders(self):
+        builders = {
+            "blr": ("create_blr", ()),
+            "st_intercept": ("create_st_intercept_blr", tuple(GROUPING_VARIABLES.values())),
+            "st": ("create_st_blr", tuple(GROUPING_VARIABLES.values())),
+        }
+        for name, (builder, grouping_variables) in builders.items():
+            for parameterization in ("centered", "non_centered") if grouping_variables else ("centered",):
+                with self.subTest(builder=name, parameterization=parameterization):
+                    kwargs = {"parameterization": parameterization} if grouping_variables else {}
+                    model = getattr(bayesian_models, builder)(self.X, self.y, COORDS, *grouping_variables, **kwargs)
+                    legacy = getattr(legacy_blr_builders, builder)(self.X, self.y, COORDS, *grouping_variables,
+                                                                   **kwargs)
+                    # same free variables, so traces of the legacy builders warm start the stacked models
+                    self.assertEqual(list(model.initial_point()), list(legacy.initial_point()))
+                    logp, legacy_logp = model.compile_logp(), legacy.compile_logp()
+                    dlogp, legacy_dlogp = model.compile_dlogp(), legacy.compile_dlogp()
+                    for seed in range(3):
+                        point = random_point(model, seed)
+                        self.assertAlmostEqual(float(logp(point)), float(legacy_logp(point)))
+                        np.testing.assert_allclose(dlogp(point), legacy_dlogp(point), rtol=1e-8, atol=1e-8)
+
+    def test_feature_coefficients_for_prediction(self):
+        model = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values())
+        predictions = BLRPosteriorPredictor(fake_posterior(model, 0), to_model_data(random_features(50, 2))).predict()
+        self.assertEqual(len(predictions), 50)
+        self.assertTrue(predictions.p_pred.between(0, 1).all())
+
+
+class TestGroupParameterization(unittest.TestCase):
+
+    def setUp(self):
+        self.X = random_features(200, 0)
+        self.y = pd.Series(np.random.default_rng(1).integers(0, 2, len(self.X)))
+
+    def test_centered_is_default(self):
+        model = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values())
+        centered = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), parameterization="centered")
+        self.assertEqual(set(model.initial_point()), set(centered.initial_point()))
+        self.assertIn("beta_slope", model.named_vars)
+        self.assertNotIn("beta_slope_offset", model.named_vars)
+
+    def test_non_centered_models(self):
+        builders = {
+            "st": lambda **kwargs: create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), **kwargs),
+            "st_intercept": lambda **kwargs: create_st_intercept_blr(self.X, self.y, COORDS,
+                                                                     *GROUPING_VARIABLES.values(), **kwargs),
+            "stacked": lambda **kwargs: create_stacked_blr(self.X, self.y, COORDS, "all", **GROUPING_VARIABLES,
+                                                           **kwargs),
+        }
+        for name, build in builders.items():
+            for distribution in ("cauchy", "student_t", "normal"):
+                with self.subTest(builder=name, distribution=distribution):
+                    model = build(parameterization="non_centered", distribution=distribution)
+                    self.assertTrue(np.isfinite(model.compile_logp()(model.initial_point())))
+                    self.assertIn("intercept_offset", model.named_vars)
+                    self.assertIn(model["intercept"], model.deterministics)
+                    self.assertEqual("intercept_precision" in model.named_vars, distribution != "normal")
+
+    def test_deterministic_coefficients_keep_dims(self):
+        model = create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), parameterization="non_centered")
+        self.assertIn(model["beta_slope"], model.deterministics)
+        self.assertEqual(model.named_vars_to_dims["beta_slope"],
+                         ("slope_classes", "spatial_groups", "temporal_groups"))
+
+    def test_non_centered_normal_is_shifted_and_scaled_offset(self):
+        with pm.Model(coords={"groups": [0, 1, 2]}) as model:
+            create_group_coefficients("beta", 1.5, 2.0, "groups", "non_centered", "normal")
+        point = {"beta_offset": np.array([-1.0, 0.0, 0.5])}
+        beta = model.compile_fn(model["beta"], inputs=[model["beta_offset"]])(point)
+        np.testing.assert_allclose(beta, 1.5 + 2.0 * point["beta_offset"])
+
+    def test_unknown_options(self):
+        with self.assertRaises(ValueError):
+            create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), parameterization="other")
+        with self.assertRaises(ValueError):
+            create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), distribution="other")
+
+
+class TestAggregatedLikelihood(unittest.TestCase):
+
+    def setUp(self):
+        # few distinct patterns, each repeated several times
+        patterns = random_features(40, 0)
+        self.X = patterns.sample(400, replace=True, random_state=1).reset_index(drop=True)
+        self.y = pd.Series(np.random.default_rng(2).integers(0, 2, len(self.X)))
+
+    def test_aggregate_patterns(self):
+        X, fires, trials = aggregate_patterns(self.X, self.y, ["spatial_group", "temporal_group"])
+        self.assertEqual(len(X), len(self.X.drop_duplicates()))
+        self.assertEqual(trials.sum(), len(self.X))
+        self.assertEqual(fires.sum(), self.y.sum())
+        first = (self.X == X.iloc[0]).all(axis=1)
+        self.assertEqual(fires.iloc[0], self.y[first].sum())
+        self.assertEqual(trials[0], first.sum())
+
+    def test_equivalent_to_per_row_model(self):
+        _, fires, trials = aggregate_patterns(self.X, self.y, list(GROUPING_VARIABLES.values()))
+        # log binomial coefficients of the Binomial likelihood
+        constant = np.sum(gammaln(trials + 1) - gammaln(fires + 1) - gammaln(trials - fires + 1))
+        builders = {
+            "blr": lambda **kwargs: create_blr(self.X, self.y, COORDS, **kwargs),
+            "st_intercept": lambda **kwargs: create_st_intercept_blr(self.X, self.y, COORDS,
+                                                                     *GROUPING_VARIABLES.values(), **kwargs),
+            "st": lambda **kwargs: create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values(), **kwargs),
+            "stacked": lambda **kwargs: create_stacked_blr(self.X, self.y, COORDS, "all", **GROUPING_VARIABLES,
+                                                           **kwargs),
+        }
+        for name, build in builders.items():
+            with self.subTest(builder=name):
+                model, aggregated = build(aggregate=False), build(aggregate=True)
+                self.assertEqual(aggregated["y_pred"].owner.op.name, "binomial")
+                logp, aggregated_logp = model.compile_logp(), aggregated.compile_logp()
+                dlogp, aggregated_dlogp = model.compile_dlogp(), aggregated.compile_dlogp()
+                for seed in range(3):
+                    point = random_point(model, seed)
+                    self.assertAlmostEqual(float(aggregated_logp(point) - logp(point)), constant, places=6)
+                    np.testing.assert_allclose(aggregated_dlogp(point), dlogp(point), rtol=1e-8, atol=1e-8)
+
+    def test_aggregates_repeated_rows_by_default(self):
+        self.assertIn("n_trials", create_blr(self.X, self.y, COORDS).named_vars)
+        self.assertIn("n_trials", create_st_blr(self.X, self.y, COORDS, *GROUPING_VARIABLES.values()).named_vars)
+        # minibatches and mostly unique rows are fit row by row
+        self.assertNotIn("n_trials", create_blr(self.X, self.y, COORDS, total_size=10000).named_vars)
+        self.assertNotIn("n_trials", create_blr(random_features(400, 3), self.y, COORDS).named_vars)
+
+    def test_no_minibatches(self):
+        with self.assertRaises(ValueError):
+            create_blr(self.X, self.y, COORDS, total_size=10000, aggregate=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
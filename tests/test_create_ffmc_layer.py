@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+
+from scripts.create_ffmc_layer import (
+    calculate_hourly_ffmc_cube,
+    create_ffmc_layers_for_season,
+    create_hourly_ffmc_layer,
+    get_time_window,
+    iterate_hourly_ffmc,
+)
+from src.data_collection.inca_cache import get_netcdf_times
+from src.data_preprocessing.inca_data_preprocessing import (
+    calculate_ffmc_array,
+    calculate_hourly_ffmc_array,
+    calculate_wind_speed,
+)
+
+GRID_SHAPE = (3, 4)
+
+
+def write_weather_netcdfs(tmp_dir: str, start_date: str, end_date: str, seed: int = 0) -> tuple:
+    """writes hourly INCA-like rain (RR) and other parameter (T2M, UU, VV, RH2M) NetCDF files"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start_date, end_date, freq="h")
+    hours = ((times - pd.Timestamp("1970-01-01")) // pd.Timedelta("1h")).values
+    shape = (len(times), *GRID_SHAPE)
+    variables = {
+        "rain": {"RR": np.where(rng.random(shape) < 0.8, 0, rng.uniform(0, 2, shape))},
+        "other": {"T2M": rng.uniform(5, 30, shape), "UU": rng.normal(0, 4, shape), "VV": rng.normal(0, 4, shape),
+                  "RH2M": rng.uniform(20, 100, shape)},
+    }
+    paths = []
+    for name, data in variables.items():
+        path = os.path.join(tmp_dir, f"{name}.nc")
+        with nc.Dataset(path, "w") as ds:
+            ds.createDimension("time", len(times))
+            ds.createDimension("y", GRID_SHAPE[0])
+            ds.createDimension("x", GRID_SHAPE[1])
+            time_var = ds.createVariable("time", "i8", ("time",))
+            time_var.units = "hours since 1970-01-01 00:00:00"
+            time_var[:] = hours
+            ds.createVariable("lat", "f8", ("y", "x"))[:] = np.linspace(47, 48, GRID_SHAPE[0])[:, None] * np.ones(GRID_SHAPE)
+            ds.createVariable("lon", "f8", ("y", "x"))[:] = np.linspace(13, 15, GRID_SHAPE[1])[None] * np.ones(GRID_SHAPE)
+            for parameter, values in data.items():
+                ds.createVariable(parameter, "f8", ("time", "y", "x"))[:] = values
+        paths.append(path)
+    return tuple(paths)
+
+
+def read_weather(path_to_rain_nc: str, path_to_other_nc: str) -> tuple:
+    """time axis and all time steps of the synthetic NetCDF files"""
+    with nc.Dataset(path_to_rain_nc) as ds_rain, nc.Dataset(path_to_other_nc) as ds_other:
+        times = get_netcdf_times(ds_rain)
+        weather = {name: np.asarray(ds_other.variables[name][:]) for name in ["T2M", "UU", "VV", "RH2M"]}
+        weather["RR"] = np.asarray(ds_rain.variables["RR"][:])
+    return times, weather
+
+
+class TestSeasonFFMCLayers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path_to_rain_nc, self.path_to_other_nc = write_weather_netcdfs(
+            self.tmp_dir, "2023-06-01T12:00", "2023-06-04T12:00")
+        self.paths = {"ffmc": {"intermediate": os.path.join(self.tmp_dir, "ffmc_intermediate"),
+                               "final": os.path.join(self.tmp_dir, "ffmc")}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_time_window_includes_both_ends(self):
+        with nc.Dataset(self.path_to_rain_nc) as ds:
+            window = get_time_window(ds, "2023-06-02T12:00", "2023-06-03T12:00")
+            times = get_netcdf_times(ds)[window]
+            with self.assertRaises(ValueError):
+                get_time_window(ds, "2023-07-01T00:00", "2023-07-02T00:00")
+        self.assertEqual(times[0], pd.Timestamp("2023-06-02T12:00"))
+        self.assertEqual(times[-1], pd.Timestamp("2023-06-03T12:00"))
+
+    def test_matches_chained_daily_ffmc(self):
+        with mock.patch("scripts.create_ffmc_layer.write_ffmc_layers") as write_ffmc_layers:
+            create_ffmc_layers_for_season(self.paths, "2023-06-02T12:00", "2023-06-04T12:00", None,
+                                          self.path_to_rain_nc, self.path_to_other_nc)
+
+        written = {call.args[4]: call.args[1] for call in write_ffmc_layers.call_args_list}
+        self.assertEqual(list(written), ["20230602", "20230603", "20230604"])
+
+        # state of the previous day is carried over, the first day starts from FFMC_INITIAL_VALUE
+        times, weather = read_weather(self.path_to_rain_nc, self.path_to_other_nc)
+        ffmc = np.full(GRID_SHAPE, 85)
+        for date, ffmc_layer in written.items():
+            date = pd.Timestamp(date) + pd.Timedelta("12h")
+            in_window = (times >= date - pd.Timedelta("24h")) & (times <= date)
+            first = np.flatnonzero(in_window)[0]
+            ffmc = calculate_ffmc_array(ffmc, weather["RH2M"][first], weather["T2M"][first],
+                                        weather["RR"][in_window].sum(axis=0),
+                                        calculate_wind_speed(weather["UU"][first], weather["VV"][first]))
+            np.testing.assert_allclose(ffmc_layer, ffmc)
+
+    def test_starts_from_intermediate_layer_of_previous_day(self):
+        ffmc_prev = np.full(GRID_SHAPE, 60.0)
+        with mock.patch("scripts.create_ffmc_layer.write_ffmc_layers") as write_ffmc_layers, \
+                mock.patch("scripts.create_ffmc_layer.load_ffmc_layer", return_value=ffmc_prev) as load_ffmc_layer:
+            create_ffmc_layers_for_season(self.paths, "2023-06-02T12:00", "2023-06-03T12:00", None,
+                                          self.path_to_rain_nc, self.path_to_other_nc)
+        load_ffmc_layer.assert_called_once_with(self.paths, "2023-06-01T12:00:00", intermediate=True)
+
+        times, weather = read_weather(self.path_to_rain_nc, self.path_to_other_nc)
+        first = times.get_loc(pd.Timestamp("2023-06-01T12:00"))
+        in_window = (times >= pd.Timestamp("2023-06-01T12:00")) & (times <= pd.Timestamp("2023-06-02T12:00"))
+        expected = calculate_ffmc_array(ffmc_prev, weather["RH2M"][first], weather["T2M"][first],
+                                        weather["RR"][in_window].sum(axis=0),
+                                        calculate_wind_speed(weather["UU"][first], weather["VV"][first]))
+        np.testing.assert_allclose(write_ffmc_layers.call_args_list[0].args[1], expected)
+
+
+class TestHourlyFFMCCube(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path_to_rain_nc, self.path_to_other_nc = write_weather_netcdfs(
+            self.tmp_dir, "2023-06-01T00:00", "2023-06-03T00:00", seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_cube(self, path: str) -> tuple:
+        with nc.Dataset(path) as ds:
+            return get_netcdf_times(ds), np.asarray(ds.variables["FFMC"][:])
+
+    def chained_hourly_ffmc(self, start_date: str, end_date: str, ffmc_0: np.array) -> tuple:
+        times, weather = read_weather(self.path_to_rain_nc, self.path_to_other_nc)
+        selected = np.flatnonzero((times > pd.Timestamp(start_date)) & (times <= pd.Timestamp(end_date)))
+        ffmc, cube = ffmc_0, []
+        for i in selected:
+            ffmc = calculate_hourly_ffmc_array(ffmc, weather["RH2M"][i], weather["T2M"][i], weather["RR"][i],
+                                               calculate_wind_speed(weather["UU"][i], weather["VV"][i]))
+            cube.append(ffmc)
+        return times[selected], np.stack(cube)
+
+    def test_matches_chained_hourly_ffmc(self):
+        path = os.path.join(self.tmp_dir, "cube.nc")
+        ffmc_end = calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path,
+                                              "2023-06-01T00:00", "2023-06-02T12:00")
+        expected_times, expected = self.chained_hourly_ffmc("2023-06-01T00:00", "2023-06-02T12:00",
+                                                            np.full(GRID_SHAPE, 85.0))
+        times, cube = self.read_cube(path)
+        self.assertEqual(len(times), 36)
+        np.testing.assert_array_equal(times, expected_times)
+        np.testing.assert_allclose(cube, expected, rtol=1e-6)
+        np.testing.assert_allclose(ffmc_end, expected[-1])
+
+    def test_state_streams_across_chunks(self):
+        # a window split in two, the second part started from the ffmc returned by the first
+        ffmc_0 = np.full(GRID_SHAPE, 70.0)
+        path_full, path_first, path_second = (os.path.join(self.tmp_dir, f"{name}.nc")
+                                              for name in ("full", "first", "second"))
+        calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path_full,
+                                   "2023-06-01T00:00", "2023-06-03T00:00", ffmc_0)
+        ffmc_mid = calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path_first,
+                                              "2023-06-01T00:00", "2023-06-01T17:00", ffmc_0)
+        calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path_second,
+                                   "2023-06-01T17:00", "2023-06-03T00:00", ffmc_mid)
+
+        times, cube = self.read_cube(path_full)
+        first_times, first_cube = self.read_cube(path_first)
+        second_times, second_cube = self.read_cube(path_second)
+        np.testing.assert_array_equal(times, first_times.append(second_times))
+        np.testing.assert_allclose(cube, np.concatenate([first_cube, second_cube]))
+
+    def test_iterator_yields_one_step_per_hour(self):
+        with nc.Dataset(self.path_to_rain_nc) as nc_rainfall, nc.Dataset(self.path_to_other_nc) as nc_inca_param:
+            steps = list(iterate_hourly_ffmc(nc_rainfall, nc_inca_param, "2023-06-01T05:00", "2023-06-01T08:00"))
+        self.assertEqual([time.hour for time, _ in steps], [6, 7, 8])
+
+    def test_daily_output_hour(self):
+        path_hourly, path_daily = (os.path.join(self.tmp_dir, f"{name}.nc") for name in ("hourly", "daily"))
+        calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path_hourly,
+                                   "2023-06-01T00:00", "2023-06-03T00:00")
+        ffmc_end = calculate_hourly_ffmc_cube(self.path_to_rain_nc, self.path_to_other_nc, path_daily,
+                                              "2023-06-01T00:00", "2023-06-03T00:00", daily_output_hour=23)
+
+        times, cube = self.read_cube(path_hourly)
+        daily_times, daily_cube = self.read_cube(path_daily)
+        self.assertEqual(list(daily_times), [pd.Timestamp("2023-06-01T23:00"), pd.Timestamp("2023-06-02T23:00")])
+        np.testing.assert_allclose(daily_cube, cube[times.hour == 23])
+        # the state still runs to the end of the window
+        np.testing.assert_allclose(ffmc_end, cube[-1])
+
+    def test_hourly_layer_from_given_netcdfs(self):
+        paths = {"ffmc": {"intermediate": os.path.join(self.tmp_dir, "ffmc_intermediate"),
+                          "final": os.path.join(self.tmp_dir, "ffmc"),
+                          "hourly": os.path.join(self.tmp_dir, "ffmc_hourly")}}
+        create_hourly_ffmc_layer(paths, "2023-06-01T00:00", "2023-06-03T00:00", None,
+                                 self.path_to_rain_nc, self.path_to_other_nc, daily_output_hour=12)
+        times, cube = self.read_cube(os.path.join(self.tmp_dir, "ffmc_hourly_20230601T0000_20230603T0000.nc"))
+        self.assertEqual(list(times.hour), [12, 12])
+        _, expected = self.chained_hourly_ffmc("2023-06-01T00:00", "2023-06-03T00:00", np.full(GRID_SHAPE, 85.0))
+        np.testing.assert_allclose(cube, expected[[11, 35]], rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+import pandas as pd
+
+from src.modeling import encodings
+
+SCALAR_AND_ARRAY_ENCODINGS = [
+    (encodings.convert_aspect_to_cardinal_direction, encodings.convert_aspect_to_cardinal_direction_array),
+    (encodings.convert_slope_to_classes, encodings.convert_slope_to_classes_array),
+    (encodings.convert_elevation_to_classes, encodings.convert_elevation_to_classes_array),
+    (encodings.convert_population_to_classes, encodings.convert_population_to_classes_array),
+    (encodings.convert_canopy_cover_to_classes, encodings.convert_canopy_cover_to_classes_array),
+    (encodings.convert_ffmc_to_classes, encodings.convert_ffmc_to_classes_array),
+]
+
+# class boundaries of all encodings, shifted slightly to both sides, plus special values
+BOUNDARIES = [0, 10, 20, 22.5, 30, 40, 50, 60, 67.5, 78, 80, 87, 91, 93, 100, 112.5, 157.5, 202.5, 247.5,
+              292.5, 337.5, 360, 500, 800, 1000, 1500, 1800, 2200]
+TEST_VALUES = np.concatenate([BOUNDARIES, np.add(BOUNDARIES, 1e-6), np.subtract(BOUNDARIES, 1e-6),
+                              np.linspace(-100, 3000, 1000), [np.nan, np.inf, -np.inf]])
+
+
+class TestArrayEncodings(unittest.TestCase):
+
+    def test_array_encodings_match_scalar_encodings(self):
+        for scalar_encoding, array_encoding in SCALAR_AND_ARRAY_ENCODINGS:
+            with self.subTest(encoding=scalar_encoding.__name__):
+                expected = [scalar_encoding(value) for value in TEST_VALUES]
+                classes = array_encoding(TEST_VALUES)
+                self.assertEqual(classes.dtype, np.int8)
+                np.testing.assert_array_equal(classes, expected)
+
+    def test_series_keep_index(self):
+        series = pd.Series([10.0, 400.0, np.nan], index=[5, 7, 9], name="aspect")
+        classes = encodings.convert_aspect_to_cardinal_direction_array(series)
+        pd.testing.assert_series_equal(classes, pd.Series([0, 0, -1], index=[5, 7, 9], name="aspect", dtype=np.int8))
+
+    def test_raster_block_with_mask_and_nodata(self):
+        block = np.ma.masked_array([[100.0, 600.0], [-9999.0, 2500.0]], mask=[[True, False], [False, False]])
+        classes = encodings.convert_elevation_to_classes_array(block, nodata=-9999)
+        np.testing.assert_array_equal(classes, [[-1, 1], [-1, 5]])
+
+    def test_binary_array_matches_scalar(self):
+        values = TEST_VALUES[np.isfinite(TEST_VALUES)]
+        np.testing.assert_array_equal(encodings.map_to_binary_array(values),
+                                      [encodings.map_to_binary(value) for value in values])
+        np.testing.assert_array_equal(encodings.map_to_binary_array([np.nan, -1.0], nodata=-1), [-1, -1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import geopandas as gpd
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.geometry import box
+
+from src.data_preprocessing import feature_datacube
+from src.data_preprocessing.feature_datacube import FeatureDatacube, write_feature_datacube
+from src.data_preprocessing.feature_engineering import sample_rasters
+
+GRID_SHAPE = (70, 90)
+TRANSFORM = from_origin(100000, 400000, 100, 100)
+FFMC_DATES = ["2021-07-01", "2021-07-02", "2021-07-05"]
+
+
+def write_layer(path: str, data: np.array, nodata, transform=TRANSFORM):
+    with rasterio.open(path, "w", driver="GTiff", height=data.shape[0], width=data.shape[1], count=1,
+                       dtype=data.dtype, crs="EPSG:31287", transform=transform, nodata=nodata) as dst:
+        dst.write(data, 1)
+
+
+class TestFeatureDatacube(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.path_to_ref_grid = os.path.join(self.tmp_dir, "ref_grid_id.tif")
+        write_layer(self.path_to_ref_grid, np.arange(np.prod(GRID_SHAPE), dtype="int32").reshape(GRID_SHAPE), -1)
+
+        self.static_layers = [("ref_grid_id", self.path_to_ref_grid)]
+        for name, data, nodata in [
+            ("forest_type", rng.integers(0, 7, GRID_SHAPE).astype("int32"), -1),
+            ("aspect", rng.integers(0, 360, GRID_SHAPE).astype("int32"), -1),
+            ("elevation", rng.uniform(200, 3000, GRID_SHAPE), -9999.0),
+        ]:
+            data[rng.random(GRID_SHAPE) < 0.2] = nodata
+            path = os.path.join(self.tmp_dir, f"{name}.tif")
+            write_layer(path, data, nodata)
+            self.static_layers.append((name, path))
+
+        self.ffmc_layers = {}
+        for i, date in enumerate(FFMC_DATES):
+            path = os.path.join(self.tmp_dir, f"ffmc_{date}.tif")
+            write_layer(path, (rng.uniform(60, 95, GRID_SHAPE) + 100 * i).astype("float32"), -9999.0)
+            self.ffmc_layers[date] = path
+
+        self.path_to_datacube = os.path.join(self.tmp_dir, "datacube.nc")
+        write_feature_datacube(self.path_to_datacube, self.static_layers, self.path_to_ref_grid, self.ffmc_layers,
+                               chunk_size=32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compact_dtypes(self):
+        with FeatureDatacube(self.path_to_datacube) as datacube:
+            dtypes = {name: datacube.ds.variables[name].dtype for name in datacube.nodata}
+            self.assertEqual(datacube.dates, FFMC_DATES)
+            self.assertEqual(datacube.static_variables, ["ref_grid_id", "forest_type", "aspect", "elevation"])
+            self.assertEqual(datacube.nodata["forest_type"], -1)
+        self.assertEqual(dtypes, {"ref_grid_id": np.int16, "forest_type": np.int8, "aspect": np.int16,
+                                  "elevation": np.float32, "ffmc": np.float32})
+
+    def test_value_range_of_integer_layers_only(self):
+        with mock.patch.object(feature_datacube, "_get_value_range",
+                               wraps=feature_datacube._get_value_range) as get_value_range:
+            write_feature_datacube(os.path.join(self.tmp_dir, "other.nc"), self.static_layers,
+                                   self.path_to_ref_grid, self.ffmc_layers)
+        # ref_grid_id, forest_type and aspect, not elevation and ffmc
+        self.assertEqual(get_value_range.call_count, 3)
+
+    def test_dtype_overrides(self):
+        path = os.path.join(self.tmp_dir, "other.nc")
+        write_feature_datacube(path, self.static_layers, self.path_to_ref_grid, dtypes={"aspect": "int32"})
+        with FeatureDatacube(path) as datacube:
+            self.assertEqual(datacube.ds.variables["aspect"].dtype, np.int32)
+            aspect = datacube.read_window(Window(0, 0, GRID_SHAPE[1], GRID_SHAPE[0]), ["aspect"])["aspect"]
+        with rasterio.open(dict(self.static_layers)["aspect"]) as src:
+            np.testing.assert_array_equal(aspect, src.read(1))
+
+        # aspect up to 359 would wrap around in int8
+        with self.assertRaises(ValueError):
+            write_feature_datacube(path, self.static_layers, self.path_to_ref_grid, dtypes={"aspect": "int8"})
+        with self.assertRaises(ValueError):
+            write_feature_datacube(path, self.static_layers, self.path_to_ref_grid, dtypes={"elevation": "uint8"})
+
+    def test_read_window(self):
+        window = Window(20, 10, 45, 33)
+        with FeatureDatacube(self.path_to_datacube) as datacube:
+            values = datacube.read_window(window, date="2021-07-02")
+            df = datacube.read_window_df(window, ["forest_type"])
+        for name, path in [*self.static_layers, ("ffmc", self.ffmc_layers["2021-07-02"])]:
+            with rasterio.open(path) as src:
+                expected = src.read(1, window=window)
+            np.testing.assert_allclose(values[name], expected, rtol=1e-6)
+        self.assertEqual(len(df), 45 * 33)
+        with self.assertRaises(ValueError):
+            with FeatureDatacube(self.path_to_datacube) as datacube:
+                datacube.read_window(window, ["ffmc"])
+
+    def test_read_points(self):
+        rng = np.random.default_rng(1)
+        xs, ys = rng.uniform(99000, 110000, 300), rng.uniform(392000, 401000, 300)
+        dates = rng.choice(["2021-07-01", "2021-07-02", "2021-07-04", "2021-07-06"], 300)
+        events = gpd.GeoDataFrame(geometry=gpd.points_from_xy(xs, ys), crs="EPSG:31287")
+
+        with FeatureDatacube(self.path_to_datacube) as datacube:
+            points = datacube.read_points(xs, ys, dates=dates)
+        expected = sample_rasters(events, self.static_layers)
+        for name, _ in self.static_layers:
+            np.testing.assert_allclose(points[name].values, expected[name].values, rtol=1e-6)
+
+        # closest date, the earlier one on ties
+        nearest_dates = {"2021-07-01": "2021-07-01", "2021-07-02": "2021-07-02", "2021-07-04": "2021-07-05",
+                         "2021-07-06": "2021-07-05"}
+        for date, ffmc_date in nearest_dates.items():
+            selected = dates == date
+            ffmc = sample_rasters(events[selected], [("ffmc", self.ffmc_layers[ffmc_date])])["ffmc"].values
+            np.testing.assert_allclose(points["ffmc"].values[selected], ffmc, rtol=1e-6)
+
+    def test_read_region(self):
+        geometry = box(101050, 394020, 104990, 397000)
+        with FeatureDatacube(self.path_to_datacube) as datacube:
+            window, values, mask = datacube.read_region(geometry, ["ref_grid_id"])
+        full_mask = geometry_mask([geometry], out_shape=GRID_SHAPE, transform=TRANSFORM, invert=True)
+        with rasterio.open(self.path_to_ref_grid) as src:
+            expected_ids = src.read(1)[full_mask]
+        np.testing.assert_array_equal(np.sort(values["ref_grid_id"][mask]), np.sort(expected_ids))
+
+    def test_layers_must_be_aligned(self):
+        path = os.path.join(self.tmp_dir, "shifted.tif")
+        write_layer(path, np.zeros(GRID_SHAPE, dtype="int32"), -1, from_origin(100050, 400000, 100, 100))
+        with self.assertRaises(ValueError):
+            write_feature_datacube(os.path.join(self.tmp_dir, "other.nc"), [("shifted", path)],
+                                   self.path_to_ref_grid)
+
+
+if __name__ == "__main__":
+    unittest.main()
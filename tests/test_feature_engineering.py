@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio.transform import from_origin
+
+from src.data_preprocessing.feature_datacube import add_static_features_from_datacube, write_feature_datacube
+from src.data_preprocessing.feature_engineering import (
+    add_static_feature_from_raster,
+    add_static_features,
+    get_nearest_vintage_idx,
+    sample_raster,
+    sample_rasters,
+    sample_time_stamped_rasters,
+)
+
+GRID_SHAPE = (70, 90)
+TRANSFORM = from_origin(100000, 400000, 100, 100)
+
+
+def write_layer(path: str, data: np.array, nodata):
+    with rasterio.open(path, "w", driver="GTiff", height=data.shape[0], width=data.shape[1], count=1,
+                       dtype=data.dtype, crs="EPSG:31287", transform=TRANSFORM, nodata=nodata) as dst:
+        dst.write(data, 1)
+
+
+class TestRasterSampling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.feature_info = []
+        for name, dtype, nodata in [("elevation", "float32", -9999.0), ("slope", "int16", -1),
+                                    ("pop_2006", "float64", None), ("pop_2011", "int32", 0),
+                                    ("pop_2018", "int32", 0), ("pop_2021", "int32", 0)]:
+            data = rng.integers(-1, 20, GRID_SHAPE).astype(dtype)
+            if nodata is not None:
+                data[rng.random(GRID_SHAPE) < 0.2] = nodata
+            path = os.path.join(self.tmp_dir, f"{name}.tif")
+            write_layer(path, data, nodata)
+            self.feature_info.append((name, path))
+
+        n = 500
+        # some points outside of the rasters and on pixel edges
+        xs = np.concatenate([rng.uniform(99000, 110000, n), [100000, 100100, 108999.9]])
+        ys = np.concatenate([rng.uniform(392000, 401000, n), [400000, 399900, 393000.1]])
+        dates = pd.to_datetime("2003-01-01") + pd.to_timedelta(rng.integers(0, 22 * 365, len(xs)), unit="D")
+        self.events = gpd.GeoDataFrame(
+            {"date": dates.strftime("%Y-%m-%d"), "index": np.arange(len(xs))},
+            geometry=gpd.points_from_xy(xs, ys), crs="EPSG:31287")
+        self.population_layers = {int(name[4:]): path for name, path in self.feature_info if name.startswith("pop_")}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_matches_point_sampling(self):
+        features = sample_rasters(self.events, self.feature_info, block_size=32, max_workers=3)
+        self.assertEqual(list(features.columns), [name for name, _ in self.feature_info])
+        xs, ys = self.events.geometry.x, self.events.geometry.y
+        left, top = TRANSFORM.c, TRANSFORM.f
+        right, bottom = left + GRID_SHAPE[1] * TRANSFORM.a, top + GRID_SHAPE[0] * TRANSFORM.e
+        outside = (xs < left) | (xs >= right) | (ys > top) | (ys <= bottom)
+        self.assertTrue(outside.any())
+        for name, path in self.feature_info:
+            expected = add_static_feature_from_raster(self.events, path, name)[name].astype(float)
+            # point sampling returns 0 outside of rasters without nodata value
+            expected[outside] = np.nan
+            np.testing.assert_array_equal(features[name].values, expected.values)
+
+    def test_nodata_and_outside_points(self):
+        name, path = self.feature_info[1]
+        values = sample_raster(path, np.array([99950.0, 100050.0]), np.array([399950.0, 399950.0]))
+        with rasterio.open(path) as src:
+            first = src.read(1)[0, 0]
+        self.assertTrue(np.isnan(values[0]))
+        self.assertEqual(np.isnan(values[1]), first == -1)
+        self.assertEqual(len(sample_raster(path, np.array([]), np.array([]))), 0)
+
+    def test_nearest_vintage(self):
+        vintages = [2006, 2011, 2018, 2021]
+        dates = pd.Series(pd.date_range("2000-01-01", "2025-12-31", freq="MS"))
+        idx = get_nearest_vintage_idx(dates, vintages)
+        expected = [vintages.index(min(vintages, key=lambda vintage: abs(vintage - date.year))) for date in dates]
+        np.testing.assert_array_equal(idx, expected)
+
+    def test_time_stamped_rasters(self):
+        values = sample_time_stamped_rasters(self.events, self.population_layers)
+        all_vintages = sample_rasters(self.events, [(year, path) for year, path in self.population_layers.items()])
+        years = sorted(self.population_layers)
+        idx = get_nearest_vintage_idx(self.events["date"], years)
+        expected = all_vintages.values[np.arange(len(idx)), idx]
+        np.testing.assert_array_equal(values, expected)
+        self.assertGreater(len(np.unique(idx)), 2)
+
+    def test_add_static_features(self):
+        feature_info = [(name, path) for name, path in self.feature_info if not name.startswith("pop_")]
+        train_data = add_static_features(self.tmp_dir, self.events, feature_info, {"pop_dens": self.population_layers})
+        self.assertEqual(len(train_data), len(self.events))
+        self.assertEqual(train_data.crs, "EPSG:31287")
+        self.assertEqual(list(train_data.columns[-3:]), ["elevation", "slope", "pop_dens"])
+        np.testing.assert_array_equal(train_data["pop_dens"].values,
+                                      sample_time_stamped_rasters(self.events, self.population_layers))
+
+    def test_add_static_features_from_datacube(self):
+        path_to_datacube = os.path.join(self.tmp_dir, "datacube.nc")
+        write_feature_datacube(path_to_datacube, self.feature_info, self.feature_info[0][1], chunk_size=32)
+        feature_info = [(name, path) for name, path in self.feature_info if not name.startswith("pop_")]
+        expected = add_static_features(self.tmp_dir, self.events, feature_info, {"pop_dens": self.population_layers})
+        train_data = add_static_features_from_datacube(
+            self.events, path_to_datacube, [(name, name) for name, _ in feature_info],
+            {"pop_dens": {year: f"pop_{year}" for year in self.population_layers}})
+        self.assertEqual(train_data.crs, "EPSG:31287")
+        pd.testing.assert_frame_equal(pd.DataFrame(train_data), pd.DataFrame(expected), check_dtype=False)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1 +1,77 @@
-# TODO implement test
+import unittest
+import numpy as np
+
+from src.data_preprocessing.inca_data_preprocessing import (
+    calculate_ffmc,
+    calculate_ffmc_array,
+    calculate_hourly_ffmc_array,
+)
+
+
+def random_weather(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    ffmc0 = rng.uniform(0, 101, shape)
+    rhum = rng.uniform(1, 110, shape)
+    temp = rng.uniform(-10, 35, shape)
+    prcp = np.where(rng.random(shape) < 0.5, 0, rng.uniform(0, 30, shape))
+    wind = rng.uniform(0, 15, shape)
+    return ffmc0, rhum, temp, prcp, wind
+
+
+class TestFFMCArray(unittest.TestCase):
+
+    def test_matches_scalar_reference(self):
+        inputs = random_weather((40, 50))
+        expected = np.vectorize(calculate_ffmc)(*inputs)
+        np.testing.assert_allclose(calculate_ffmc_array(*inputs), expected, rtol=1e-12, atol=1e-12)
+
+    def test_stack_of_grids(self):
+        ffmc0, rhum, temp, prcp, wind = random_weather((3, 20, 30), seed=1)
+        stacked = calculate_ffmc_array(ffmc0, rhum, temp, prcp, wind)
+        for i in range(3):
+            np.testing.assert_allclose(
+                stacked[i], calculate_ffmc_array(ffmc0[i], rhum[i], temp[i], prcp[i], wind[i]))
+
+    def test_clipping_of_inputs(self):
+        ffmc = calculate_ffmc_array(85, np.array([120.0, 100.0]), 20, np.array([np.inf, 0.0]), 5)
+        self.assertAlmostEqual(ffmc[0], calculate_ffmc(85, 120.0, 20, np.inf, 5))
+        self.assertEqual(ffmc[0], ffmc[1])
+
+    def test_nan_and_masked_cells(self):
+        ffmc0, rhum, temp, prcp, wind = random_weather((10, 10), seed=2)
+        temp[0, 0] = np.nan
+        rhum = np.ma.masked_array(rhum, mask=np.zeros_like(rhum, dtype=bool))
+        rhum[1, 1] = np.ma.masked
+
+        ffmc = calculate_ffmc_array(ffmc0, rhum, temp, prcp, wind)
+
+        self.assertTrue(np.ma.isMaskedArray(ffmc))
+        self.assertTrue(ffmc.mask[0, 0] and ffmc.mask[1, 1])
+        self.assertEqual(ffmc.mask.sum(), 2)
+
+
+class TestHourlyFFMCArray(unittest.TestCase):
+
+    def test_hourly_steps_equal_one_long_step_for_constant_weather(self):
+        ffmc0, rhum, temp, _, wind = random_weather((20, 20), seed=4)
+        ffmc = ffmc0
+        for _ in range(24):
+            ffmc = calculate_hourly_ffmc_array(ffmc, rhum, temp, 0.0, wind)
+        # moisture <-> ffmc conversion of the hourly code is not exactly invertible
+        np.testing.assert_allclose(
+            ffmc, calculate_hourly_ffmc_array(ffmc0, rhum, temp, 0.0, wind, hours=24), atol=1e-3)
+
+    def test_drying_and_rain(self):
+        dry = calculate_hourly_ffmc_array(80, 20, 30, 0, 10)
+        wet = calculate_hourly_ffmc_array(80, 90, 15, 5, 2)
+        self.assertGreater(dry, 80)
+        self.assertLess(wet, 80)
+
+    def test_nan_cells(self):
+        ffmc = calculate_hourly_ffmc_array(85, np.array([50, np.nan]), 20, 0, 3)
+        self.assertFalse(np.isnan(ffmc[0]))
+        self.assertTrue(np.isnan(ffmc[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
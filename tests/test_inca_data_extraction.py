@@ -0,0 +1,260 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+
+from src.data_collection.inca_cache import IncaGridCache, get_netcdf_times, write_netcdf_time_subset
+from src.data_collection.inca_data_extraction import (
+    get_geosphere_data_grid,
+    get_geosphere_data_grid_chunked,
+    get_geosphere_data_points,
+    split_time_range,
+)
+
+BBOX = "47.4,12.7,48.8,15.0"
+GRID_SHAPE = (4, 5)
+
+
+def write_inca_netcdf(path: str, parameters: list, start_date: str, end_date: str) -> None:
+    """writes INCA-like NetCDF, values are the hours since 1970 plus the index of the parameter"""
+    times = pd.date_range(start_date, end_date, freq="h")
+    hours = ((times - pd.Timestamp("1970-01-01")) // pd.Timedelta("1h")).values
+    with nc.Dataset(path, "w") as ds:
+        ds.createDimension("time", len(times))
+        ds.createDimension("y", GRID_SHAPE[0])
+        ds.createDimension("x", GRID_SHAPE[1])
+        time_var = ds.createVariable("time", "i8", ("time",))
+        time_var.units = "hours since 1970-01-01 00:00:00"
+        time_var[:] = hours
+        ds.createVariable("lat", "f8", ("y", "x"))[:] = np.linspace(47, 48, GRID_SHAPE[0])[:, None] * np.ones(GRID_SHAPE)
+        ds.createVariable("lon", "f8", ("y", "x"))[:] = np.linspace(13, 15, GRID_SHAPE[1])[None] * np.ones(GRID_SHAPE)
+        for i, parameter in enumerate(parameters):
+            ds.createVariable(parameter, "f4", ("time", "y", "x"))[:] = \
+                (hours + i)[:, None, None] * np.ones(GRID_SHAPE)
+
+
+class MockGeosphereHandler(BaseHTTPRequestHandler):
+    """stand-in for the Geosphere grid API, serves generated NetCDF files"""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        if urlparse(self.path).path.endswith("timeseries"):
+            return self.send_timeseries(query)
+        # netCDF4 is not thread-safe, requests of concurrent clients are answered one after the other
+        with self.server.lock:
+            self.server.requests.append(query)
+            path_to_file = os.path.join(self.server.tmp_dir, f"response_{len(self.server.requests)}.nc")
+            write_inca_netcdf(path_to_file, query["parameters"], query["start"][0], query["end"][0])
+            with open(path_to_file, "rb") as file:
+                content = file.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_timeseries(self, query: dict):
+        """geojson response, values are latitude + 1000 * hour index + parameter index"""
+        with self.server.lock:
+            self.server.requests.append(query)
+        times = pd.date_range(query["start"][0], query["end"][0], freq="h")
+        features = []
+        for lat_lon in query["lat_lon"]:
+            lat, lon = map(float, lat_lon.split(","))
+            parameters = {parameter: {"data": [lat + 1000 * t + i for t in range(len(times))]}
+                          for i, parameter in enumerate(query["parameters"])}
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                             "properties": {"parameters": parameters}})
+        content = json.dumps({"timestamps": [time.isoformat() for time in times],
+                              "features": features}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockGeosphereTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockGeosphereHandler)
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.server.tmp_dir = self.tmp_dir
+        self.url = f"http://127.0.0.1:{self.server.server_port}/grid"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def assert_inca_file(self, path: str, start_date: str, end_date: str, parameter: str = "RR"):
+        with nc.Dataset(path) as ds:
+            times = get_netcdf_times(ds)
+            expected_times = pd.date_range(start_date, end_date, freq="h")
+            self.assertTrue(times.equals(expected_times))
+            expected_hours = (expected_times - pd.Timestamp("1970-01-01")) // pd.Timedelta("1h")
+            np.testing.assert_array_equal(ds.variables[parameter][:, 0, 0], expected_hours.values)
+
+
+class TestIncaGridCache(MockGeosphereTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output_dir = os.path.join(self.tmp_dir, "output")
+        os.makedirs(self.output_dir)
+        self.cache = IncaGridCache(os.path.join(self.tmp_dir, "cache"))
+
+    def get_grid(self, start_date, end_date, parameters=("RR",), cache=None):
+        return get_geosphere_data_grid(list(parameters), start_date, end_date, BBOX, self.output_dir,
+                                       cache=cache or self.cache, base_url=self.url)
+
+    def test_repeated_request_is_served_from_cache(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        path = self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assert_inca_file(path, "2021-07-01T00:00", "2021-07-02T00:00")
+
+    def test_sub_range_is_sliced_from_cache(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-10T00:00")
+        path = self.get_grid("2021-07-03T12:00", "2021-07-04T12:00")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assert_inca_file(path, "2021-07-03T12:00", "2021-07-04T12:00")
+
+    def test_range_is_assembled_from_several_entries(self):
+        self.get_grid("2021-07-01T12:00", "2021-07-02T12:00")
+        self.get_grid("2021-07-02T12:00", "2021-07-03T12:00")
+        path = self.get_grid("2021-07-02T00:00", "2021-07-03T00:00")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assert_inca_file(path, "2021-07-02T00:00", "2021-07-03T00:00")
+
+    def test_other_parameters_are_not_served(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        path = self.get_grid("2021-07-01T00:00", "2021-07-02T00:00", parameters=("T2M", "RH2M"))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assert_inca_file(path, "2021-07-01T00:00", "2021-07-02T00:00", "T2M")
+
+    def test_offline_mode(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        offline_cache = IncaGridCache(self.cache.cache_dir, offline=True)
+        self.get_grid("2021-07-01T06:00", "2021-07-01T18:00", cache=offline_cache)
+        with self.assertRaises(FileNotFoundError):
+            self.get_grid("2021-07-05T00:00", "2021-07-06T00:00", cache=offline_cache)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        entry_size = sum(os.path.getsize(os.path.join(self.cache.cache_dir, f))
+                         for f in os.listdir(self.cache.cache_dir) if f.endswith(".netcdf"))
+        self.cache.max_size_bytes = int(entry_size * 2.5)
+
+        self.get_grid("2021-07-03T00:00", "2021-07-04T00:00")
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        self.get_grid("2021-07-05T00:00", "2021-07-06T00:00")
+
+        # second entry was used least recently and had to make room for the third
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        self.get_grid("2021-07-03T00:00", "2021-07-04T00:00")
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_put_leaves_no_temporary_files(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        self.assertEqual(sorted(f.rsplit(".", 1)[-1] for f in os.listdir(self.cache.cache_dir)), ["json", "netcdf"])
+
+    def test_entries_are_read_without_lock_and_not_evicted(self):
+        self.get_grid("2021-07-01T00:00", "2021-07-02T00:00")
+        self.get_grid("2021-07-02T00:00", "2021-07-03T00:00")
+        self.cache.max_size_bytes = 1
+        lock_held, files_kept = [], []
+
+        def write_subset_and_put(sources, path_to_output, *args):
+            lock_held.append(self.cache._lock.locked())
+            # a concurrent download must not evict the entries that are being read
+            self.get_grid("2021-07-05T00:00", "2021-07-06T00:00")
+            files_kept.append(all(os.path.exists(path) for path, _, _ in sources))
+            write_netcdf_time_subset(sources, path_to_output, *args)
+
+        with mock.patch("src.data_collection.inca_cache.write_netcdf_time_subset", write_subset_and_put):
+            path = self.get_grid("2021-07-01T12:00", "2021-07-02T12:00")
+        self.assertEqual(lock_held, [False])
+        self.assertEqual(files_kept, [True])
+        self.assert_inca_file(path, "2021-07-01T12:00", "2021-07-02T12:00")
+        self.assertEqual(sum(self.cache._readers.values()), 0)
+
+
+class TestChunkedDownload(MockGeosphereTestCase):
+
+    def test_split_time_range(self):
+        windows = split_time_range("2021-07-01T00:00", "2021-07-03T12:00", 24)
+        self.assertEqual(windows, [("2021-07-01T00:00", "2021-07-01T23:00"),
+                                   ("2021-07-02T00:00", "2021-07-02T23:00"),
+                                   ("2021-07-03T00:00", "2021-07-03T12:00")])
+
+    def test_chunks_are_reassembled(self):
+        path = get_geosphere_data_grid_chunked(["RR", "T2M"], "2021-07-01T00:00", "2021-07-05T06:00", BBOX,
+                                               self.tmp_dir, chunk_hours=24, base_url=self.url)
+        self.assertEqual(len(self.server.requests), 5)
+        self.assert_inca_file(path, "2021-07-01T00:00", "2021-07-05T06:00")
+        self.assertEqual([f for f in os.listdir(self.tmp_dir) if "_chunk_" in f], [])
+
+    def test_chunks_are_removed_if_a_request_raises(self):
+        def get_grid_or_raise(parameters, start_date, end_date, *args):
+            if start_date.startswith("2021-07-03"):
+                raise ConnectionError("connection reset")
+            return get_geosphere_data_grid(parameters, start_date, end_date, *args)
+
+        with mock.patch("src.data_collection.inca_data_extraction.get_geosphere_data_grid", get_grid_or_raise):
+            with self.assertRaises(ConnectionError):
+                get_geosphere_data_grid_chunked(["RR"], "2021-07-01T00:00", "2021-07-05T06:00", BBOX,
+                                                self.tmp_dir, chunk_hours=24, max_workers=1, base_url=self.url)
+        self.assertGreater(len(self.server.requests), 0)
+        self.assertEqual([f for f in os.listdir(self.tmp_dir) if "_chunk_" in f], [])
+
+    def test_chunks_are_cached(self):
+        cache = IncaGridCache(os.path.join(self.tmp_dir, "cache"))
+        get_geosphere_data_grid_chunked(["RR"], "2021-07-01T00:00", "2021-07-03T23:00", BBOX, self.tmp_dir,
+                                        chunk_hours=24, cache=cache, base_url=self.url)
+        path = get_geosphere_data_grid(["RR"], "2021-07-01T12:00", "2021-07-02T12:00", BBOX, self.tmp_dir,
+                                       cache=cache, base_url=self.url)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assert_inca_file(path, "2021-07-01T12:00", "2021-07-02T12:00")
+
+
+class TestBatchedPointExtraction(MockGeosphereTestCase):
+
+    def test_events_are_batched_by_time_window(self):
+        events = pd.DataFrame({
+            "index": [10, 11, 12, 13, 14],
+            "date": ["2021-07-01", "2021-07-01", "2021-07-01", "2021-07-02", "2021-07-01"],
+            "lat": [47.1, 47.2, 47.3, 47.4, 47.5],
+            "lon": [13.1, 13.2, 13.3, 13.4, 13.5],
+        })
+
+        data = get_geosphere_data_points(events, ["T2M", "RH2M"], hours_before=3, max_locations_per_request=3,
+                                         base_url=self.url.replace("grid", "timeseries"))
+
+        # 2021-07-01: 4 events in 2 requests, 2021-07-02: 1 request
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(list(data.columns), ["event_id", "time", "T2M", "RH2M"])
+        self.assertEqual(len(data), 5 * 4)
+
+        event_13 = data[data.event_id == 13]
+        self.assertEqual(event_13.time.iloc[0], pd.Timestamp("2021-07-01T21:00"))
+        np.testing.assert_allclose(event_13.T2M, 47.4 + 1000 * np.arange(4))
+        np.testing.assert_allclose(data[data.event_id == 14].RH2M, 47.5 + 1000 * np.arange(4) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import pymc as pm
+from sklearn.preprocessing import StandardScaler
+
+from src.modeling.bayesian_models import create_st_blr
+from src.modeling.predictions import BLRPosteriorPredictor
+from src.modeling.utils import build_model_from_spec, load_idata, load_model_artifact, save_model, \
+    save_model_artifact
+from tests.test_predictions import COORDS, random_features, to_model_data
+
+BUILDER_KWARGS = {"spatial_grouping_variable": "spatial_group", "temporal_grouping_variable": "temporal_group"}
+
+
+class TestModelArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.X_train = random_features(50, 0)
+        self.y_train = pd.Series(np.zeros(len(self.X_train), dtype=int))
+        self.model = create_st_blr(self.X_train, self.y_train, COORDS, **BUILDER_KWARGS)
+        with self.model:
+            # prior samples including the training set deterministics z and p
+            self.idata = pm.sample_prior_predictive(samples=300, random_seed=0)
+        self.idata.add_groups(posterior=self.idata.prior)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save(self, **kwargs):
+        path_to_artifact = os.path.join(self.tmp_dir, "artifact")
+        save_model_artifact(path_to_artifact, self.idata, "create_st_blr", COORDS, BUILDER_KWARGS,
+                            preprocessor=StandardScaler().fit([[0.0], [1.0]]),
+                            encodings={"aspect": "convert_aspect_to_cardinal_direction"}, **kwargs)
+        return path_to_artifact
+
+    def test_round_trip(self):
+        artifact = load_model_artifact(self.save())
+        posterior = artifact["idata"].posterior
+
+        self.assertNotIn("z", posterior)
+        self.assertNotIn("p", posterior)
+        np.testing.assert_array_equal(posterior["beta_slope"].values, self.idata.posterior["beta_slope"].values)
+        self.assertEqual(artifact["spec"]["encodings"], {"aspect": "convert_aspect_to_cardinal_direction"})
+        self.assertEqual(artifact["preprocessor"].mean_, [0.5])
+
+        model = build_model_from_spec(artifact["spec"], self.X_train, self.y_train)
+        self.assertEqual(set(model.named_vars), set(self.model.named_vars))
+
+    def test_float32_predictions(self):
+        idata = load_idata(self.save(float32=True))
+        self.assertEqual(idata.posterior["beta_slope"].dtype, np.float32)
+
+        x_new = to_model_data(random_features(200, 1))
+        predictions = BLRPosteriorPredictor(idata, x_new).predict()
+        expected = BLRPosteriorPredictor(self.idata, x_new).predict()
+        np.testing.assert_allclose(predictions.p_pred, expected.p_pred, rtol=1e-5)
+
+    def test_posterior_is_loaded_lazily(self):
+        posterior = load_idata(self.save()).posterior
+        self.assertFalse(any(var._in_memory for var in posterior.data_vars.values()))
+
+    def test_load_pickled_model(self):
+        path_to_model = os.path.join(self.tmp_dir, "model.pkl")
+        save_model(path_to_model, self.model, self.idata)
+        self.assertIn("p", load_idata(path_to_model).posterior)
+
+
+if __name__ == "__main__":
+    unittest.main()
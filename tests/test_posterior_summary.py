@@ -0,0 +1,112 @@
+import unittest
+import tracemalloc
+import numpy as np
+import arviz as az
+from scipy.special import expit
+
+from src.modeling.posterior_summary import (
+    PosteriorSummaryReducer,
+    binary_entropy,
+    hdi_of_sorted_samples,
+    summarize_sorted_samples,
+)
+
+
+def random_z(n_draws: int, n_cells: int, seed: int = 0) -> np.array:
+    rng = np.random.default_rng(seed)
+    return rng.normal(rng.normal(0, 2, n_cells), rng.uniform(0.1, 1.5, n_cells), size=(n_draws, n_cells))
+
+
+class TestPosteriorSummary(unittest.TestCase):
+
+    def test_hdi_of_sorted_samples_matches_arviz(self):
+        samples = np.random.default_rng(0).gamma(2, size=(4, 1000))
+        hdi = hdi_of_sorted_samples(np.sort(samples, axis=1), 0.9)
+        for row, interval in zip(samples, hdi):
+            np.testing.assert_allclose(interval, az.hdi(row, hdi_prob=0.9))
+
+    def test_entropy_and_mutual_information(self):
+        np.testing.assert_allclose(binary_entropy(np.array([0, 0.5, 1])), [0, 1, 0])
+        # certain model: all samples equal, no epistemic uncertainty
+        p_sorted = np.array([[0.5] * 10, [0.0] * 5 + [1.0] * 5])
+        summary = summarize_sorted_samples(p_sorted)
+        np.testing.assert_allclose(summary.predictive_entropy, [1, 1])
+        np.testing.assert_allclose(summary.mutual_information, [0, 1])
+
+
+class TestPosteriorSummaryReducer(unittest.TestCase):
+
+    def assert_matches_exact_summary(self, z: np.array, reducer: PosteriorSummaryReducer, hdi_prob: float):
+        summary = reducer.summary()
+        z_sorted = np.sort(z.T, axis=1)
+        expected = summarize_sorted_samples(expit(z_sorted), z_sorted, hdi_prob=hdi_prob)
+        self.assertEqual(list(summary.columns), list(expected.columns))
+        for column in ["y_pred", "p_pred", "z_pred", "predictive_entropy", "mutual_information"]:
+            np.testing.assert_allclose(summary[column], expected[column], rtol=1e-10, atol=1e-12)
+
+        # binned hdi: as narrow as the exact one up to the bin width, within the draws and contains enough draws
+        bin_width = reducer.z_range / reducer.n_bins
+        np.testing.assert_array_less(np.abs(summary.z_hdi_width - expected.z_hdi_width), 2 * bin_width + 1e-12)
+        np.testing.assert_array_less(np.abs(summary.p_hdi_width - expected.p_hdi_width), bin_width / 2 + 1e-12)
+        self.assertTrue((summary.z_hdi_lower >= z.min(axis=0)).all() and (summary.z_hdi_upper <= z.max(axis=0)).all())
+        inside = (z >= summary.z_hdi_lower.values) & (z <= summary.z_hdi_upper.values)
+        self.assertTrue((inside.sum(axis=0) >= np.floor(hdi_prob * len(z)) + 1).all())
+
+    def test_matches_exact_summary(self):
+        z = random_z(4000, 300)
+        reducer = PosteriorSummaryReducer(z.shape[1], hdi_prob=0.9)
+        for start in range(0, len(z), 700):
+            reducer.update(z[start:start + 700])
+        self.assert_matches_exact_summary(z, reducer, 0.9)
+        # padded range of the first chunk mostly covers all draws, bins are a fraction of the posterior width
+        bin_width = reducer.z_range / reducer.n_bins
+        self.assertTrue((bin_width < z.std(axis=0) / 5).all())
+        self.assertLess(np.median(bin_width / z.std(axis=0)), 0.1)
+
+    def test_draws_outside_of_first_chunk_range(self):
+        rng = np.random.default_rng(1)
+        # first chunk is narrow, later chunks spread far to both sides
+        z = np.concatenate([rng.normal(0, 0.01, (5, 50)), rng.normal(0, 1, (500, 50)),
+                            rng.uniform(-60, 60, (20, 50)), rng.normal(30, 1, (300, 50))])
+        reducer = PosteriorSummaryReducer(z.shape[1], hdi_prob=0.5, n_bins=64)
+        for start in range(0, len(z), 5):
+            reducer.update(z[start:start + 5])
+        self.assertEqual(reducer.counts.sum(), z.size)
+        self.assertTrue((reducer.z_lower <= z.min(axis=0)).all())
+        self.assertTrue((reducer.z_lower + reducer.z_range >= z.max(axis=0)).all())
+        self.assert_matches_exact_summary(z, reducer, 0.5)
+
+    def test_equal_draws(self):
+        reducer = PosteriorSummaryReducer(2)
+        reducer.update(np.array([[1.0, -3.0]] * 10))
+        summary = reducer.summary()
+        np.testing.assert_allclose(summary.z_hdi_lower, [1, -3])
+        np.testing.assert_allclose(summary.z_hdi_upper, [1, -3])
+
+    def test_non_finite_draws(self):
+        with self.assertRaises(ValueError):
+            PosteriorSummaryReducer(2).update(np.array([[0.0, np.nan]]))
+        with self.assertRaises(ValueError):
+            PosteriorSummaryReducer(2, n_bins=15)
+
+    def peak_memory(self, n_cells: int, n_draws: int, draws_per_chunk: int) -> int:
+        rng = np.random.default_rng(2)
+        tracemalloc.start()
+        try:
+            reducer = PosteriorSummaryReducer(n_cells, hdi_prob=0.9)
+            for _ in range(n_draws // draws_per_chunk):
+                reducer.update(rng.normal(0, 1, (draws_per_chunk, n_cells)))
+            reducer.summary()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memory_does_not_grow_with_draws(self):
+        n_cells = 3000
+        peak = self.peak_memory(n_cells, 4000, 100)
+        self.assertLess(peak, 1.1 * self.peak_memory(n_cells, 1000, 100))
+        # a fraction of the dense draws x cells float64 tensor (96 MB)
+        self.assertLess(peak, 4000 * n_cells * 8 / 4)
+
+if __name__ == "__main__":
+    unittest.main()
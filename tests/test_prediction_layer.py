@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import cloudpickle
+import joblib
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import box
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import StandardScaler
+
+from src.data_preprocessing.feature_datacube import write_feature_datacube
+from src.modeling import encodings
+from src.modeling.bayesian_models import create_blr
+from scripts.create_prediction_layer import (
+    add_ffmc_layer,
+    create_prediction_layer_windowed,
+    load_static_layers_into_df,
+    make_predictions,
+    predict_with_predictor,
+    preprocess_data,
+    transform_features,
+)
+from tests.test_predictions import COORDS, fake_posterior, random_features
+
+GRID_SHAPE = (40, 37)
+TRANSFORM = from_origin(100000, 400000, 100, 100)
+# upper bound of the raw values of each layer, density layers are zero in about half of the cells
+LAYER_RANGES = {
+    "population_density": 2000, "farmyard_density": 5, "hikingtrail_density": 5, "forestroad_density": 5,
+    "railway_density": 5, "elevation": 3000, "slope": 60, "aspect": 360,
+}
+FFMC_TRAIN = np.array([70.0, 80.0, 85.0, 90.0, 95.0])
+
+
+def write_layer(path: str, data: np.array):
+    with rasterio.open(path, "w", driver="GTiff", height=data.shape[0], width=data.shape[1], count=1,
+                       dtype=data.dtype, crs="EPSG:31287", transform=TRANSFORM, nodata=-1) as dst:
+        dst.write(data, 1)
+
+
+class TestWindowedPredictionLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+
+        self.feature_layers = [("ref_grid_id", os.path.join(self.tmp_dir, "ref_grid_id.tif"))]
+        write_layer(self.feature_layers[0][1], np.arange(np.prod(GRID_SHAPE), dtype="int32").reshape(GRID_SHAPE))
+        for name, upper in LAYER_RANGES.items():
+            data = rng.uniform(0, upper, GRID_SHAPE).astype("float32")
+            if name.endswith("_density"):
+                data[rng.random(GRID_SHAPE) < 0.5] = 0
+            path = os.path.join(self.tmp_dir, f"{name}.tif")
+            write_layer(path, data)
+            self.feature_layers.append((name, path))
+        forest_type = rng.integers(0, 7, GRID_SHAPE).astype("int32")
+        forest_type[rng.random(GRID_SHAPE) < 0.3] = -1
+        # no forest in the first window
+        forest_type[:16, :16] = -1
+        self.feature_layers.append(("forest_type", os.path.join(self.tmp_dir, "forest_type.tif")))
+        write_layer(self.feature_layers[-1][1], forest_type)
+        self.path_to_ref_grid = self.feature_layers[0][1]
+
+        X_train = random_features(20, 0)
+        model = create_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS)
+        self.path_to_model = os.path.join(self.tmp_dir, "model.pkl")
+        with open(self.path_to_model, "wb") as buff:
+            cloudpickle.dump({"model": model, "idata": fake_posterior(model, 0)}, buff)
+        # preprocessor of the BLR training data, only ffmc is scaled
+        self.preprocessor = ColumnTransformer([("std_scaler", StandardScaler(), ["ffmc"])], remainder="drop")
+        self.preprocessor.fit(pd.DataFrame({"ffmc": FFMC_TRAIN, "elevation": FFMC_TRAIN}))
+        self.path_to_preprocessor = os.path.join(self.tmp_dir, "preprocessor.pkl")
+        joblib.dump(self.preprocessor, self.path_to_preprocessor)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def predict_full_grid(self, aoi_mask: np.array = None) -> np.array:
+        """p pred and hdi width of all cells predicted at once, -1 for cells that are not predicted"""
+
+        features_df = add_ffmc_layer(load_static_layers_into_df(self.feature_layers), 85)
+        selected = (features_df["forest_type"] != -1).values
+        if aoi_mask is not None:
+            selected &= aoi_mask.flatten()
+        preds = make_predictions(self.path_to_model, preprocess_data(self.path_to_preprocessor, features_df[selected]))
+
+        layers = np.full((2, selected.size), -1, dtype="float32")
+        layers[0, selected] = preds["p_pred"].values
+        layers[1, selected] = preds["p_hdi_width"].values
+        return layers.reshape(2, *GRID_SHAPE)
+
+    def assert_layer_equals(self, path_to_layer: str, expected: np.array):
+        with rasterio.open(path_to_layer) as src:
+            self.assertEqual(src.count, 2)
+            self.assertEqual(src.transform, TRANSFORM)
+            np.testing.assert_allclose(src.read(), expected, rtol=1e-6)
+
+    def test_features_are_encoded_into_training_classes(self):
+        features_df = add_ffmc_layer(load_static_layers_into_df(self.feature_layers), 85)
+        features_df = features_df[features_df["forest_type"] != -1]
+        predictor = mock.MagicMock()
+        predict_with_predictor(predictor, transform_features(self.preprocessor, features_df))
+        X_new_blr = predictor.with_data.call_args.args[0]
+
+        expected_classes = {
+            "elevation": features_df["elevation"].apply(encodings.convert_elevation_to_classes),
+            "slope": features_df["slope"].apply(encodings.convert_slope_to_classes),
+            "aspect": features_df["aspect"].apply(encodings.convert_aspect_to_cardinal_direction),
+            "population": features_df["population_density"].apply(encodings.convert_population_to_classes),
+            "forest_type": features_df["forest_type"],
+        }
+        for name in ["forestroad_density", "railway_density", "hikingtrail_density", "farmyard_density"]:
+            expected_classes[name] = features_df[name].apply(encodings.map_to_binary)
+        self.assertEqual(set(X_new_blr), set(expected_classes) | {"ffmc"})
+        for name, expected in expected_classes.items():
+            with self.subTest(feature=name):
+                np.testing.assert_array_equal(X_new_blr[name], expected.values)
+                self.assertGreater(len(np.unique(X_new_blr[name])), 1)
+        np.testing.assert_allclose(X_new_blr["ffmc"], (85 - FFMC_TRAIN.mean()) / FFMC_TRAIN.std())
+
+    def test_windowed_layer_matches_full_grid_layer(self):
+        path_to_windowed = os.path.join(self.tmp_dir, "windowed.tif")
+        create_prediction_layer_windowed(self.feature_layers, self.path_to_model, self.path_to_preprocessor,
+                                         self.path_to_ref_grid, path_to_windowed, ffmc_value=85,
+                                         block_size=16, max_workers=2)
+        self.assert_layer_equals(path_to_windowed, self.predict_full_grid())
+        with rasterio.open(path_to_windowed) as src:
+            self.assertTrue((src.read(window=((0, 16), (0, 16))) == -1).all())
+
+    def test_area_of_interest(self):
+        aoi_geometry = box(100500, 397000, 102000, 399500)
+        rows, cols = np.indices(GRID_SHAPE)
+        x, y = TRANSFORM * (cols + 0.5, rows + 0.5)
+        aoi_mask = (x > 100500) & (x < 102000) & (y > 397000) & (y < 399500)
+
+        expected = self.predict_full_grid(aoi_mask)
+        path_to_windowed = os.path.join(self.tmp_dir, "windowed.tif")
+        create_prediction_layer_windowed(self.feature_layers, self.path_to_model, self.path_to_preprocessor,
+                                         self.path_to_ref_grid, path_to_windowed, ffmc_value=85,
+                                         aoi_geometry=aoi_geometry, block_size=16, max_workers=1)
+        self.assert_layer_equals(path_to_windowed, expected)
+
+        # the same windows read from the feature datacube
+        path_to_datacube = os.path.join(self.tmp_dir, "datacube.nc")
+        path_to_datacube_layer = os.path.join(self.tmp_dir, "datacube_layer.tif")
+        write_feature_datacube(path_to_datacube, self.feature_layers, self.path_to_ref_grid, chunk_size=16)
+        create_prediction_layer_windowed([(name, name) for name, _ in self.feature_layers], self.path_to_model,
+                                         self.path_to_preprocessor, self.path_to_ref_grid, path_to_datacube_layer,
+                                         ffmc_value=85, aoi_geometry=aoi_geometry, block_size=16, max_workers=2,
+                                         path_to_datacube=path_to_datacube)
+        self.assert_layer_equals(path_to_datacube_layer, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
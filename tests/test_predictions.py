@@ -0,0 +1,292 @@
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pymc as pm
+import arviz as az
+
+from src.modeling.bayesian_models import create_blr, create_bnn, create_st_blr, create_st_intercept_blr
+from src.modeling.predictions import (
+    BinaryClassification,
+    BinaryClassificationBNN,
+    BLRPosteriorPredictor,
+    BNNPosteriorPredictor,
+    CompiledPredictor,
+    PatternPredictionCache,
+    find_unique_rows,
+)
+from src.modeling.training import BLR_DATA_COLUMNS
+
+COORDS = {
+    "elevation_classes": [0, 1, 2, 3, 4, 5],
+    "slope_classes": [0, 1, 2, 3, 4],
+    "aspect_classes": [0, 1, 2, 3, 4, 5, 6, 7],
+    "forest_type_classes": [0, 1, 2, 3, 4, 5, 6],
+    "population_classes": [0, 1, 2, 3, 4, 5],
+    "farmyard_density_classes": [0, 1],
+    "forestroad_density_classes": [0, 1],
+    "railway_density_classes": [0, 1],
+    "hikingtrail_density_classes": [0, 1],
+    "spatial_groups": [0, 1, 2],
+    "temporal_groups": [0, 1],
+}
+
+
+def random_features(n: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({
+        "elevation_encoded": rng.integers(0, 6, n),
+        "slope_encoded": rng.integers(0, 5, n),
+        "aspect_encoded": rng.integers(0, 8, n),
+        "forestroad_density_bin": rng.integers(0, 2, n),
+        "railway_density_bin": rng.integers(0, 2, n),
+        "hikingtrail_density_bin": rng.integers(0, 2, n),
+        "farmyard_density_bin": rng.integers(0, 2, n),
+        "population_encoded": rng.integers(0, 6, n),
+        "forest_type": rng.integers(0, 7, n),
+        "ffmc": rng.normal(0, 1, n),
+        "spatial_group": rng.integers(0, 3, n),
+        "temporal_group": rng.integers(0, 2, n),
+    })
+    return X
+
+
+def to_model_data(X: pd.DataFrame) -> dict:
+    return {
+        **{name: X[column] for name, column in BLR_DATA_COLUMNS.items()},
+        "fire": np.zeros(len(X), dtype=int),
+        "spatial_groups_idx": X.spatial_group,
+        "temporal_groups_idx": X.temporal_group,
+    }
+
+
+def fake_posterior(model: pm.Model, seed: int) -> az.InferenceData:
+    """prior samples with moderate coefficients stand in for a fitted posterior"""
+    with model:
+        prior = pm.sample_prior_predictive(samples=100, random_seed=seed)
+    posterior = prior.prior[[rv.name for rv in model.free_RVs]]
+    rng = np.random.default_rng(seed)
+    for var_name in posterior.data_vars:
+        posterior[var_name].values = rng.normal(0, 0.5, posterior[var_name].shape)
+    # coefficient deterministics (beta_<name>, non-centered coefficients) consistent with the free variables
+    var_names = [var.name for var in model.deterministics if var.name not in ["z", "p"]]
+    if var_names:
+        posterior = pm.compute_deterministics(posterior, var_names=var_names, model=model, merge_dataset=True,
+                                              progressbar=False)
+    return az.InferenceData(posterior=posterior)
+
+
+class TestBLRPosteriorPredictor(unittest.TestCase):
+
+    def assert_same_predictions(self, create_model, grouped: bool):
+        X_train, X_new = random_features(50, 0), random_features(300, 1)
+        y_train = pd.Series(np.random.default_rng(2).integers(0, 2, len(X_train)))
+        if grouped:
+            model = create_model(X_train, y_train, COORDS, "spatial_group", "temporal_group")
+        else:
+            model = create_model(X_train, y_train, COORDS)
+        trace = fake_posterior(model, 3)
+        x_new = to_model_data(X_new)
+        if not grouped:
+            del x_new["spatial_groups_idx"], x_new["temporal_groups_idx"]
+
+        expected_obj = BinaryClassification(model, trace, x_new, 0, "y_pred", "p", "z")
+        expected_obj.extend_trace()
+        expected = expected_obj.predict()
+        # small chunks, so that several chunks are processed
+        predictions = BLRPosteriorPredictor(trace, x_new, max_chunk_mb=0.5).predict()
+
+        self.assertEqual(list(predictions.columns), list(expected.columns))
+        pd.testing.assert_frame_equal(predictions, expected, check_dtype=False, rtol=1e-10, atol=1e-12)
+
+    def test_blr(self):
+        self.assert_same_predictions(create_blr, grouped=False)
+
+    def test_st_intercept_blr(self):
+        self.assert_same_predictions(create_st_intercept_blr, grouped=True)
+
+    def test_st_blr(self):
+        self.assert_same_predictions(create_st_blr, grouped=True)
+
+    def test_invalid_indices(self):
+        X_train = random_features(50, 0)
+        model = create_st_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS,
+                              "spatial_group", "temporal_group")
+        predictor = BLRPosteriorPredictor(fake_posterior(model, 3), to_model_data(random_features(20, 1)))
+        predictor.predict()
+        n_spatial_groups = len(COORDS["spatial_groups"])
+        for name, value in [("elevation", 0.5), ("slope", -1), ("forest_type", 7),
+                            ("spatial_groups_idx", n_spatial_groups), ("temporal_groups_idx", np.nan)]:
+            with self.subTest(name=name, value=value):
+                x_new = to_model_data(random_features(20, 1))
+                x_new[name] = x_new[name].astype(float).copy()
+                x_new[name].iloc[3] = value
+                with self.assertRaises(ValueError):
+                    predictor.with_data(x_new).predict()
+        # integer valued floats are valid indices
+        x_new = to_model_data(random_features(20, 1))
+        x_new["elevation"] = x_new["elevation"].astype(float)
+        pd.testing.assert_frame_equal(predictor.with_data(x_new).predict(), predictor.predict())
+
+    def test_aggregated_blr(self):
+        # n_trials of the aggregated training rows is replaced by one trial per new row
+        self.assert_same_predictions(lambda *args: create_blr(*args, aggregate=True), grouped=False)
+        self.assert_same_predictions(lambda *args: create_st_blr(*args, aggregate=True), grouped=True)
+
+    def test_streaming_prediction(self):
+        X_train, X_new = random_features(50, 0), random_features(300, 1)
+        model = create_st_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS,
+                              "spatial_group", "temporal_group")
+        predictor = BLRPosteriorPredictor(fake_posterior(model, 3), to_model_data(X_new), max_chunk_mb=0.5)
+        expected = predictor.predict()
+        predictions = predictor.predict(draws_per_chunk=30)
+
+        self.assertEqual(list(predictions.columns), list(expected.columns))
+        exact_columns = ["y_pred", "p_pred", "z_pred", "predictive_entropy", "mutual_information"]
+        pd.testing.assert_frame_equal(predictions[exact_columns], expected[exact_columns], check_dtype=False)
+        # binned p hdi, the bins are 1/128 of the (padded) range of the z draws of each cell
+        np.testing.assert_allclose(predictions.p_hdi_width, expected.p_hdi_width, atol=0.02)
+
+
+class TestPatternDeduplication(unittest.TestCase):
+
+    def setUp(self):
+        X_train = random_features(50, 0)
+        self.model = create_st_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS,
+                                   "spatial_group", "temporal_group")
+        self.trace = fake_posterior(self.model, 3)
+
+    def repeated_patterns(self, n_cells: int, seed: int) -> dict:
+        # few distinct patterns, static ffmc
+        X_new = random_features(40, seed).sample(n_cells, replace=True, random_state=seed)
+        X_new["ffmc"] = 0.85
+        return to_model_data(X_new)
+
+    def test_find_unique_rows(self):
+        rows, inverse = find_unique_rows([[1, 2, 1, 1], [0.5, 0.5, 0.5, np.nan]])
+        self.assertEqual(len(rows), 3)
+        np.testing.assert_array_equal(rows[inverse], [[1, 0.5], [2, 0.5], [1, 0.5], [1, np.nan]])
+
+    def test_deduplicated_predictions_match(self):
+        x_new = self.repeated_patterns(500, 1)
+        predictor = BLRPosteriorPredictor(self.trace, x_new)
+        pd.testing.assert_frame_equal(predictor.predict(deduplicate=True), predictor.predict())
+
+    def test_cache_is_reused(self):
+        cache = PatternPredictionCache()
+        predictor = BLRPosteriorPredictor(self.trace, {})
+        x_first, x_second = self.repeated_patterns(300, 1), self.repeated_patterns(300, 2)
+
+        predictor.with_data(x_first).predict(cache=cache)
+        n_cached = len(cache)
+        predictions = predictor.with_data(x_second).predict(cache=cache)
+
+        self.assertEqual(len(cache.dtypes), 1)
+        self.assertLessEqual(len(cache), n_cached + 40)
+        pd.testing.assert_frame_equal(predictions, predictor.with_data(x_second).predict())
+
+        # other posterior, other cache table
+        other_predictor = BLRPosteriorPredictor(fake_posterior(self.model, 4), x_second)
+        other_predictor.predict(cache=cache)
+        self.assertEqual(len(cache.dtypes), 2)
+
+    def test_cache_evicts_least_recently_used_patterns(self):
+        cache = PatternPredictionCache(max_patterns=30)
+        predictor = BLRPosteriorPredictor(self.trace, {})
+        x_first, x_second = self.repeated_patterns(300, 1), self.repeated_patterns(300, 2)
+        expected = predictor.with_data(x_second).predict()
+
+        for x_new in [x_first, x_second, x_first]:
+            predictor.with_data(x_new).predict(cache=cache)
+            self.assertEqual(len(cache), 30)
+        # the patterns of the last prediction are kept
+        settings_key = next(iter(cache.dtypes))
+        self.assertTrue(all(key[0] == settings_key for key in cache.rows))
+        pd.testing.assert_frame_equal(predictor.with_data(x_second).predict(cache=cache), expected)
+        with self.assertRaises(ValueError):
+            PatternPredictionCache(max_patterns=0)
+
+
+class TestCompiledPredictor(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_matches_posterior_predictive(self):
+        X_train, X_new = random_features(50, 0), random_features(300, 1)
+        model = create_st_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS,
+                              "spatial_group", "temporal_group")
+        trace = fake_posterior(model, 3)
+        x_new = to_model_data(X_new)
+
+        expected_obj = BinaryClassification(model, trace, x_new, 0, "y_pred", "p", "z")
+        expected_obj.extend_trace()
+        predictor = CompiledPredictor(model, trace, ["z", "p"], draws_per_call=30, max_chunk_mb=0.1)
+        # the predictor can be reused for other data
+        predictor.predict(to_model_data(random_features(10, 2)))
+        predictions = predictor.predict(x_new)
+
+        pd.testing.assert_frame_equal(predictions, expected_obj.predict(), check_dtype=False, rtol=1e-10)
+        self.assertFalse(predictor.posterior["beta_slope"].flags.writeable)
+
+    def test_bnn(self):
+        rng = np.random.default_rng(0)
+        X_train, X_new = rng.normal(size=(50, 4)), rng.normal(size=(200, 4))
+        model = create_bnn(X_train, rng.integers(0, 2, 50))
+        trace = fake_posterior(model, 0)
+
+        expected_obj = BinaryClassificationBNN(model, trace, X_new, 0, "y_pred", "p")
+        expected_obj.extend_trace()
+        expected = expected_obj.predict()
+        predictions = CompiledPredictor(model, trace, ["p"]).predict({"ann_input": X_new})
+
+        pd.testing.assert_frame_equal(predictions[expected.columns], expected, check_dtype=False, rtol=1e-5)
+
+    def test_compiled_function_is_cached_on_disk(self):
+        X_train = random_features(50, 0)
+        model = create_blr(X_train, pd.Series(np.zeros(len(X_train), dtype=int)), COORDS)
+        trace = fake_posterior(model, 3)
+        x_new = to_model_data(random_features(100, 1))
+
+        first = CompiledPredictor(model, trace, ["z", "p"], cache_dir=self.cache_dir)
+        second = CompiledPredictor(model, trace, ["z", "p"], cache_dir=self.cache_dir)
+        self.assertFalse(first.from_cache)
+        self.assertTrue(second.from_cache)
+        pd.testing.assert_frame_equal(second.predict(x_new), first.predict(x_new))
+
+
+class TestBNNPosteriorPredictor(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X_train, self.X_new = rng.normal(size=(50, 4)), rng.normal(size=(200, 4))
+        self.model = create_bnn(self.X_train, rng.integers(0, 2, 50))
+
+    def test_matches_posterior_predictive(self):
+        trace = fake_posterior(self.model, 0)
+        expected_obj = BinaryClassificationBNN(self.model, trace, self.X_new, 0, "y_pred", "p")
+        expected_obj.extend_trace()
+        expected = expected_obj.predict()
+
+        predictions = BNNPosteriorPredictor.from_trace(trace, max_chunk_mb=0.1).predict(self.X_new)
+
+        pd.testing.assert_frame_equal(predictions[expected.columns], expected, check_dtype=False, rtol=1e-5)
+
+    def test_samples_from_approximation(self):
+        with self.model:
+            approx = pm.fit(n=200, random_seed=0, progressbar=False)
+        predictor = BNNPosteriorPredictor.from_approximation(approx, draws=4000, random_seed=1)
+        self.assertEqual(predictor.weights[0].shape, (4000, 4, 10))
+        np.testing.assert_allclose(predictor.weights[3].mean(axis=0),
+                                   approx.groups[0].mean.eval()[approx.groups[0].ordering["w_3_out"][1]], atol=0.1)
+
+        expected = BNNPosteriorPredictor.from_trace(approx.sample(4000, random_seed=2)).predict(self.X_new)
+        np.testing.assert_allclose(predictor.predict(self.X_new).p_pred, expected.p_pred, atol=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.modeling.runner import get_blr_prediction_data, run_models, split_cores
+from src.modeling.utils import load_model_artifact
+from tests.test_predictions import COORDS
+from tests.test_training import random_training_data
+
+GROUPING_VARIABLES = {"spatial_grouping_variable": "spatial_group", "temporal_grouping_variable": "temporal_group"}
+BNN_FEATURES = ["elevation_encoded", "slope_encoded", "forest_type", "ffmc"]
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_split_cores(self):
+        self.assertEqual(split_cores(3, 8), [3, 3, 2])
+        self.assertEqual(split_cores(4, 2), [1, 1, 1, 1])
+        self.assertEqual(sum(split_cores(4, 10)), 10)
+
+    def test_prediction_data_of_grouped_models(self):
+        X = random_training_data(10, 0)
+        data = get_blr_prediction_data({"builder": "create_st_blr", "builder_kwargs": GROUPING_VARIABLES}, X)
+        self.assertIn("spatial_groups_idx", data)
+        self.assertNotIn("fire", data)
+        self.assertNotIn("spatial_groups_idx", get_blr_prediction_data({"builder": "create_blr"}, X))
+
+    def test_run_models(self):
+        train, test = random_training_data(300, 0), random_training_data(40, 1)
+        specs = [
+            {"name": "blr", "builder": "create_blr", "coords": COORDS, "backend": "pymc",
+             "fit_kwargs": {"draws": 20, "tune": 20, "chains": 2, "random_seed": 0}},
+            {"name": "st_blr", "builder": "create_stacked_blr", "coords": COORDS,
+             "builder_kwargs": {"grouping": "all", **GROUPING_VARIABLES}, "backend": "advi",
+             "fit_kwargs": {"draws": 20, "chains": 1, "n": 100, "random_seed": 0}},
+            {"name": "bnn", "builder": "create_bnn", "feature_columns": BNN_FEATURES, "backend": "advi",
+             "fit_kwargs": {"draws": 20, "chains": 1, "n": 100, "random_seed": 0}},
+        ]
+
+        predictions, fit_stats = run_models(specs, train, train.fire, test, self.tmp_dir, n_cores=2)
+
+        self.assertEqual(list(predictions), ["blr", "st_blr", "bnn"])
+        # numpy predictors for all models, the bnn predictions have the entropies of the blr predictions
+        self.assertIn("mutual_information", predictions["bnn"])
+        self.assertIn("mutual_information", predictions["blr"])
+        for spec in specs:
+            name = spec["name"]
+            self.assertEqual(len(predictions[name]), len(test))
+            self.assertTrue(predictions[name].p_pred.between(0, 1).all())
+            self.assertEqual(fit_stats[name]["backend"], spec["backend"])
+            self.assertEqual(load_model_artifact(os.path.join(self.tmp_dir, name))["spec"]["builder"], spec["builder"])
+            self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, f"{name}_test_predictions.csv")))
+
+
+if __name__ == "__main__":
+    unittest.main()
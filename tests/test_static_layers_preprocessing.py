@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+from src.data_preprocessing.static_layers_preprocessing import (
+    accumulate_area,
+    accumulate_length,
+    calculate_area,
+    calculate_length,
+    create_density_layer_raster,
+    create_density_layer_vector,
+)
+
+GRID_SHAPE = (30, 40)
+TRANSFORM = from_origin(100000, 400000, 100, 100)
+CRS = "EPSG:31287"
+
+
+def random_lines(n: int, seed: int) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(n):
+        start = rng.uniform([99500, 396500], [104500, 400500])
+        vertices = start + np.cumsum(rng.normal(0, 150, (rng.integers(2, 6), 2)), axis=0)
+        lines.append(shapely.LineString(vertices))
+    # line through cell corners
+    lines.append(shapely.LineString([(100000, 400000), (101000, 399000)]))
+    return gpd.GeoDataFrame(geometry=lines, crs=CRS)
+
+
+def random_polygons(n: int, seed: int) -> gpd.GeoDataFrame:
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([99800, 396800], [104200, 400200], (n, 2))
+    polygons = shapely.buffer(shapely.points(centers), rng.uniform(20, 400, n))
+    return gpd.GeoDataFrame(geometry=polygons, crs=CRS)
+
+
+def ref_grid_vector() -> gpd.GeoDataFrame:
+    rows, cols = np.indices(GRID_SHAPE).reshape(2, -1)
+    cells = shapely.box(TRANSFORM.c + cols * TRANSFORM.a, TRANSFORM.f + (rows + 1) * TRANSFORM.e,
+                        TRANSFORM.c + (cols + 1) * TRANSFORM.a, TRANSFORM.f + rows * TRANSFORM.e)
+    return gpd.GeoDataFrame({"index": np.arange(len(cells))}, geometry=cells, crs=CRS)
+
+
+class TestDensityLayerRaster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path_to_ref_grid = os.path.join(self.tmp_dir, "ref_grid.tif")
+        with rasterio.open(self.path_to_ref_grid, "w", driver="GTiff", height=GRID_SHAPE[0], width=GRID_SHAPE[1],
+                           count=1, dtype="uint8", crs=CRS, transform=TRANSFORM) as dst:
+            dst.write(np.ones(GRID_SHAPE, dtype="uint8"), 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def vector_density(self, input_layer: gpd.GeoDataFrame, density_function) -> np.array:
+        path = os.path.join(self.tmp_dir, "density_vector.shp")
+        create_density_layer_vector(input_layer, ref_grid_vector(), path, density_function)
+        density_layer = gpd.read_file(path)
+        density = np.zeros(GRID_SHAPE[0] * GRID_SHAPE[1])
+        density[density_layer["index"].values] = density_layer["density"].values
+        return density.reshape(GRID_SHAPE)
+
+    def raster_density(self, input_layer: gpd.GeoDataFrame, measure: str, tile_size: int) -> np.array:
+        path = os.path.join(self.tmp_dir, f"density_{measure}_{tile_size}.tif")
+        create_density_layer_raster(input_layer, self.path_to_ref_grid, path, measure, tile_size)
+        with rasterio.open(path) as src:
+            self.assertEqual(src.transform, TRANSFORM)
+            self.assertIsNone(src.nodata)
+            return src.read(1)
+
+    def test_length_matches_overlay(self):
+        lines = random_lines(40, 0)
+        expected = self.vector_density(lines, calculate_length)
+        for tile_size in (7, 1024):
+            with self.subTest(tile_size=tile_size):
+                np.testing.assert_allclose(self.raster_density(lines, "length", tile_size), expected, atol=1e-6)
+
+    def test_area_matches_overlay(self):
+        polygons = random_polygons(30, 1)
+        expected = self.vector_density(polygons, calculate_area)
+        for tile_size in (7, 1024):
+            with self.subTest(tile_size=tile_size):
+                np.testing.assert_allclose(self.raster_density(polygons, "area", tile_size), expected, atol=1e-6)
+
+    def test_totals(self):
+        # features inside the grid are fully accumulated
+        line = np.array([shapely.LineString([(100050, 399950), (103010, 397020), (100010, 399010)])])
+        np.testing.assert_allclose(accumulate_length(line, TRANSFORM, GRID_SHAPE).sum(), shapely.length(line[0]))
+        polygon = np.array([shapely.Point(102000, 398500).buffer(700)])
+        area = accumulate_area(polygon, TRANSFORM, GRID_SHAPE)
+        np.testing.assert_allclose(area.sum(), shapely.area(polygon[0]))
+        self.assertTrue((area <= 100 * 100 + 1e-6).all())
+
+    def test_line_on_cell_edge(self):
+        # counted once, the overlay adds it to the cells on both sides of the edge
+        line = np.array([shapely.LineString([(100200, 399000), (100200, 398000)])])
+        density = accumulate_length(line, TRANSFORM, GRID_SHAPE)
+        np.testing.assert_allclose(density.sum(), 1000)
+        np.testing.assert_allclose(density[10:20, 2], 100)
+
+    def test_line_on_tile_edge(self):
+        # tiles of 7 cells, lines on the edges between the first and second tile column and row
+        lines = gpd.GeoDataFrame(geometry=[
+            shapely.LineString([(100700, 399000), (100700, 398000)]),
+            shapely.LineString([(100300, 399300), (101300, 399300)]),
+            shapely.LineString([(100650, 399500), (100700, 399000), (100700, 398500), (100750, 398000)]),
+            # on the outer edge of the grid
+            shapely.LineString([(104000, 398000), (104000, 397000)]),
+        ], crs=CRS)
+        density = self.raster_density(lines, "length", 7)
+        np.testing.assert_allclose(density, self.raster_density(lines, "length", 1024), atol=1e-6)
+        np.testing.assert_allclose(density.sum(), shapely.length(lines.geometry.values).sum())
+        np.testing.assert_allclose(density[10:20, 7], 100 + np.array([100] * 5 + [np.hypot(10, 100)] * 5))
+        np.testing.assert_allclose(density[7, 7:13], 100)
+        np.testing.assert_allclose(density[20:30, 39], 100)
+
+    def test_lines_outside_grid(self):
+        line = np.array([shapely.LineString([(99500, 399950), (100500, 399950)])])
+        np.testing.assert_allclose(accumulate_length(line, TRANSFORM, GRID_SHAPE).sum(), 500)
+
+    def test_empty_input(self):
+        self.assertEqual(accumulate_length(np.array([], dtype=object), TRANSFORM, GRID_SHAPE).sum(), 0)
+        self.assertEqual(accumulate_area(np.array([], dtype=object), TRANSFORM, GRID_SHAPE).sum(), 0)
+
+    def test_unknown_measure(self):
+        with self.assertRaises(ValueError):
+            create_density_layer_raster(random_lines(2, 0), self.path_to_ref_grid,
+                                        os.path.join(self.tmp_dir, "density.tif"), "count")
+
+
+if __name__ == "__main__":
+    unittest.main()
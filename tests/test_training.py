@@ -0,0 +1,183 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from scipy import stats
+from pytensor.compile.sharedvalue import SharedVariable
+
+from src.modeling.bayesian_models import create_blr, create_st_intercept_blr
+from src.modeling.training import (
+    SAMPLER_BACKENDS,
+    ColumnarTrainingSet,
+    MinibatchFeeder,
+    add_posterior_as_prior,
+    check_backend,
+    fit,
+    fit_minibatch_advi,
+    get_blr_data_columns,
+    get_unconstrained_posterior,
+    get_warm_start_kwargs,
+    write_columnar_training_set,
+)
+from tests.test_predictions import COORDS, random_features
+
+
+def random_training_data(n: int, seed: int) -> pd.DataFrame:
+    """fires are much more likely in forest type 0"""
+    data = random_features(n, seed)
+    rng = np.random.default_rng(seed + 1)
+    data["fire"] = (rng.random(n) < np.where(data.forest_type == 0, 0.8, 0.1)).astype(int)
+    return data
+
+
+class TestMinibatchTraining(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = random_training_data(5000, 0)
+        chunks = (self.data.iloc[start:start + 1500] for start in range(0, len(self.data), 1500))
+        write_columnar_training_set(chunks, self.tmp_dir)
+        self.training_set = ColumnarTrainingSet(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_columnar_training_set(self):
+        self.assertEqual(len(self.training_set), 5000)
+        rows = self.training_set.read_rows(np.array([0, 10, 4999]))
+        pd.testing.assert_frame_equal(rows, self.data.iloc[[0, 10, 4999]].reset_index(drop=True))
+
+    def test_feeder_replaces_minibatch(self):
+        rng = np.random.default_rng(0)
+        batch = self.training_set.sample_batch(100, rng)
+        model = create_blr(batch, batch.fire, COORDS, total_size=len(self.training_set))
+        feeder = MinibatchFeeder(model, self.training_set, get_blr_data_columns(), 100, 1)
+
+        before = model["elevation"].get_value().copy()
+        feeder(None, None, 0)
+        after = model["elevation"].get_value()
+        self.assertEqual(after.shape, (100,))
+        self.assertFalse(np.array_equal(before, after))
+
+    def test_data_columns_match_data_containers(self):
+        model = create_st_intercept_blr(self.data, self.data.fire, COORDS, "spatial_group", "temporal_group")
+        data_columns = get_blr_data_columns(spatial_grouping_variable="spatial_group",
+                                            temporal_grouping_variable="temporal_group")
+        self.assertEqual(set(data_columns), {name for name, var in model.named_vars.items() if isinstance(var, SharedVariable)})
+        self.assertTrue(set(data_columns.values()) <= set(self.data.columns))
+
+    def test_likelihood_is_scaled_to_training_set(self):
+        batch = self.training_set.read_rows(np.arange(100))
+        full = create_blr(batch, batch.fire, COORDS)
+        scaled = create_blr(batch, batch.fire, COORDS, total_size=len(self.training_set))
+        point = full.initial_point()
+        loglike = full.compile_fn(full.observedlogp, inputs=full.value_vars)(point)
+        scaled_loglike = scaled.compile_fn(scaled.observedlogp, inputs=scaled.value_vars)(point)
+        self.assertAlmostEqual(float(scaled_loglike), float(loglike) * 50)
+
+    def test_fit_minibatch_advi(self):
+        def build_model(X, total_size):
+            return create_blr(X, X.fire, COORDS, total_size=total_size)
+
+        model, approx = fit_minibatch_advi(build_model, self.training_set, get_blr_data_columns(),
+                                           batch_size=200, n=3000, random_seed=0, progressbar=False)
+        self.assertEqual(len(model["fire"].get_value()), 200)
+        beta_forest_type = approx.sample(200, random_seed=0).posterior["beta_forest_type"].mean(("chain", "draw"))
+        self.assertGreater(float(beta_forest_type[0] - beta_forest_type[1:].mean()), 1)
+
+
+class TestFit(unittest.TestCase):
+
+    def setUp(self):
+        data = random_training_data(300, 0)
+        self.model = create_blr(data, data.fire, COORDS)
+
+    def assert_layout(self, idata, backend: str):
+        self.assertEqual(idata.posterior.sizes["chain"], 2)
+        self.assertEqual(idata.posterior.sizes["draw"], 30)
+        self.assertEqual(idata.posterior["beta_forest_type"].dims, ("chain", "draw", "forest_type_classes"))
+        self.assertEqual(idata.attrs["backend"], backend)
+        self.assertGreater(idata.attrs["sampling_time"], 0)
+        self.assertAlmostEqual(idata.attrs["ess_per_second"],
+                               idata.attrs["min_ess_bulk"] / idata.attrs["sampling_time"])
+
+    def test_pymc(self):
+        idata = fit(self.model, "pymc", draws=30, tune=30, chains=2, random_seed=0, cores=1)
+        self.assert_layout(idata, "pymc")
+
+    def test_advi_has_the_layout_of_nuts(self):
+        idata = fit(self.model, "advi", draws=30, chains=2, random_seed=0, n=200)
+        self.assert_layout(idata, "advi")
+        self.assertEqual(set(idata.posterior.data_vars), {var.name for var in self.model.free_RVs + self.model.deterministics})
+
+    def test_unknown_and_missing_backends(self):
+        with self.assertRaises(ValueError):
+            check_backend("other")
+        for backend in SAMPLER_BACKENDS:
+            try:
+                check_backend(backend)
+            except ImportError as error:
+                self.assertIn("pip install", str(error))
+
+
+class TestWarmStart(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = random_training_data(300, 0)
+        cls.idata = fit(cls.build(), "advi", draws=500, chains=1, n=1000, random_seed=0)
+
+    @classmethod
+    def build(cls, data=None):
+        data = cls.data if data is None else data
+        return create_st_intercept_blr(data, data.fire, COORDS, "spatial_group", "temporal_group")
+
+    def test_unconstrained_posterior(self):
+        model = self.build()
+        moments = get_unconstrained_posterior(model, self.idata)
+        sigma = self.idata.posterior["sigma_b1"].values.ravel()
+        np.testing.assert_allclose(moments[model["sigma_b1"]][0], np.log(sigma).mean())
+        self.assertEqual(moments[model["intercept"]][0].shape, (3, 2))
+
+        # coefficients of a new temporal group do not match the previous posterior
+        model = create_st_intercept_blr(self.data, self.data.fire, {**COORDS, "temporal_groups": [0, 1, 2]},
+                                        "spatial_group", "temporal_group")
+        moments = get_unconstrained_posterior(model, self.idata)
+        self.assertNotIn(model["intercept"], moments)
+        self.assertIn(model["beta_slope"], moments)
+
+    def test_nuts_starts_with_previous_mass_matrix(self):
+        model = self.build()
+        kwargs = get_warm_start_kwargs(model, self.idata, "pymc")
+        np.testing.assert_allclose(kwargs["initvals"]["sigma_b1"],
+                                   np.exp(np.log(self.idata.posterior["sigma_b1"].values).mean()))
+        variance = kwargs["step"].potential._var
+        self.assertEqual(len(variance), sum(value.size for value in model.initial_point().values()))
+        self.assertAlmostEqual(variance[0], self.idata.posterior["mu_b1"].values.var())
+
+        idata = fit(model, "pymc", draws=20, tune=20, chains=1, random_seed=0, warm_start=self.idata)
+        self.assertEqual(idata.posterior.sizes["draw"], 20)
+
+    def test_advi_starts_at_previous_posterior(self):
+        idata = fit(self.build(), "advi", draws=500, chains=1, n=1, random_seed=1, warm_start=self.idata)
+        np.testing.assert_allclose(idata.posterior["beta_slope"].mean(("chain", "draw")),
+                                   self.idata.posterior["beta_slope"].mean(("chain", "draw")), atol=0.2)
+
+    def test_posterior_as_prior(self):
+        model, updated = self.build(), add_posterior_as_prior(self.build(), self.idata)
+        point = model.initial_point()
+        point["mu_b1"], point["sigma_b1_log__"] = np.array(0.3), np.array(0.2)
+        difference = updated.compile_logp()(point) - model.compile_logp()(point)
+
+        mu = self.idata.posterior["mu_b1"].values.ravel()
+        log_sigma = np.log(self.idata.posterior["sigma_b1"].values.ravel())
+        expected = stats.norm(mu.mean(), mu.std()).logpdf(0.3) - stats.cauchy(0, 1).logpdf(0.3) + \
+            stats.lognorm(log_sigma.std(), scale=np.exp(log_sigma.mean())).logpdf(np.exp(0.2)) - \
+            stats.expon().logpdf(np.exp(0.2))
+        self.assertAlmostEqual(float(difference), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()